@@ -2,43 +2,140 @@ from django.contrib import admin
 from django.utils import timezone
 from django.contrib import messages
 from django.shortcuts import redirect, get_object_or_404
-from django.urls import path
+from django.urls import path, reverse
 from django.utils.html import format_html
-from .models import Class, Group, Student, Attendance, Teacher
+from django.core.exceptions import PermissionDenied
+from django.template.response import TemplateResponse
+from django.db.models import Count, Q
+from .models import Class, Group, Student, Attendance, AttendanceAudit, Teacher, OutboxEvent
+from . import jobs, retention, search, sharding
+
+class SoftDeleteAdminMixin:
+    """Admin deletes only mark rows; attendance is removed later by ``manage.py purge_attendance``."""
+    
+    def delete_model(self, request, obj):
+        retention.soft_delete(type(obj).objects.filter(pk=obj.pk))
+    
+    def delete_queryset(self, request, queryset):
+        retention.soft_delete(queryset)
+    
+    def get_deleted_objects(self, objs, request):
+        # не собираем каскад по всей посещаемости — на больших данных это минуты
+        objs = list(objs)
+        to_delete = [f'{obj} — attendance will be purged in the background' for obj in objs]
+        opts = self.model._meta
+        return to_delete, {opts.verbose_name_plural: len(objs)}, set(), []
+
 
 @admin.register(Class)
-class ClassAdmin(admin.ModelAdmin):
+class ClassAdmin(SoftDeleteAdminMixin, admin.ModelAdmin):
     list_display = ['name', 'code', 'student_count', 'created_at']
     search_fields = ['name', 'code']
     
+    def get_queryset(self, request):
+        # счётчики одним запросом вместо COUNT на каждую строку списка
+        return super().get_queryset(request).annotate(
+            student_total=Count('enrollments', filter=Q(enrollments__student__deleted_at__isnull=True)),
+        )
+    
     def student_count(self, obj):
-        return obj.students.count()
+        return obj.student_total
     student_count.short_description = 'Students'
 
 @admin.register(Group)
-class GroupAdmin(admin.ModelAdmin):
+class GroupAdmin(SoftDeleteAdminMixin, admin.ModelAdmin):
     list_display = ['code', 'name', 'classes_list', 'student_count']
     search_fields = ['code', 'name']
     # ВАЖНО: Это позволяет удобно добавлять предметы группе
     filter_horizontal = ['classes']
+    actions = ['provision_accounts']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('classes').annotate(
+            student_total=Count('students', filter=Q(students__deleted_at__isnull=True)),
+        )
     
     def classes_list(self, obj):
         return ', '.join(c.code for c in obj.classes.all()) or '—'
     classes_list.short_description = 'Subjects'
     
     def student_count(self, obj):
-        return obj.students.count()
+        return obj.student_total
     student_count.short_description = 'Students'
+    
+    @admin.action(description='Create accounts for students without one (credentials CSV)')
+    def provision_accounts(self, request, queryset):
+        # хеширование паролей долгое — не в веб-воркере, а в очереди заданий
+        job = jobs.enqueue('provision_accounts', {
+            'group_ids': list(queryset.values_list('id', flat=True)),
+        }, user=request.user)
+        messages.success(request, format_html(
+            'Accounts are being created by job #{}. Once it is done, download the credentials CSV '
+            '<a href="{}">here</a>. It can be downloaded only once: it is the only copy of the passwords.',
+            job.id, reverse('api_job_result', args=[job.id]),
+        ))
 
 @admin.register(Student)
-class StudentAdmin(admin.ModelAdmin):
+class StudentAdmin(SoftDeleteAdminMixin, admin.ModelAdmin):
     list_display = ['name', 'student_id', 'group', 'has_account']
     search_fields = ['name', 'student_id']
     list_filter = ['group']
+    search_limit = 500
+    change_list_template = 'admin/attendance/student/change_list.html'
     
     def has_account(self, obj):
-        return obj.user is not None
+        return obj.user_id is not None
     has_account.boolean = True
+    
+    def get_search_results(self, request, queryset, search_term):
+        # поиск по триграммному индексу вместо icontains по всей таблице
+        if not search_term.strip() or not search.enabled():
+            return super().get_search_results(request, queryset, search_term)
+        ids = search.search_ids(search_term, limit=self.search_limit)
+        return queryset.filter(id__in=ids), False
+    
+    def changelist_view(self, request, extra_context=None):
+        extra_context = {'shards_enabled': sharding.enabled(), **(extra_context or {})}
+        return super().changelist_view(request, extra_context)
+    
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path('all-shards/', self.admin_site.admin_view(self.all_shards_view), name='student_all_shards'),
+        ]
+        return custom_urls + urls
+    
+    def all_shards_view(self, request):
+        """Students of every institution shard, merged by name, with per-shard totals; superusers only."""
+        if not request.user.is_superuser:
+            raise PermissionDenied
+        term = request.GET.get('q', '').strip()
+        querysets = {}
+        totals = []
+        for alias in sharding.aliases():
+            students = Student.objects.using(alias).select_related('group').order_by('name', 'id')
+            if term:
+                with sharding.use(alias):
+                    students = students.filter(id__in=search.search_ids(term, limit=self.search_limit))
+            querysets[alias] = students
+            totals.append({
+                'shard': alias,
+                'classes': Class.objects.using(alias).count(),
+                'groups': Group.objects.using(alias).count(),
+                'students': Student.objects.using(alias).count(),
+                'teachers': Teacher.objects.using(alias).count(),
+            })
+        rows = sharding.merged(querysets, key=lambda student: (student.name, student.id), limit=self.search_limit)
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Students of all institutions',
+            'q': term,
+            'rows': rows,
+            'totals': totals,
+            'limit': self.search_limit,
+        }
+        return TemplateResponse(request, 'admin/attendance/student/all_shards.html', context)
 
 @admin.register(Teacher)
 class TeacherAdmin(admin.ModelAdmin):
@@ -46,6 +143,7 @@ class TeacherAdmin(admin.ModelAdmin):
     list_filter = ['status', 'department']
     search_fields = ['user__username', 'user__first_name', 'user__last_name']
     actions = ['approve_teachers', 'reject_teachers']
+    list_select_related = ['user']
     
     # ВАЖНО: Это возвращает "окошки" для выбора предметов и групп
     filter_horizontal = ['classes', 'groups']
@@ -63,13 +161,17 @@ class TeacherAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            class_total=Count('classes', distinct=True),
+            group_total=Count('groups', distinct=True),
+        )
+    
     def user_info(self, obj):
         return f"{obj.user.get_full_name()} ({obj.user.username})"
     
     def assigned_summary(self, obj):
-        c_count = obj.classes.count()
-        g_count = obj.groups.count()
-        return f"{c_count} Subjects, {g_count} Groups"
+        return f"{obj.class_total} Subjects, {obj.group_total} Groups"
     assigned_summary.short_description = 'Access'
 
     def status_badge(self, obj):
@@ -105,4 +207,26 @@ class TeacherAdmin(admin.ModelAdmin):
 @admin.register(Attendance)
 class AttendanceAdmin(admin.ModelAdmin):
     list_display = ['date', 'student', 'class_enrolled', 'status']
-    list_filter = ['date', 'class_enrolled', 'status']
\ No newline at end of file
+    list_filter = ['date', 'class_enrolled', 'status']
+
+@admin.register(AttendanceAudit)
+class AttendanceAuditAdmin(admin.ModelAdmin):
+    list_display = ['changed_at', 'student_id', 'class_id', 'date', 'old_status', 'new_status', 'actor', 'source']
+    list_filter = ['source', 'new_status']
+    list_select_related = ['actor']
+    
+    # журнал только для чтения
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'event_type', 'created_at', 'attempts', 'next_attempt_at', 'dispatched_at']
+    list_filter = ['event_type', 'dispatched_at']
+    readonly_fields = ['event_type', 'payload', 'created_at', 'attempts', 'next_attempt_at', 'dispatched_at', 'last_error']
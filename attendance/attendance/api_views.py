@@ -2,15 +2,21 @@ from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.http import FileResponse, HttpResponse
 from django.db.models import Q
+from django.core import signing
 from datetime import date
-from .models import Class, Student, Attendance
-from .serializers import ClassSerializer, StudentSerializer, AttendanceSerializer
+from .models import Class, Group, Student, Attendance, AttendanceCalendar, Job, VersionConflict
+from .serializers import ClassSerializer, StudentSerializer, AttendanceSerializer, JobSerializer
+from .views import get_teacher, get_student
+from . import audit, heatmap, changefeed, checkin, history, jobs, throttling, search, refcache, sharding, storage, trends
+from .idempotency import idempotent
 
 
 @api_view(['GET'])
 def api_attendance_list(request):
-    attendances = Attendance.objects.select_related('student', 'class_enrolled').all()
+    attendances = storage.attendances().select_related('student', 'class_enrolled')
     
     class_id = request.GET.get('class_id')
     if class_id:
@@ -32,7 +38,39 @@ def api_attendance_list(request):
     return Response(serializer.data)
 
 
+@api_view(['GET'])
+def api_attendance_changes(request):
+    """Delta feed: rows created/updated (``changes``) and deleted (``deleted``) after ``?since=<cursor>``."""
+    try:
+        since = int(request.GET.get('since', 0))
+        limit = min(int(request.GET.get('limit', changefeed.DEFAULT_LIMIT)), changefeed.MAX_LIMIT)
+    except (ValueError, TypeError):
+        return Response(
+            {'error': 'since and limit must be integers'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if since < 0 or limit < 1:
+        return Response(
+            {'error': 'since must be >= 0 and limit >= 1'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    upserts, tombstones, cursor, has_more = changefeed.read(
+        since=since,
+        limit=limit,
+        class_id=request.GET.get('class_id'),
+        student_id=request.GET.get('student_id'),
+    )
+    return Response({
+        'cursor': cursor,
+        'has_more': has_more,
+        'changes': AttendanceSerializer(upserts, many=True).data,
+        'deleted': [{'id': pk} for pk in tombstones],
+    })
+
+
 @api_view(['POST'])
+@idempotent
 def api_mark_attendance(request):
     student_id = request.data.get('student_id')
     class_id = request.data.get('class_id')
@@ -68,15 +106,28 @@ def api_mark_attendance(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    attendance, created = Attendance.objects.update_or_create(
-        student=student,
-        date=attendance_date,
-        class_enrolled=class_obj,
-        defaults={
-            'status': status_val,
-            'notes': request.data.get('notes', '')
-        }
-    )
+    notes = request.data.get('notes', '')
+    sessions = storage.sessions_for(class_obj.id, attendance_date, [student.group_id])
+    if (status_val == storage.implied_status(student, sessions) and not notes
+            and not Attendance.objects.filter(student=student, class_enrolled=class_obj, date=attendance_date).exists()):
+        # режим исключений: отметка совпадает с отметкой по умолчанию — строку не создаём
+        implied = storage.attendances().select_related('student', 'class_enrolled').get(
+            student=student, class_enrolled=class_obj, date=attendance_date,
+        )
+        return Response(AttendanceSerializer(implied).data, status=status.HTTP_200_OK)
+    
+    try:
+        attendance, created = Attendance.objects.update_or_create(
+            student=student,
+            date=attendance_date,
+            class_enrolled=class_obj,
+            defaults={
+                'status': status_val,
+                'notes': notes
+            }
+        )
+    except VersionConflict as exc:
+        return _conflict_response(exc.instance.pk)
     
     serializer = AttendanceSerializer(attendance)
     return Response(
@@ -85,7 +136,27 @@ def api_mark_attendance(request):
     )
 
 
+def _expected_version(request):
+    """Row version the client last saw: ``version`` in the body or an ``If-Match`` header."""
+    value = request.data.get('version') if hasattr(request.data, 'get') else None
+    if value is None:
+        value = request.META.get('HTTP_IF_MATCH', '').strip('"') or None
+    return int(value) if value is not None else None
+
+
+def _conflict_response(attendance_id):
+    current = Attendance.objects.select_related('student', 'class_enrolled').filter(id=attendance_id).first()
+    return Response(
+        {
+            'error': 'Attendance record was changed by someone else.',
+            'current': AttendanceSerializer(current).data if current else None,
+        },
+        status=status.HTTP_409_CONFLICT,
+    )
+
+
 @api_view(['GET', 'PUT', 'DELETE'])
+@idempotent
 def api_attendance_detail(request, attendance_id):
     try:
         attendance = Attendance.objects.select_related('student', 'class_enrolled').get(id=attendance_id)
@@ -99,7 +170,14 @@ def api_attendance_detail(request, attendance_id):
         serializer = AttendanceSerializer(attendance)
         return Response(serializer.data)
     
-    elif request.method == 'PUT':
+    try:
+        expected_version = _expected_version(request)
+    except (ValueError, TypeError):
+        return Response({'error': 'version must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    if expected_version is not None and expected_version != attendance.version:
+        return _conflict_response(attendance.id)
+    
+    if request.method == 'PUT':
         status_val = request.data.get('status', attendance.status)
         notes = request.data.get('notes', attendance.notes)
         
@@ -122,15 +200,370 @@ def api_attendance_detail(request, attendance_id):
         
         attendance.status = status_val
         attendance.notes = notes
-        attendance.save()
+        try:
+            with transaction.atomic(using=sharding.current()):
+                # UPDATE только изменённых полей и только если версия не изменилась
+                attendance.save()
+        except VersionConflict:
+            return _conflict_response(attendance.id)
         
         serializer = AttendanceSerializer(attendance)
         return Response(serializer.data)
     
     elif request.method == 'DELETE':
-        attendance.delete()
+        if expected_version is None:
+            attendance.delete()
+        elif not Attendance.objects.filter(id=attendance.id, version=expected_version).delete()[0]:
+            return _conflict_response(attendance.id)
         return Response(
             {'message': 'Attendance record deleted successfully'},
             status=status.HTTP_204_NO_CONTENT
         )
 
+
+def _student_access_error(request, student):
+    """Same rules as the student_detail page: students see themselves, teachers their groups."""
+    logged_student = get_student(request)
+    if logged_student:
+        if logged_student.id != student.id:
+            return Response({'error': 'You can only view your own attendance.'}, status=status.HTTP_403_FORBIDDEN)
+        return None
+    teacher = get_teacher(request)
+    if teacher and student.group_id not in refcache.teacher_scope(teacher)[1]:
+        return Response({'error': 'You do not have access to this student.'}, status=status.HTTP_403_FORBIDDEN)
+    return None
+
+
+def _calendar_year(request):
+    try:
+        return int(request.GET.get('year', date.today().year))
+    except (ValueError, TypeError):
+        return None
+
+
+def _calendar_response(rows, year):
+    return Response({
+        'year': year,
+        'months': [heatmap.decode(row) for row in rows],
+    })
+
+
+@api_view(['GET'])
+def api_student_calendar(request, student_id):
+    """Year heatmap of one student, optionally for a single subject (?class_id=)."""
+    student = get_object_or_404(Student, id=student_id)
+    denied = _student_access_error(request, student)
+    if denied:
+        return denied
+    
+    year = _calendar_year(request)
+    if year is None:
+        return Response({'error': 'Invalid year'}, status=status.HTTP_400_BAD_REQUEST)
+    rows = AttendanceCalendar.objects.filter(student=student, year=year)
+    class_id = request.GET.get('class_id')
+    if class_id:
+        if not class_id.isdigit():
+            return Response({'error': 'class_id must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        rows = rows.filter(class_enrolled_id=class_id)
+    return _calendar_response(rows, year)
+
+
+@api_view(['GET'])
+def api_group_calendar(request, group_id):
+    """Year heatmap for every student of a group, optionally for a single subject (?class_id=)."""
+    if get_student(request):
+        return Response({'error': 'Students cannot view group calendars.'}, status=status.HTTP_403_FORBIDDEN)
+    group = get_object_or_404(Group, id=group_id)
+    teacher = get_teacher(request)
+    if teacher and group.id not in refcache.teacher_scope(teacher)[1]:
+        return Response({'error': 'You do not have access to this group.'}, status=status.HTTP_403_FORBIDDEN)
+    
+    year = _calendar_year(request)
+    if year is None:
+        return Response({'error': 'Invalid year'}, status=status.HTTP_400_BAD_REQUEST)
+    rows = AttendanceCalendar.objects.filter(student__group=group, year=year)
+    class_id = request.GET.get('class_id')
+    if class_id:
+        if not class_id.isdigit():
+            return Response({'error': 'class_id must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        rows = rows.filter(class_enrolled_id=class_id)
+    return _calendar_response(rows, year)
+
+
+@api_view(['GET'])
+def api_trends(request):
+    """Present/late/absent per day, week or month for a subject and/or group over a date range."""
+    if get_student(request):
+        return Response({'error': 'Students cannot view attendance trends.'}, status=status.HTTP_403_FORBIDDEN)
+    granularity = request.GET.get('granularity', 'week')
+    if granularity not in trends.GRANULARITIES:
+        return Response({'error': 'granularity must be day, week or month'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        date_to = date.fromisoformat(request.GET.get('date_to', date.today().isoformat()))
+        date_from = date.fromisoformat(request.GET.get('date_from', date_to.replace(day=1, month=1).isoformat()))
+        class_id = int(request.GET['class_id']) if request.GET.get('class_id') else None
+        group_id = int(request.GET['group_id']) if request.GET.get('group_id') else None
+    except (ValueError, TypeError):
+        return Response({'error': 'Invalid parameters'}, status=status.HTTP_400_BAD_REQUEST)
+    if date_from > date_to:
+        return Response({'error': 'date_from must not be after date_to'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    group_ids = [group_id] if group_id else None
+    teacher = get_teacher(request)
+    if teacher:
+        # Преподаватель видит только свои предметы и свои группы
+        teacher_class_ids, teacher_group_ids = refcache.teacher_scope(teacher)
+        if class_id and class_id not in teacher_class_ids:
+            return Response({'error': 'You do not have access to this subject.'}, status=status.HTTP_403_FORBIDDEN)
+        if group_id and group_id not in teacher_group_ids:
+            return Response({'error': 'You do not have access to this group.'}, status=status.HTTP_403_FORBIDDEN)
+        if group_ids is None:
+            group_ids = sorted(teacher_group_ids)
+    
+    try:
+        buckets = trends.trends(date_from, date_to, granularity, class_id=class_id, group_ids=group_ids)
+    except ValueError as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({
+        'granularity': granularity,
+        'class_id': class_id,
+        'group_id': group_id,
+        'buckets': buckets,
+    })
+
+
+@api_view(['GET'])
+def api_checkin_token(request):
+    """Current self check-in token for a subject and group; the teacher's screen shows it as a QR code."""
+    teacher = get_teacher(request)
+    if not teacher:
+        return Response({'error': 'Only teachers can open self check-in.'}, status=status.HTTP_403_FORBIDDEN)
+    try:
+        class_id = int(request.GET['class_id'])
+        group_id = int(request.GET['group_id'])
+    except (KeyError, ValueError, TypeError):
+        return Response({'error': 'class_id and group_id are required'}, status=status.HTTP_400_BAD_REQUEST)
+    teacher_class_ids, teacher_group_ids = refcache.teacher_scope(teacher)
+    if class_id not in teacher_class_ids or group_id not in teacher_group_ids:
+        return Response({'error': 'You do not have access to this subject or group.'}, status=status.HTTP_403_FORBIDDEN)
+    if class_id not in refcache.group_class_ids(group_id):
+        return Response({'error': 'This group does not study this subject.'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({
+        'token': checkin.make_token(class_id, group_id),
+        'class_id': class_id,
+        'group_id': group_id,
+        'date': date.today(),
+        'expires_in': checkin.get_config()['TOKEN_TTL'],
+    })
+
+
+@api_view(['POST'])
+def api_checkin(request):
+    """Student self check-in with the token from the QR code. Stored asynchronously: 202 Accepted."""
+    student = get_student(request)
+    if not student:
+        return Response({'error': 'Only students can check in.'}, status=status.HTTP_403_FORBIDDEN)
+    token = request.data.get('token')
+    if not token:
+        return Response({'error': 'token is required'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        class_id, day = checkin.check_in(student, str(token))
+    except signing.SignatureExpired:
+        return Response({'error': 'This check-in code has expired, scan the current one.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    except signing.BadSignature:
+        return Response({'error': 'Invalid check-in code.'}, status=status.HTTP_400_BAD_REQUEST)
+    except PermissionError as e:
+        return Response({'error': str(e)}, status=status.HTTP_403_FORBIDDEN)
+    except checkin.BufferFull:
+        response = Response({'error': 'Too many check-ins right now, please retry.'},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        response['Retry-After'] = '1'
+        return response
+    return Response({'status': 'accepted', 'class_id': class_id, 'date': day}, status=status.HTTP_202_ACCEPTED)
+
+
+def _job_for_request(request, job_id):
+    """Job visible to the current user (its creator or staff), else None."""
+    job = get_object_or_404(Job, id=job_id)
+    if request.user.is_staff or (request.user.is_authenticated and job.created_by_id == request.user.id):
+        return job
+    return None
+
+
+@api_view(['POST'])
+def api_jobs(request):
+    """Enqueue a background job: {"kind": "export" | "range_report" | "rebuild_calendar" | ..., "params": {...}}."""
+    teacher = get_teacher(request)
+    if not (request.user.is_staff or teacher):
+        return Response({'error': 'Only teachers and staff can start jobs.'}, status=status.HTTP_403_FORBIDDEN)
+    
+    kind = request.data.get('kind')
+    params = dict(request.data.get('params') or {})
+    if kind in ('rebuild_calendar', 'provision_accounts') and not request.user.is_staff:
+        return Response({'error': 'Only staff can start this job.'}, status=status.HTTP_403_FORBIDDEN)
+    if kind in ('export', 'range_report'):
+        try:
+            params['class_id'] = int(params.get('class_id'))
+        except (ValueError, TypeError):
+            return Response({'error': 'class_id must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if teacher and not request.user.is_staff:
+            teacher_class_ids, teacher_group_ids = refcache.teacher_scope(teacher)
+            if params['class_id'] not in teacher_class_ids:
+                return Response({'error': 'You do not have access to this subject.'}, status=status.HTTP_403_FORBIDDEN)
+            params['group_ids'] = sorted(teacher_group_ids)
+    
+    try:
+        job = jobs.enqueue(kind, params, user=request.user)
+    except jobs.JobError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(['GET'])
+def api_job_detail(request, job_id):
+    job = _job_for_request(request, job_id)
+    if job is None:
+        return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(JobSerializer(job).data)
+
+
+@api_view(['GET'])
+def api_job_result(request, job_id):
+    job = _job_for_request(request, job_id)
+    if job is None or job.status != 'done' or not job.result_file:
+        return Response({'error': 'Result not available'}, status=status.HTTP_404_NOT_FOUND)
+    path = jobs.result_path(job)
+    if not path.exists():
+        return Response({'error': 'Result file is missing'}, status=status.HTTP_410_GONE)
+    if job.kind in jobs.DOWNLOAD_ONCE:
+        response = HttpResponse(path.read_bytes(), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="{job.result_file}"'
+        jobs.discard_result(job)
+        return response
+    return FileResponse(path.open('rb'), as_attachment=True, filename=job.result_file)
+
+
+@api_view(['GET'])
+def api_student_search(request):
+    """Typeahead over name and student ID; teachers only see students of their groups."""
+    teacher = get_teacher(request)
+    if not teacher and not request.user.is_staff:
+        return Response({'error': 'Only teachers and staff can search students.'}, status=status.HTTP_403_FORBIDDEN)
+    try:
+        limit = min(int(request.GET.get('limit', search.DEFAULT_LIMIT)), search.MAX_LIMIT)
+    except (ValueError, TypeError):
+        return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    group_ids = None
+    if teacher and not request.user.is_staff:
+        group_ids = sorted(refcache.teacher_scope(teacher)[1])
+    students = search.search(request.GET.get('q', ''), group_ids=group_ids, limit=max(limit, 1))
+    return Response({
+        'results': [
+            {'id': s.id, 'name': s.name, 'student_id': s.student_id, 'group': s.group.code}
+            for s in students
+        ],
+    })
+
+
+@api_view(['GET'])
+def api_student_history(request, student_id):
+    """Keyset-paginated history of a student, newest first.
+    
+    Filters: ``class_id``, ``date_from``, ``date_to``; pass ``cursor`` from the
+    previous page to get the next one.
+    """
+    student = get_object_or_404(Student, id=student_id)
+    denied = _student_access_error(request, student)
+    if denied:
+        return denied
+    
+    try:
+        date_from = date.fromisoformat(request.GET['date_from']) if request.GET.get('date_from') else None
+        date_to = date.fromisoformat(request.GET['date_to']) if request.GET.get('date_to') else None
+        limit = min(int(request.GET.get('limit', history.PAGE_SIZE)), history.MAX_PAGE_SIZE)
+    except (ValueError, TypeError):
+        return Response(
+            {'error': 'Invalid filter. Dates use YYYY-MM-DD, limit is an integer.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    attendances = history.history_queryset(
+        student,
+        class_id=request.GET.get('class_id'),
+        date_from=date_from,
+        date_to=date_to,
+    )
+    try:
+        rows, next_cursor = history.page(attendances, request.GET.get('cursor'), max(limit, 1))
+    except history.InvalidCursor as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({
+        'results': [history.row_data(row) for row in rows],
+        'next_cursor': next_cursor,
+    })
+
+
+@api_view(['GET'])
+def api_attendance_audit(request):
+    """Who changed which status and when, newest first.
+    
+    Filters: ``student_id`` and/or ``class_id`` (one is required), ``date``;
+    pass ``cursor`` from the previous page to get the next one.
+    """
+    if not request.user.is_authenticated:
+        return Response({'error': 'Authentication required.'}, status=status.HTTP_403_FORBIDDEN)
+    student_id = request.GET.get('student_id')
+    class_id = request.GET.get('class_id')
+    try:
+        student_id = int(student_id) if student_id else None
+        class_id = int(class_id) if class_id else None
+        day = date.fromisoformat(request.GET['date']) if request.GET.get('date') else None
+        cursor = int(request.GET['cursor']) if request.GET.get('cursor') else None
+        limit = min(int(request.GET.get('limit', audit.PAGE_SIZE)), audit.MAX_PAGE_SIZE)
+    except (ValueError, TypeError):
+        return Response(
+            {'error': 'Invalid filter. Ids, cursor and limit are integers, date is YYYY-MM-DD.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not student_id and not class_id:
+        return Response({'error': 'student_id or class_id is required.'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    student_ids = None
+    if student_id:
+        student = get_object_or_404(Student.all_objects, id=student_id)
+        denied = _student_access_error(request, student)
+        if denied:
+            return denied
+    elif get_student(request):
+        return Response({'error': 'You can only view your own attendance.'}, status=status.HTTP_403_FORBIDDEN)
+    teacher = get_teacher(request)
+    if teacher:
+        teacher_class_ids, teacher_group_ids = refcache.teacher_scope(teacher)
+        if class_id and class_id not in teacher_class_ids:
+            return Response({'error': 'You do not have access to this subject.'}, status=status.HTTP_403_FORBIDDEN)
+        if not student_id:
+            student_ids = Student.all_objects.filter(group_id__in=teacher_group_ids).values('id')
+    
+    rows, next_cursor = audit.history(
+        student_id=student_id, class_id=class_id, day=day, cursor=cursor, limit=max(limit, 1),
+        student_ids=student_ids,
+    )
+    return Response({
+        'results': [audit.row_data(row) for row in rows],
+        'next_cursor': next_cursor,
+    })
+
+
+@api_view(['GET'])
+def api_throttle_stats(request):
+    if not request.user.is_staff:
+        return Response({'error': 'Staff only.'}, status=status.HTTP_403_FORBIDDEN)
+    return Response(throttling.stats())
+
+
+@api_view(['GET'])
+def api_refcache_stats(request):
+    if not request.user.is_staff:
+        return Response({'error': 'Staff only.'}, status=status.HTTP_403_FORBIDDEN)
+    return Response(refcache.stats())
@@ -0,0 +1,163 @@
+"""Append-only audit trail of attendance status changes.
+
+Every created, changed or deleted mark gets an AttendanceAudit row: the
+attendance key (student, subject, day), old and new status, who did it and
+through what (``web``, ``api``, ``admin``, ``checkin``, ``system``).
+
+Entries are not written one by one. ``record`` registers them with
+``transaction.on_commit`` (so marks rolled back with a savepoint leave no
+entry) and collects the committed ones in a per-request buffer that
+``AuditMiddleware`` writes with a single bulk INSERT when the request ends:
+saving a 300-student roster adds one statement, not 300. Outside a request
+(management commands, the check-in flusher) each committed batch is written
+right away.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from django.db import transaction
+
+from . import sharding
+from .models import AttendanceAudit
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+_buffer = ContextVar('attendance_audit_buffer', default=None)
+
+
+class Buffer:
+    """Committed entries of one request, with its actor and source."""
+
+    def __init__(self, actor_id=None, source='system', request=None):
+        self._actor_id = actor_id
+        self.source = source
+        self.request = request
+        self.entries = []
+
+    @property
+    def actor_id(self):
+        # request.user загружается только если запрос действительно что-то изменил
+        user = getattr(self.request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return user.id
+        return self._actor_id
+
+    def flush(self):
+        entries, self.entries = self.entries, []
+        if entries:
+            AttendanceAudit.objects.bulk_create(entries)
+        return len(entries)
+
+
+@contextmanager
+def collect(actor_id=None, source='system', request=None):
+    """Buffer the entries committed inside the block and write them at its end."""
+    buffer = Buffer(actor_id, source, request)
+    token = _buffer.set(buffer)
+    try:
+        yield buffer
+    finally:
+        _buffer.reset(token)
+        buffer.flush()
+
+
+def source_for_path(path):
+    if path.startswith('/admin/'):
+        return 'admin'
+    if path.startswith('/api/'):
+        return 'api'
+    return 'web'
+
+
+def _committed(entries):
+    buffer = _buffer.get()
+    if buffer is None:
+        AttendanceAudit.objects.bulk_create(entries)
+    else:
+        buffer.entries.extend(entries)
+
+
+def entry(key, old_status, new_status, attendance_id=None, source=None, actor_id=None):
+    """Unsaved AttendanceAudit for ``key`` = (student_id, class_id, date); actor/source default to the request's."""
+    buffer = _buffer.get()
+    student_id, class_id, day = key
+    return AttendanceAudit(
+        attendance_id=attendance_id,
+        student_id=student_id,
+        class_id=class_id,
+        date=day,
+        old_status=old_status or '',
+        new_status=new_status or '',
+        actor_id=actor_id if actor_id is not None else (buffer.actor_id if buffer else None),
+        source=source or (buffer.source if buffer else 'system'),
+    )
+
+
+def record_many(entries):
+    """Queue entries; they are kept only if the current transaction commits."""
+    entries = [e for e in entries if e.old_status != e.new_status]
+    if entries:
+        transaction.on_commit(partial(_committed, entries), using=sharding.current())
+
+
+def record(previous, current, attendance_id=None):
+    """Audit a change between two ``Attendance.current_state()`` tuples (None for create/delete)."""
+    if previous and current and previous[:3] != current[:3]:
+        # ключ строки изменился: для истории это удаление старой отметки и новая отметка
+        record_many([
+            entry(previous[:3], previous[3], None, attendance_id),
+            entry(current[:3], None, current[3], attendance_id),
+        ])
+        return
+    state = current or previous
+    record_many([entry(
+        state[:3], previous[3] if previous else None, current[3] if current else None, attendance_id,
+    )])
+
+
+class AuditMiddleware:
+    """Attribute entries to the request's user and write them in one INSERT at the end of the request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with collect(source=source_for_path(request.path), request=request):
+            return self.get_response(request)
+
+
+def history(student_id=None, class_id=None, day=None, cursor=None, limit=PAGE_SIZE, student_ids=None):
+    """Entries newest first; return (rows, next_cursor). ``cursor`` is the id of the last row seen."""
+    entries = AttendanceAudit.objects.select_related('actor')
+    if student_id:
+        entries = entries.filter(student_id=student_id)
+    if class_id:
+        entries = entries.filter(class_id=class_id)
+    if student_ids is not None:
+        entries = entries.filter(student_id__in=student_ids)
+    if day:
+        entries = entries.filter(date=day)
+    if cursor:
+        entries = entries.filter(id__lt=cursor)
+    rows = list(entries.order_by('-id')[:limit + 1])
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1].id
+    return rows, None
+
+
+def row_data(entry):
+    return {
+        'id': entry.id,
+        'attendance_id': entry.attendance_id,
+        'student_id': entry.student_id,
+        'class_id': entry.class_id,
+        'date': entry.date.isoformat(),
+        'old_status': entry.old_status or None,
+        'new_status': entry.new_status or None,
+        'actor': entry.actor.username if entry.actor else None,
+        'source': entry.source,
+        'changed_at': entry.changed_at.isoformat(),
+    }
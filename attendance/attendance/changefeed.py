@@ -0,0 +1,123 @@
+"""Delta changes feed for offline clients.
+
+Every Attendance write appends an AttendanceChange row; its autoincrement id is
+the change sequence. A sync reads the log after the client's cursor, so its
+cost depends on what changed since then, not on the size of the table. In the
+``exceptions`` storage mode, sessions and ``compact()`` / ``expand()`` also log
+the (student, subject, day) keys whose implied rows they add or remove, and
+``read()`` loads rows through ``storage.attendances()``, so implied rows come
+out like stored ones.
+
+Ids are handed out when a row is inserted, not when its transaction commits:
+on PostgreSQL a change with a lower id can become visible after a higher one.
+The cursor therefore never moves past changes younger than ``SAFETY_WINDOW``
+seconds (longer than any write transaction). They are returned right away and
+again on the next read, which is harmless because every read returns the
+latest state of the row.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import AttendanceChange
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+
+DEFAULTS = {
+    'SAFETY_WINDOW': 30,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ATTENDANCE_CHANGEFEED', {})}
+
+
+def _settle_cutoff():
+    return timezone.now() - timedelta(seconds=get_config()['SAFETY_WINDOW'])
+
+
+def _change(instance, op):
+    return AttendanceChange(
+        attendance_id=instance.pk,
+        op=op,
+        student_id=instance.student_id,
+        class_id=instance.class_enrolled_id,
+        date=instance.date,
+    )
+
+
+def record_upsert(instance):
+    _change(instance, 'upsert').save()
+
+
+def record_delete(instance):
+    _change(instance, 'delete').save()
+
+
+def record_many(instances, op='upsert'):
+    AttendanceChange.objects.bulk_create([_change(instance, op) for instance in instances])
+
+
+def current_cursor():
+    """Last change id that no transaction still in progress can precede."""
+    last = (
+        AttendanceChange.objects.filter(changed_at__lt=_settle_cutoff())
+        .order_by('-id').values_list('id', flat=True).first()
+    )
+    return last or 0
+
+
+def _current_rows(lessons):
+    """Current rows (stored or implied, see storage.py) of {(class_id, date): student ids}."""
+    from . import storage
+
+    if not lessons:
+        return []
+    rows = Q()
+    for (class_id, day), student_ids in lessons.items():
+        rows |= Q(class_enrolled_id=class_id, date=day, student_id__in=student_ids)
+    return list(storage.attendances().filter(rows).select_related('student', 'class_enrolled').order_by('id'))
+
+
+def read(since=0, limit=DEFAULT_LIMIT, class_id=None, student_id=None):
+    """Return ``(upserts, tombstones, cursor, has_more)`` for changes after ``since``.
+    
+    Every change names a (student, subject, day) and the row id it affected.
+    The current row of each such key is returned in its latest state, also an
+    implied row of the ``exceptions`` storage mode (derived here on read); ids
+    that no longer hold the key are tombstones. ``cursor`` is the sequence
+    number to pass as ``since`` on the next call. It stops before the first
+    change of the page younger than ``SAFETY_WINDOW``, so those are read again
+    next time.
+    """
+    changes = AttendanceChange.objects.filter(id__gt=since)
+    if class_id:
+        changes = changes.filter(class_id=class_id)
+    if student_id:
+        changes = changes.filter(student_id=student_id)
+    page = list(changes.order_by('id').values_list(
+        'id', 'attendance_id', 'student_id', 'class_id', 'date', 'changed_at',
+    )[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    
+    cutoff = _settle_cutoff()
+    cursor = since
+    settled = True
+    touched = set()
+    lessons = defaultdict(set)
+    for seq, attendance_id, change_student_id, change_class_id, day, changed_at in page:
+        touched.add(attendance_id)
+        lessons[(change_class_id, day)].add(change_student_id)
+        settled = settled and changed_at < cutoff
+        if settled:
+            cursor = seq
+    upserts = _current_rows(lessons)
+    # удалённая строка, неявная строка, ставшая сохранённой (и наоборот), — всё это tombstone старого id
+    tombstones = sorted(touched - {a.id for a in upserts})
+    # страница из одних свежих изменений: курсор стоит, клиент придёт снова позже, а не сразу
+    return upserts, tombstones, cursor, has_more and settled
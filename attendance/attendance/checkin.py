@@ -0,0 +1,249 @@
+"""Self check-in by QR code, with a coalescing write buffer.
+
+The teacher's screen shows a QR code with a signed token for (subject, group,
+day) that expires after ``TOKEN_TTL`` seconds; students scan it and post the
+token to ``/api/checkin/``. The token is verified from its signature alone (no
+database lookup) and the check-in is appended to an in-process buffer.
+
+A whole hall scans within the same minute, so instead of hundreds of
+single-row writes a background flusher takes the buffer every
+``FLUSH_INTERVAL`` seconds (or as soon as ``MAX_BATCH`` check-ins are waiting),
+drops duplicates and writes it as one transaction: a bulk INSERT for students
+without a mark and one UPDATE turning ``absent`` into ``present``. Rows marked
+``present`` or ``late`` by the teacher are left alone. The hooks that
+``signals.py`` runs for single saves (change feed, outbox, calendar, trends, audit)
+are applied once per batch.
+
+Tokens and buffered check-ins carry the institution shard (``sharding.py``),
+so one flusher serves every shard of the process.
+
+A batch whose write fails is put back and retried with the next flush. After
+``MAX_RETRIES`` failures its check-ins are written one by one, so one bad row
+cannot hold up the rest; the ones that still fail are dropped and logged.
+
+The buffer lives in the worker process: check-ins accepted in the last
+``FLUSH_INTERVAL`` before a crash are lost (a clean shutdown flushes it).
+"""
+import atexit
+import logging
+import threading
+from collections import defaultdict
+from datetime import date
+
+from django.conf import settings
+from django.core import signing
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, transaction
+from django.db.models import F
+
+from . import audit, changefeed, heatmap, outbox, sharding, storage, trends
+from .models import Attendance, Student
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'TOKEN_TTL': 90,
+    'SALT': 'attendance.checkin',
+    'BUFFERED': True,  # False — писать каждую отметку сразу (для сравнения в loadtest_checkin)
+    'FLUSH_INTERVAL': 0.3,
+    'MAX_BATCH': 500,
+    'MAX_BUFFER': 20000,
+    'MAX_RETRIES': 3,  # неудачных записей пачки, после этого её отметки пишутся по одной
+}
+
+STATUS = 'present'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ATTENDANCE_CHECKIN', {})}
+
+
+class BufferFull(Exception):
+    pass
+
+
+# --- токены ---
+
+def make_token(class_id, group_id, day=None):
+    """Signed check-in token for a subject, group and day (today by default)."""
+    day = day or date.today()
+    return signing.dumps(
+        {'c': class_id, 'g': group_id, 'd': day.isoformat(), 's': sharding.current()},
+        salt=get_config()['SALT'],
+    )
+
+
+def read_token(token):
+    """(class_id, group_id, day) of a valid token; raises ``signing.BadSignature`` (incl. expired)."""
+    config = get_config()
+    data = signing.loads(token, salt=config['SALT'], max_age=config['TOKEN_TTL'])
+    if data.get('s', DEFAULT_DB_ALIAS) != sharding.current():
+        # тот же id предмета и группы в другом учреждении — чужой код
+        raise signing.BadSignature('Check-in code of another institution.')
+    return data['c'], data['g'], date.fromisoformat(data['d'])
+
+
+# --- запись пачкой ---
+
+def write_checkins(keys):
+    """Store ``(student_id, class_id, day)`` check-ins in one transaction; return (created, updated)."""
+    by_lesson = defaultdict(set)
+    for student_id, class_id, day in keys:
+        by_lesson[(class_id, day)].add(student_id)
+
+    created = updated = 0
+    touched = []
+    was_absent = set()
+    with transaction.atomic(using=sharding.current()):
+        for (class_id, day), student_ids in by_lesson.items():
+            lesson = Attendance.objects.filter(class_enrolled_id=class_id, date=day)
+            existing = dict(lesson.filter(student_id__in=student_ids).values_list('student_id', 'status'))
+            missing = [student_id for student_id in student_ids if student_id not in existing]
+            sessions = storage.sessions_for(class_id, day)
+            if sessions and missing:
+                # режим исключений: если сессия уже отмечает ученика присутствующим, писать нечего
+                missing = [
+                    student.id for student in Student.all_objects.filter(id__in=missing)
+                    if storage.implied_status(student, sessions) != STATUS
+                ]
+            absent = [student_id for student_id, status in existing.items() if status == 'absent']
+            # ignore_conflicts: если преподаватель успел создать строку сам, его отметка остаётся
+            created += len(Attendance.objects.bulk_create(
+                [Attendance(student_id=student_id, class_enrolled_id=class_id, date=day, status=STATUS)
+                 for student_id in missing],
+                ignore_conflicts=True,
+            ))
+            if absent:
+                updated += lesson.filter(student_id__in=absent, status='absent').update(
+                    status=STATUS, version=F('version') + 1,
+                )
+            if missing or absent:
+                touched += lesson.filter(student_id__in=missing + absent, status=STATUS)
+                was_absent.update((student_id, class_id, day) for student_id in absent)
+
+        if touched:
+            changefeed.record_many(touched, 'upsert')
+            outbox.record_many('attendance.saved', [outbox.attendance_payload(a) for a in touched])
+            heatmap.refresh({a.current_state() for a in touched})
+            audit.record_many([
+                audit.entry(a.current_state()[:3], 'absent' if a.current_state()[:3] in was_absent else None,
+                            STATUS, a.id, source='checkin')
+                for a in touched
+            ])
+    trends.invalidate({day for _, day in by_lesson})
+    return created, updated
+
+
+class CheckinBuffer:
+    """Pending check-ins of this process, keyed by (shard, student, subject, day)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.stats = {'accepted': 0, 'coalesced': 0, 'flushes': 0, 'written': 0, 'errors': 0, 'dropped': 0}
+
+    def add(self, student_id, class_id, day):
+        config = get_config()
+        key = (sharding.current(), student_id, class_id, day)
+        with self._lock:
+            if key in self._pending:
+                self.stats['coalesced'] += 1
+                return
+            if len(self._pending) >= config['MAX_BUFFER']:
+                raise BufferFull
+            self._pending[key] = 0  # неудачных попыток записи
+            self.stats['accepted'] += 1
+            size = len(self._pending)
+            if self._thread is None or not self._thread.is_alive():
+                self._start()
+        if size >= config['MAX_BATCH']:
+            self._wakeup.set()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='checkin-flusher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(get_config()['FLUSH_INTERVAL'])
+            self._wakeup.clear()
+            close_old_connections()
+            self.flush()
+
+    def flush(self):
+        """Write everything buffered so far; failed batches go back into the buffer (see ``MAX_RETRIES``)."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        by_shard = defaultdict(list)
+        for key in pending:
+            by_shard[key[0]].append(key)
+        config = get_config()
+        batch_size = config['MAX_BATCH']
+        batches = [
+            (alias, keys[start:start + batch_size])
+            for alias, keys in by_shard.items() for start in range(0, len(keys), batch_size)
+        ]
+        for alias, batch in batches:
+            if self._write(alias, batch):
+                continue
+            retry = [key for key in batch if pending[key] + 1 < config['MAX_RETRIES']]
+            exhausted = [key for key in batch if pending[key] + 1 >= config['MAX_RETRIES']]
+            if retry:
+                logger.warning('Check-in flush failed, %d check-ins re-queued', len(retry))
+                with self._lock:
+                    for key in retry:
+                        self._pending.setdefault(key, pending[key] + 1)
+            # исчерпавшие попытки пишем по одной: плохая строка не держит остальные
+            for key in exhausted:
+                if len(batch) == 1 or not self._write(alias, [key]):
+                    logger.error('Check-in dropped after %d failed writes: shard=%s student=%s class=%s day=%s',
+                                 pending[key] + 1, *key)
+                    with self._lock:
+                        self.stats['dropped'] += 1
+        return len(pending)
+
+    def _write(self, alias, batch):
+        try:
+            with sharding.use(alias):
+                write_checkins([key[1:] for key in batch])
+        except Exception:
+            logger.exception('Check-in write of %d check-ins failed', len(batch))
+            with self._lock:
+                self.stats['errors'] += 1
+            return False
+        with self._lock:
+            self.stats['flushes'] += 1
+            self.stats['written'] += len(batch)
+        return True
+
+
+buffer = CheckinBuffer()
+atexit.register(buffer.flush)
+
+
+def check_in(student, token):
+    """Validate ``token`` for ``student`` and record the check-in; return (class_id, day).
+
+    Raises ``signing.BadSignature`` for invalid or expired tokens, ``PermissionError``
+    if the token is for another group and ``BufferFull`` under overload.
+    """
+    class_id, group_id, day = read_token(token)
+    if student.group_id != group_id:
+        raise PermissionError('This check-in code is for another group.')
+    if get_config()['BUFFERED']:
+        buffer.add(student.id, class_id, day)
+    else:
+        write_checkins([(student.id, class_id, day)])
+    return class_id, day
+
+
+def stats():
+    with buffer._lock:
+        counters = dict(buffer.stats)
+        pending = len(buffer._pending)
+    return {**counters, 'pending': pending}
@@ -0,0 +1,20 @@
+"""System checks for settings that work but lose what the app relies on."""
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches, deploy=True)
+def check_refcache_backend(app_configs, **kwargs):
+    from . import refcache
+
+    alias = refcache.get_config()['CACHE_ALIAS']
+    backend = settings.CACHES.get(alias, {}).get('BACKEND', '')
+    if not backend.endswith('LocMemCache'):
+        return []
+    return [Warning(
+        f'ATTENDANCE_REFCACHE uses the per-process LocMemCache "{alias}".',
+        hint='Every worker process loads and keeps its own copy of the reference data. '
+             'Point CACHES["%s"] (or ATTENDANCE_REFCACHE["CACHE_ALIAS"]) at Redis or memcached '
+             'in production.' % alias,
+        id='attendance.W001',
+    )]
@@ -0,0 +1,79 @@
+"""Materialized subject enrolment.
+
+A student studies every subject of their group. Reading that through
+``Group.classes`` joins students, groups and the M2M table on every roster and
+count; the ``Enrollment`` table keeps the result as one row per (subject,
+student) with the student's group. ``signals.py`` keeps it in sync when a
+student is created or moves to another group and when subjects are added to or
+removed from a group. Bulk writes that bypass signals call ``sync_students`` /
+``sync_groups`` themselves; ``manage.py rebuild_enrollments`` recomputes the
+whole table.
+"""
+from django.db import connections, transaction
+from django.db.models import Exists, F, OuterRef, Q
+
+from . import sharding
+from .models import Enrollment, Group, Student
+
+BATCH_SIZE = 500
+
+
+def _sync(students, enrollments):
+    """Make ``enrollments`` match the subjects of the ``students``' groups; return (added, removed).
+
+    Set-based (one DELETE, one INSERT ... SELECT): a group of a thousand
+    students with a hundred subjects is a hundred thousand rows.
+    """
+    link = Group.classes.through.objects.filter(
+        group_id=OuterRef('student__group_id'), class_id=OuterRef('class_enrolled_id'),
+    )
+    stale = enrollments.filter(~Exists(link) | ~Q(group_id=F('student__group_id')))
+    links = Group.classes.through._meta.db_table
+    table = Enrollment._meta.db_table
+    members, params = students.order_by().values('id').query.sql_with_params()
+    with transaction.atomic(using=sharding.current()):
+        removed, _ = stale.delete()
+        with connections[sharding.current()].cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (class_enrolled_id, student_id, group_id)
+                SELECT link.class_id, student.id, student.group_id
+                FROM {Student._meta.db_table} student
+                JOIN {links} link ON link.group_id = student.group_id
+                WHERE student.id IN ({members})
+                  AND NOT EXISTS (
+                      SELECT 1 FROM {table} e WHERE e.class_enrolled_id = link.class_id AND e.student_id = student.id
+                  )
+                """,
+                params,
+            )
+            added = cursor.rowcount
+    return added, removed
+
+
+def sync_students(student_ids):
+    """Re-enrol students after they were created or moved to another group."""
+    return _sync(
+        Student.all_objects.filter(id__in=student_ids),
+        Enrollment.objects.filter(student_id__in=student_ids),
+    )
+
+
+def sync_groups(group_ids):
+    """Re-enrol the students of groups whose subjects changed."""
+    # и строки, оставшиеся у учеников группы от прежней группы (перевод без сигналов, update())
+    return _sync(
+        Student.all_objects.filter(group_id__in=group_ids),
+        Enrollment.objects.filter(Q(group_id__in=group_ids) | Q(student__group_id__in=group_ids)),
+    )
+
+
+def rebuild(batch_size=BATCH_SIZE):
+    """Recompute the whole table, ``batch_size`` groups at a time; return (added, removed)."""
+    added = removed = 0
+    group_ids = list(Group.all_objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(group_ids), batch_size):
+        batch_added, batch_removed = sync_groups(group_ids[start:start + batch_size])
+        added += batch_added
+        removed += batch_removed
+    return added, removed
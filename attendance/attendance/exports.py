@@ -0,0 +1,76 @@
+"""CSV exports and range reports, shared by the inline views and the background jobs."""
+import csv
+from collections import Counter
+
+from . import storage
+from .models import Class
+
+CHUNK_SIZE = 1000
+
+
+def _noop_progress(done, total):
+    pass
+
+
+def export_queryset(class_id, date_from, date_to, group_ids=None):
+    attendances = storage.attendances().filter(
+        class_enrolled_id=class_id,
+        date__gte=date_from,
+        date__lte=date_to,
+    )
+    if group_ids is not None:
+        attendances = attendances.filter(student__group_id__in=group_ids)
+    return attendances
+
+
+def write_export(fh, class_id, date_from, date_to, group_ids=None, progress=_noop_progress):
+    """Every attendance record of a subject in a date range, one CSV row each."""
+    attendances = export_queryset(class_id, date_from, date_to, group_ids)
+    total = attendances.count()
+    progress(0, total)
+    writer = csv.writer(fh)
+    writer.writerow(['date', 'subject', 'student_id', 'student_name', 'group', 'status', 'notes'])
+    rows = attendances.order_by('date', 'student__name').values_list(
+        'date', 'class_enrolled__code', 'student__student_id', 'student__name',
+        'student__group__code', 'status', 'notes',
+    )
+    done = 0
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        writer.writerow(row)
+        done += 1
+        if done % CHUNK_SIZE == 0:
+            progress(done, total)
+    progress(total, total)
+    return total
+
+
+def write_range_report(fh, class_id, date_from, date_to, group_ids=None, progress=_noop_progress):
+    """Per-student present/late/absent totals of a subject over a date range."""
+    class_obj = Class.objects.get(id=class_id)
+    students = class_obj.students.select_related('group')
+    if group_ids is not None:
+        students = students.filter(group_id__in=group_ids)
+    students = list(students)
+    progress(0, len(students))
+
+    counts = Counter()
+    rows = export_queryset(class_id, date_from, date_to, group_ids).values_list('student_id', 'status')
+    for student_id, status in rows.iterator(chunk_size=CHUNK_SIZE):
+        counts[student_id, status] += 1
+
+    writer = csv.writer(fh)
+    writer.writerow(['student_id', 'student_name', 'group', 'present', 'late', 'absent', 'total', 'percent'])
+    for done, student in enumerate(students, 1):
+        present = counts[student.id, 'present']
+        late = counts[student.id, 'late']
+        absent = counts[student.id, 'absent']
+        total = present + late + absent
+        writer.writerow([
+            student.student_id, student.name, student.group.code,
+            present, late, absent, total,
+            round(100 * present / total, 1) if total else 0,
+        ])
+        if done % CHUNK_SIZE == 0:
+            progress(done, len(students))
+    progress(len(students), len(students))
+    return len(students)
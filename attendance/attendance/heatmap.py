@@ -0,0 +1,142 @@
+"""Calendar heatmap store: one packed bitmap row per (student, class, month).
+
+A whole year for one student and subject is at most 12 small rows, so a group
+calendar is a single query instead of loading every Attendance instance.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+
+from . import sharding, storage
+from .models import AttendanceCalendar
+
+STATUS_BITS = {
+    'present': 'present_bits',
+    'late': 'late_bits',
+}
+
+
+def day_mask(day):
+    return 1 << (day.day - 1)
+
+
+def _row_key(student_id, class_id, day):
+    return (student_id, class_id, day.year, day.month)
+
+
+def record_change(old, new):
+    """Apply an Attendance transition to the bitmaps.
+
+    ``old`` and ``new`` are ``(student_id, class_id, date, status)`` tuples
+    (``None`` for inserts / deletes respectively).
+    """
+    if old == new:
+        return
+    # per row: {column: (bits_to_clear, bits_to_set)}
+    changes = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+    if old is not None:
+        student_id, class_id, day, status = old
+        mask = day_mask(day)
+        row = changes[_row_key(student_id, class_id, day)]
+        for column in ('marked_bits', 'present_bits', 'late_bits'):
+            row[column][0] |= mask
+    if new is not None:
+        student_id, class_id, day, status = new
+        mask = day_mask(day)
+        row = changes[_row_key(student_id, class_id, day)]
+        row['marked_bits'][1] |= mask
+        if status in STATUS_BITS:
+            row[STATUS_BITS[status]][1] |= mask
+    for (student_id, class_id, year, month), columns in changes.items():
+        AttendanceCalendar.objects.get_or_create(
+            student_id=student_id, class_enrolled_id=class_id, year=year, month=month,
+        )
+        AttendanceCalendar.objects.filter(
+            student_id=student_id, class_enrolled_id=class_id, year=year, month=month,
+        ).update(**{
+            column: F(column).bitand(~clear).bitor(set_)
+            for column, (clear, set_) in columns.items()
+        })
+
+
+def rebuild(attendances):
+    """Recompute bitmaps from Attendance rows (e.g. ``storage.attendances().filter(...)``)."""
+    rows = defaultdict(lambda: {'marked_bits': 0, 'present_bits': 0, 'late_bits': 0})
+    for student_id, class_id, day, status in attendances.values_list(
+        'student_id', 'class_enrolled_id', 'date', 'status'
+    ).iterator():
+        row = rows[_row_key(student_id, class_id, day)]
+        mask = day_mask(day)
+        row['marked_bits'] |= mask
+        if status in STATUS_BITS:
+            row[STATUS_BITS[status]] |= mask
+    AttendanceCalendar.objects.bulk_create(
+        [
+            AttendanceCalendar(
+                student_id=student_id, class_enrolled_id=class_id, year=year, month=month, **bits
+            )
+            for (student_id, class_id, year, month), bits in rows.items()
+        ],
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['student', 'class_enrolled', 'year', 'month'],
+        update_fields=['marked_bits', 'present_bits', 'late_bits'],
+    )
+    return len(rows)
+
+
+def refresh(states):
+    """Recompute the month rows touched by ``(student_id, class_id, date, status)`` states (bulk writes)."""
+    months = defaultdict(set)
+    for student_id, class_id, day, status in states:
+        months[(class_id, day.year, day.month)].add(student_id)
+    with transaction.atomic(using=sharding.current()):
+        for (class_id, year, month), student_ids in months.items():
+            # rebuild() пишет только месяцы, где остались отметки: удалённая последняя отметка
+            # иначе осталась бы в битах, поэтому сначала убираем строки месяца целиком
+            AttendanceCalendar.objects.filter(
+                class_enrolled_id=class_id, year=year, month=month, student_id__in=student_ids,
+            ).delete()
+            rebuild(storage.attendances().filter(
+                class_enrolled_id=class_id, date__year=year, date__month=month, student_id__in=student_ids,
+            ))
+
+
+def rebuild_all():
+    with transaction.atomic(using=sharding.current()):
+        AttendanceCalendar.objects.all().delete()
+        return rebuild(storage.attendances())
+
+
+def bits_to_days(bits):
+    """Day numbers (1-based) of the set bits, lowest first.
+
+    Peels off the lowest set bit each step (``bits & -bits``), so the cost is
+    proportional to the number of marked days, not to the month length.
+    """
+    days = []
+    while bits:
+        lowest = bits & -bits
+        days.append(lowest.bit_length())
+        bits ^= lowest
+    return days
+
+
+def decode(row):
+    """Turn one AttendanceCalendar row into day lists per status."""
+    present = row.present_bits
+    late = row.late_bits
+    absent = row.marked_bits & ~(present | late)
+    return {
+        'student': row.student_id,
+        'class_id': row.class_enrolled_id,
+        'year': row.year,
+        'month': row.month,
+        'present': bits_to_days(present),
+        'late': bits_to_days(late),
+        'absent': bits_to_days(absent),
+        'present_count': present.bit_count(),
+        'late_count': late.bit_count(),
+        'absent_count': absent.bit_count(),
+    }
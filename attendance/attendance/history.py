@@ -0,0 +1,67 @@
+"""Keyset-paginated attendance history of a student.
+
+Pages are ordered by ``(date, id)`` descending and continue from a cursor of
+the last row, so fetching page N costs the same as fetching page 1 no matter
+how long the history is.
+"""
+from datetime import date
+
+from django.db.models import Q
+from django.utils.dateformat import format as format_date
+
+from . import storage
+
+PAGE_SIZE = 25
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def make_cursor(attendance):
+    return f'{attendance.date.isoformat()}.{attendance.id}'
+
+
+def parse_cursor(value):
+    try:
+        day, pk = value.split('.')
+        return date.fromisoformat(day), int(pk)
+    except (ValueError, AttributeError):
+        raise InvalidCursor(f'Invalid cursor: {value!r}')
+
+
+def history_queryset(student, class_id=None, date_from=None, date_to=None):
+    attendances = storage.attendances().filter(student=student).select_related('class_enrolled')
+    if class_id:
+        attendances = attendances.filter(class_enrolled_id=class_id)
+    if date_from:
+        attendances = attendances.filter(date__gte=date_from)
+    if date_to:
+        attendances = attendances.filter(date__lte=date_to)
+    return attendances
+
+
+def page(attendances, cursor=None, limit=PAGE_SIZE):
+    """Return ``(rows, next_cursor)``; ``next_cursor`` is None on the last page."""
+    if cursor:
+        day, pk = parse_cursor(cursor)
+        attendances = attendances.filter(Q(date__lt=day) | Q(date=day, id__lt=pk))
+    rows = list(attendances.order_by('-date', '-id')[:limit + 1])
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, make_cursor(rows[-1])
+    return rows, None
+
+
+def row_data(attendance):
+    return {
+        'id': attendance.id,
+        'date': attendance.date.isoformat(),
+        'date_display': format_date(attendance.date, 'M d, Y'),
+        'class_id': attendance.class_enrolled_id,
+        'class_name': attendance.class_enrolled.name,
+        'status': attendance.status,
+        'status_display': attendance.get_status_display(),
+        'notes': attendance.notes,
+    }
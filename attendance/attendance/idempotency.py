@@ -0,0 +1,159 @@
+"""``Idempotency-Key`` support for the attendance write API.
+
+A client that may retry a write sends a unique ``Idempotency-Key`` header. The
+first request with a key reserves an IdempotencyKey row, runs the view and
+stores its status code and JSON body. Repeats of the same key (same client,
+method and path) get the stored response back without running the view; a
+repeat that arrives while the first one is still running waits for it.
+Reusing a key with a different body is rejected with 422.
+
+Rows expire after ``TTL`` seconds and are purged opportunistically.
+"""
+import functools
+import hashlib
+import json
+import random
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import sharding
+from .models import IdempotencyKey
+
+DEFAULTS = {
+    'HEADER': 'HTTP_IDEMPOTENCY_KEY',
+    'TTL': 24 * 3600,
+    'WAIT_TIMEOUT': 10,
+    'PENDING_TIMEOUT': 60,
+    'PURGE_PROBABILITY': 0.01,
+}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+MAX_KEY_LENGTH = 255
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ATTENDANCE_IDEMPOTENCY', {})}
+
+
+def _client(request):
+    if request.user and request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f'ip:{request.META.get("REMOTE_ADDR", "")}'
+
+
+def key_hash(request, key):
+    scope = f'{_client(request)}\n{request.method}\n{request.path}\n{key}'
+    return hashlib.sha256(scope.encode()).hexdigest()
+
+
+def request_hash(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def purge_expired():
+    return IdempotencyKey.objects.filter(expires_at__lt=timezone.now()).delete()[0]
+
+
+def _reserve(config, hashed, body_hash):
+    """Create the pending row; return None if we own it, else the existing row."""
+    now = timezone.now()
+    while True:
+        try:
+            with transaction.atomic(using=sharding.current()):
+                IdempotencyKey.objects.create(
+                    key_hash=hashed,
+                    request_hash=body_hash,
+                    expires_at=now + timedelta(seconds=config['TTL']),
+                )
+            return None
+        except IntegrityError:
+            pass
+        existing = IdempotencyKey.objects.filter(key_hash=hashed).first()
+        if existing is None:
+            continue  # строку только что удалили — пробуем занять снова
+        stale = existing.is_pending and existing.created_at < now - timedelta(seconds=config['PENDING_TIMEOUT'])
+        if existing.expires_at < now or stale:
+            # истёкший ключ или «зависший» запрос упавшего воркера — начинаем заново
+            IdempotencyKey.objects.filter(id=existing.id).delete()
+            continue
+        return existing
+
+
+def _wait(config, record):
+    deadline = time.monotonic() + config['WAIT_TIMEOUT']
+    delay = 0.05
+    while record is not None and record.is_pending and time.monotonic() < deadline:
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+        record = IdempotencyKey.objects.filter(id=record.id).first()
+    return record
+
+
+def _replay(record):
+    response = Response(record.response, status=record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """Decorator for DRF function views (put it under ``@api_view``)."""
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        config = get_config()
+        key = request.META.get(config['HEADER'])
+        if not key or request.method in SAFE_METHODS:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'error': f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        hashed = key_hash(request, key)
+        body_hash = request_hash(request)
+        existing = _reserve(config, hashed, body_hash)
+        if existing is not None:
+            if existing.request_hash != body_hash:
+                return Response(
+                    {'error': 'Idempotency-Key was already used with a different request body'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            existing = _wait(config, existing)
+            if existing is None:
+                # первый запрос завершился ошибкой и освободил ключ — выполняем сами
+                return wrapper(request, *args, **kwargs)
+            if existing.is_pending:
+                response = Response(
+                    {'error': 'A request with this Idempotency-Key is still in progress'},
+                    status=status.HTTP_409_CONFLICT,
+                )
+                response['Retry-After'] = '1'
+                return response
+            return _replay(existing)
+
+        if random.random() < config['PURGE_PROBABILITY']:
+            purge_expired()
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            IdempotencyKey.objects.filter(key_hash=hashed).delete()
+            raise
+        if response.status_code >= 500:
+            # ошибку сервера не запоминаем — повтор должен выполниться заново
+            IdempotencyKey.objects.filter(key_hash=hashed).delete()
+        else:
+            IdempotencyKey.objects.filter(key_hash=hashed).update(
+                status_code=response.status_code,
+                response=getattr(response, 'data', None),
+            )
+        return response
+
+    return wrapper
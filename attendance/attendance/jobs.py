@@ -0,0 +1,234 @@
+"""Lightweight DB-backed job queue for work that should not run in request workers.
+
+Jobs are rows in the Job table; ``manage.py run_workers`` claims and runs them.
+Each kind is a function registered with ``@handler(kind)`` that receives the job
+and a ``progress(done, total)`` callback and returns the result file name (or '').
+
+A running job holds a lease: ``run`` renews ``heartbeat_at`` every
+``LEASE_TIMEOUT / 4`` seconds. If the worker is killed the lease runs out and
+``requeue_expired`` (called by the workers between jobs) puts the job back in
+the queue, or fails it after ``MAX_ATTEMPTS`` tries.
+"""
+import threading
+import traceback
+from datetime import date, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import F
+from django.utils import timezone
+
+from . import exports, heatmap, provisioning, retention, sharding
+from .models import Group, Job
+
+DEFAULTS = {
+    'RESULTS_DIR': Path(settings.BASE_DIR) / 'media' / 'jobs',
+    'INLINE_MAX_DAYS': 31,
+    'POLL_INTERVAL': 1.0,
+    'PROCESSES': 2,
+    'LEASE_TIMEOUT': 120,
+    'MAX_ATTEMPTS': 3,
+    'RESULT_TTL': 7 * 24 * 3600,  # секунд; старые файлы результатов удаляет purge_results()
+}
+
+HANDLERS = {}
+# результат с паролями отдаётся один раз и сразу удаляется
+DOWNLOAD_ONCE = {'provision_accounts'}
+
+
+class JobError(Exception):
+    """Raised by handlers for expected failures (bad params etc.)."""
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ATTENDANCE_JOBS', {})}
+
+
+def handler(kind):
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, params=None, user=None):
+    if kind not in HANDLERS:
+        raise JobError(f'Unknown job kind: {kind}')
+    return Job.objects.create(kind=kind, params=params or {}, created_by=user)
+
+
+def claim_next(worker_name):
+    """Atomically take the oldest queued job, or return None."""
+    while True:
+        job_id = Job.objects.filter(status='queued').order_by('id').values_list('id', flat=True).first()
+        if job_id is None:
+            return None
+        now = timezone.now()
+        claimed = Job.objects.filter(id=job_id, status='queued').update(
+            status='running', worker=worker_name, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return Job.objects.get(id=job_id)
+        # другой воркер успел первым — пробуем следующую
+
+
+def requeue_expired():
+    """Take back running jobs whose worker stopped renewing the lease; return (requeued, failed)."""
+    config = get_config()
+    expired = Job.objects.filter(
+        status='running', heartbeat_at__lt=timezone.now() - timedelta(seconds=config['LEASE_TIMEOUT']),
+    )
+    failed = expired.filter(attempts__gte=config['MAX_ATTEMPTS']).update(
+        status='failed', finished_at=timezone.now(),
+        error=f'The worker stopped responding {config["MAX_ATTEMPTS"]} times; giving up.',
+    )
+    requeued = expired.filter(attempts__lt=config['MAX_ATTEMPTS']).update(
+        status='queued', worker='', progress=0, total=0,
+    )
+    return requeued, failed
+
+
+def _renew_lease(job, alias, stop):
+    # у потока свой контекст: шард и соединение с базой заводим заново
+    interval = get_config()['LEASE_TIMEOUT'] / 4
+    try:
+        with sharding.use(alias):
+            while not stop.wait(interval):
+                Job.objects.filter(id=job.id, status='running', worker=job.worker).update(
+                    heartbeat_at=timezone.now(),
+                )
+    finally:
+        connections.close_all()
+
+
+def results_dir():
+    # у каждого шарда свои номера заданий
+    alias = sharding.current()
+    base = Path(get_config()['RESULTS_DIR'])
+    return base if alias == DEFAULT_DB_ALIAS else base / alias
+
+
+def result_path(job):
+    return results_dir() / job.result_file
+
+
+def run(job):
+    def progress(done, total):
+        Job.objects.filter(id=job.id).update(progress=done, total=total)
+
+    stop = threading.Event()
+    heartbeat = threading.Thread(
+        target=_renew_lease, args=(job, sharding.current(), stop), name=f'job-{job.id}-lease', daemon=True,
+    )
+    heartbeat.start()
+    # если аренду уже забрали (воркер считался мёртвым), результат не записываем
+    mine = Job.objects.filter(id=job.id, status='running', worker=job.worker)
+    try:
+        result_file = HANDLERS[job.kind](job, progress)
+    except Exception as exc:
+        message = str(exc) if isinstance(exc, JobError) else traceback.format_exc()
+        mine.update(status='failed', error=message, finished_at=timezone.now())
+        return False
+    finally:
+        stop.set()
+        heartbeat.join()
+    mine.update(status='done', result_file=result_file or '', finished_at=timezone.now())
+    return True
+
+
+def discard_result(job):
+    """Delete the result file of ``job`` and forget it."""
+    if job.result_file:
+        result_path(job).unlink(missing_ok=True)
+    Job.objects.filter(id=job.id).update(result_file='')
+    job.result_file = ''
+
+
+def expired_results(ttl=None):
+    ttl = get_config()['RESULT_TTL'] if ttl is None else ttl
+    return Job.objects.exclude(result_file='').filter(finished_at__lt=timezone.now() - timedelta(seconds=ttl))
+
+
+def purge_results(ttl=None):
+    """Delete result files of jobs finished more than ``RESULT_TTL`` seconds ago; return their number."""
+    expired = list(expired_results(ttl))
+    for job in expired:
+        discard_result(job)
+    return len(expired)
+
+
+def _date_range(params):
+    try:
+        date_from = date.fromisoformat(params['date_from'])
+        date_to = date.fromisoformat(params['date_to'])
+    except (KeyError, ValueError, TypeError):
+        raise JobError('date_from and date_to (YYYY-MM-DD) are required')
+    if date_from > date_to:
+        raise JobError('date_from must not be after date_to')
+    return date_from, date_to
+
+
+def _write_csv(job, prefix, writer, progress):
+    params = job.params
+    date_from, date_to = _date_range(params)
+    if not params.get('class_id'):
+        raise JobError('class_id is required')
+    directory = results_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f'{prefix}-{job.id}-{params["class_id"]}-{date_from}-{date_to}.csv'
+    with (directory / name).open('w', newline='', encoding='utf-8') as fh:
+        writer(fh, params['class_id'], date_from, date_to, params.get('group_ids'), progress)
+    return name
+
+
+@handler('export')
+def export_job(job, progress):
+    return _write_csv(job, 'export', exports.write_export, progress)
+
+
+@handler('range_report')
+def range_report_job(job, progress):
+    return _write_csv(job, 'report', exports.write_range_report, progress)
+
+
+@handler('rebuild_calendar')
+def rebuild_calendar_job(job, progress):
+    progress(0, 1)
+    heatmap.rebuild_all()
+    progress(1, 1)
+    return ''
+
+
+@handler('provision_accounts')
+def provision_accounts_job(job, progress):
+    """Create accounts for unlinked students of groups (params: {"group_ids": [...]}); result is the credentials CSV."""
+    group_ids = job.params.get('group_ids')
+    if not group_ids:
+        raise JobError('group_ids is required')
+    groups = Group.objects.filter(id__in=group_ids)
+    progress(0, 1)
+    # PBKDF2 на всех ядрах: воркеры run_workers не демонические и могут заводить свой пул процессов
+    credentials = provisioning.provision(groups)
+    directory = results_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f'credentials-{job.id}.csv'
+    with (directory / name).open('w', newline='', encoding='utf-8') as fh:
+        provisioning.write_credentials(fh, credentials)
+    progress(len(credentials), len(credentials))
+    return name
+
+
+@handler('purge')
+def purge_job(job, progress):
+    """Purge soft-deleted records, apply the retention policy (params: {"years": N}) and expire job results."""
+    done = {'rows': 0}
+
+    def report(label, batch_done, total):
+        progress(done['rows'] + batch_done, done['rows'] + total)
+
+    done['rows'] += retention.purge_deleted(progress=report)
+    done['rows'] += retention.purge_expired(years=job.params.get('years'), progress=report)
+    purge_results()
+    progress(done['rows'], done['rows'])
+    return ''
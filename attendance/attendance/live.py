@@ -0,0 +1,264 @@
+"""Live attendance report over server-sent events.
+
+An open report page subscribes to ``/class/<id>/report/<date>/live/`` and
+patches its rows and counts from the events instead of being reloaded. The
+stream is an async view, so it has to be served through the ASGI entry point
+(``attendance_system/asgi.py``); under WSGI it answers 501, so pages rendered
+there leave the stream out and stay static unless ``STREAM_ELSEWHERE`` says the
+proxy sends the stream to a separate ASGI service.
+
+Each process runs one ``Hub`` per institution shard: a single poll loop reads the change feed
+(``AttendanceChange``, plus ``AttendanceSession`` in the ``exceptions``
+storage mode) after its cursor every ``POLL_INTERVAL`` seconds, loads the
+current rows of the (subject, day) pairs that somebody is watching once, and
+fans them out to every subscriber of that pair. A hundred open tabs cost the
+same queries as one.
+
+Events carry the cursor as their id, so a reconnecting ``EventSource`` sends
+it back in ``Last-Event-ID`` and gets the rows changed while it was away. Like
+the change feed, the cursor stays behind changes younger than
+``ATTENDANCE_CHANGEFEED["SAFETY_WINDOW"]``; the hub remembers which of those it
+has already sent, so a change whose lower id commits late is still delivered
+and the others are not sent twice.
+"""
+import asyncio
+import json
+import logging
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Max, Q
+from django.utils import dateformat, timezone
+
+from . import changefeed, sharding, storage
+from .models import AttendanceChange, AttendanceSession, Student
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'POLL_INTERVAL': 1.0,
+    'KEEPALIVE': 15,  # комментарий в потоке, чтобы прокси не закрывали простаивающее соединение
+    'MAX_AGE': 600,  # потом браузер переподключается сам (с Last-Event-ID)
+    'RETRY': 3000,  # мс, пауза EventSource перед переподключением
+    'STREAM_ELSEWHERE': False,  # поток обслуживает отдельный ASGI-сервис, страницы — WSGI
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ATTENDANCE_LIVE', {})}
+
+
+def available(request):
+    """Can the page rendered for ``request`` subscribe to the stream?"""
+    return isinstance(request, ASGIRequest) or get_config()['STREAM_ELSEWHERE']
+
+
+# --- курсор ---
+
+def current_cursor():
+    """(settled change id, last session id)."""
+    change = changefeed.current_cursor()
+    session = 0
+    if storage.exceptions_mode():
+        session = AttendanceSession.objects.aggregate(last=Max('id'))['last'] or 0
+    return change, session
+
+
+def format_cursor(cursor):
+    return '{}-{}'.format(*cursor)
+
+
+def parse_cursor(value):
+    """Cursor from ``?since=`` / ``Last-Event-ID``, or None if it is missing or malformed."""
+    try:
+        change, session = (int(part) for part in value.split('-'))
+    except (AttributeError, ValueError):
+        return None
+    return (change, session) if change >= 0 and session >= 0 else None
+
+
+# --- чтение изменений ---
+
+def row_data(attendance):
+    return {
+        'student': attendance.student_id,
+        'group': attendance.student.group_id,
+        'student_code': attendance.student.student_id,
+        'name': attendance.student.name,
+        'status': attendance.status,
+        'status_display': attendance.get_status_display(),
+        'time': dateformat.format(timezone.localtime(attendance.marked_at), 'H:i'),
+    }
+
+
+def lesson_rows(class_id, day, student_ids=(), group_ids=()):
+    """Current report rows of the given students and groups; gone students come back as ``deleted``."""
+    attendances = storage.attendances().filter(class_enrolled_id=class_id, date=day).filter(
+        Q(student_id__in=student_ids) | Q(student__group_id__in=group_ids)
+    ).select_related('student')
+    rows = {attendance.student_id: row_data(attendance) for attendance in attendances}
+    gone = set(student_ids) - set(rows)
+    if gone:
+        for student_id, group_id in Student.all_objects.filter(id__in=gone).values_list('id', 'group_id'):
+            rows[student_id] = {'student': student_id, 'group': group_id, 'deleted': True}
+    return list(rows.values())
+
+
+def read(cursor, keys, sent=frozenset()):
+    """Rows changed after ``cursor`` for the watched (class_id, date) ``keys``.
+
+    ``sent`` are the change ids above ``cursor`` delivered by earlier reads;
+    returns (cursor, {key: rows}, sent ids above the new cursor).
+    """
+    change_id, session_id = cursor
+    new_cursor = current_cursor()
+    if not keys:
+        return new_cursor, {}, frozenset(seq for seq in sent if seq > new_cursor[0])
+    lessons = Q()
+    for class_id, day in keys:
+        lessons |= Q(class_id=class_id, date=day)
+    students = defaultdict(set)
+    groups = defaultdict(set)
+    # без верхней границы: изменение с меньшим id могло закоммититься позже соседних
+    changes = AttendanceChange.objects.filter(lessons, id__gt=change_id).exclude(id__in=sent)
+    sent = set(sent)
+    for seq, class_id, day, student_id in changes.values_list('id', 'class_id', 'date', 'student_id'):
+        students[(class_id, day)].add(student_id)
+        sent.add(seq)
+    if new_cursor[1] > session_id:
+        # режим исключений: взятая сессия неявно отмечает всю группу
+        sessions = AttendanceSession.objects.filter(
+            id__gt=session_id, id__lte=new_cursor[1],
+            class_enrolled_id__in={class_id for class_id, _ in keys}, date__in={day for _, day in keys},
+        )
+        for class_id, day, group_id in sessions.values_list('class_enrolled_id', 'date', 'group_id'):
+            if (class_id, day) in keys:
+                groups[(class_id, day)].add(group_id)
+    updates = {
+        key: lesson_rows(*key, student_ids=students[key], group_ids=groups[key])
+        for key in set(students) | set(groups)
+    }
+    return new_cursor, updates, frozenset(seq for seq in sent if seq > new_cursor[0])
+
+
+# --- раздача подписчикам ---
+
+class Subscription:
+    def __init__(self, key, group_ids=None):
+        self.key = key
+        self.group_ids = group_ids  # None — все группы (администратор)
+        self.queue = asyncio.Queue()
+
+    def visible(self, rows):
+        if self.group_ids is None:
+            return rows
+        return [row for row in rows if row['group'] in self.group_ids]
+
+
+class Hub:
+    """Subscribers of this process by (class_id, date) on one shard, fed by one poll loop."""
+
+    def __init__(self, shard=DEFAULT_DB_ALIAS):
+        self.shard = shard
+        self._subscribers = defaultdict(set)
+        self._task = None
+        self.cursor = None
+        self.sent = frozenset()  # id изменений новее курсора, уже разосланные
+        self.stats = {'polls': 0, 'events': 0, 'errors': 0}
+
+    async def subscribe(self, key, group_ids=None, since=None):
+        """Register a subscriber; with ``since``, queue the rows changed after that cursor first."""
+        if self.cursor is None:
+            self.cursor = await sync_to_async(self._on_shard)(current_cursor)
+        subscription = Subscription(key, group_ids)
+        self._subscribers[key].add(subscription)
+        self._ensure_running()
+        if since is not None and since < self.cursor:
+            cursor, updates, _ = await sync_to_async(self._on_shard)(read, since, [key])
+            if updates.get(key):
+                subscription.queue.put_nowait((cursor, updates[key]))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscribers = self._subscribers.get(subscription.key)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.key]
+
+    def _on_shard(self, func, *args):
+        # поток ответа и цикл опроса живут дольше запроса, выбравшего шард
+        with sharding.use(self.shard):
+            return func(*args)
+
+    def subscriber_count(self):
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        # цикл событий мог смениться (тесты, перезапуск сервера) — тогда старая задача мертва
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while self._subscribers:
+            await asyncio.sleep(get_config()['POLL_INTERVAL'])
+            if not self._subscribers:
+                break
+            try:
+                cursor, updates, sent = await sync_to_async(self._on_shard)(
+                    read, self.cursor, list(self._subscribers), self.sent,
+                )
+            except Exception:
+                logger.exception('Live report poll failed')
+                self.stats['errors'] += 1
+                continue
+            self.stats['polls'] += 1
+            self.cursor = cursor
+            self.sent = sent
+            for key, rows in updates.items():
+                for subscription in list(self._subscribers.get(key, ())):
+                    subscription.queue.put_nowait((cursor, rows))
+                    self.stats['events'] += 1
+        if self._task is asyncio.current_task():
+            self._task = None
+
+
+hubs = {}
+
+
+def hub_for(shard):
+    if shard not in hubs:
+        hubs[shard] = Hub(shard)
+    return hubs[shard]
+
+
+def event(cursor, rows):
+    return f'id: {format_cursor(cursor)}\ndata: {json.dumps(rows)}\n\n'
+
+
+async def stream(key, group_ids=None, since=None, shard=DEFAULT_DB_ALIAS):
+    """The text/event-stream body of one subscriber of ``shard``."""
+    config = get_config()
+    hub = hub_for(shard)
+    subscription = await hub.subscribe(key, group_ids, since)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + config['MAX_AGE']
+    try:
+        yield f'retry: {config["RETRY"]}\n\n'
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                cursor, rows = await asyncio.wait_for(
+                    subscription.queue.get(), timeout=min(config['KEEPALIVE'], remaining),
+                )
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            rows = subscription.visible(rows)
+            if rows:
+                yield event(cursor, rows)
+    finally:
+        hub.unsubscribe(subscription)
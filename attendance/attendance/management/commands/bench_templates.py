@@ -0,0 +1,144 @@
+import re
+import time
+from datetime import date, timedelta
+from statistics import median
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.template import engines
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from attendance import templating
+from attendance.models import Attendance, Class, Group, Student
+
+TEMPLATES = {
+    'mark_attendance': ('attendance/mark_attendance.html', 'mark_attendance'),
+    'report': ('attendance/report.html', 'attendance_report'),
+    'my_attendance': ('attendance/my_attendance.html', 'my_attendance'),
+}
+STATUSES = ['present', 'late', 'absent']
+_CSRF = re.compile(r'name="csrfmiddlewaretoken" value="[^"]*"')
+_SPACE = re.compile(r'\s+')
+
+
+def normalize(html):
+    """HTML without whitespace differences and the per-render CSRF token."""
+    html = _CSRF.sub('name="csrfmiddlewaretoken" value=""', html)
+    html = re.sub(r'>\s+', '>', re.sub(r'\s+<', '<', html))
+    return _SPACE.sub(' ', html).strip()
+
+
+class Command(BaseCommand):
+    help = 'Compare render time of the Django and Jinja2 versions of the large attendance pages.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=300, help='Table rows per page (default 300).')
+        parser.add_argument('--repeat', type=int, default=50, help='Renders per engine and template.')
+        parser.add_argument('--template', choices=sorted(TEMPLATES), action='append',
+                            help='Only these pages (repeatable).')
+
+    def contexts(self, rows):
+        """Unsaved model instances: the benchmark needs no database."""
+        today = date.today()
+        group = Group(id=1, code='SE-2401', name='SE-2401')
+        class_obj = Class(id=1, name='Algorithms', code='ALG')
+        subjects = [Class(id=i + 1, name=f'Subject {i:02d}', code=f'S{i:02d}') for i in range(12)]
+        students = []
+        for i in range(rows):
+            student = Student(id=i + 1, name=f'Student {i:04d}', student_id=f'2401{i:05d}', group=group)
+            student.current_status = student.original_status = STATUSES[i % 3]
+            student.version = 1
+            students.append(student)
+        marked_at = timezone.now()
+        attendances = [
+            Attendance(id=i + 1, student=student, class_enrolled=class_obj, date=today,
+                       status=student.current_status, marked_at=marked_at)
+            for i, student in enumerate(students)
+        ]
+        history_rows = [
+            Attendance(id=i + 1, student=students[0], class_enrolled=subjects[i % len(subjects)],
+                       date=today - timedelta(days=i), status=STATUSES[i % 3], notes='' if i % 4 else 'Sick')
+            for i in range(rows)
+        ]
+        return {
+            'mark_attendance': {
+                'class_obj': class_obj,
+                'students': students,
+                'attendance_date': today,
+                'is_teacher': True,
+                'selected_group': group,
+                'group_id': group.id,
+            },
+            'report': {
+                'class_obj': class_obj,
+                'attendances': attendances,
+                'report_date': today,
+                'total_students': rows,
+                'present_count': rows // 3,
+                'absent_count': rows // 3,
+                'late_count': rows - 2 * (rows // 3),
+                'live_cursor': '0-0',
+            },
+            'my_attendance': {
+                'student': students[0],
+                'first_class': subjects[0],
+                'present_count': rows // 3,
+                'absent_count': rows // 3,
+                'late_count': rows - 2 * (rows // 3),
+                'total_records': rows,
+                'attendance_percent': 33.3,
+                'stats_by_subject': [],
+                'history_rows': history_rows,
+                'history_next_cursor': 'bench',
+                'history_url': reverse('api_student_history', args=[students[0].id]),
+                'history_subjects': subjects,
+            },
+        }
+
+    def request(self, url_name):
+        path = reverse(url_name, args=[1]) if url_name != 'my_attendance' else reverse(url_name)
+        request = RequestFactory().get(path)
+        request.user = User(username='bench', first_name='Bench')
+        request.resolver_match = resolve(path)
+        return request
+
+    def timings(self, template, context, request, repeat):
+        template.render(dict(context), request)  # компиляция и прогрев
+        result = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            template.render(dict(context), request)
+            result.append((time.perf_counter() - started) * 1000)
+        return result
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1 or options['repeat'] < 1:
+            raise CommandError('--rows and --repeat must be positive.')
+        names = options['template'] or sorted(TEMPLATES)
+        contexts = self.contexts(options['rows'])
+        django_engine = engines['django']
+        jinja2_engine = engines[templating.get_config()['ENGINE']]
+
+        self.stdout.write(f'{options["rows"]} rows, {options["repeat"]} renders per engine (median / min, ms)\n')
+        self.stdout.write(f'{"page":<18}{"django":>18}{"jinja2":>18}{"speedup":>10}  same HTML')
+        for name in names:
+            template_name, url_name = TEMPLATES[name]
+            request = self.request(url_name)
+            context = contexts[name]
+            django_template = django_engine.get_template(template_name)
+            jinja2_template = jinja2_engine.get_template(template_name)
+            same = normalize(django_template.render(dict(context), request)) == \
+                normalize(jinja2_template.render(dict(context), request))
+            django_ms = self.timings(django_template, context, request, options['repeat'])
+            jinja2_ms = self.timings(jinja2_template, context, request, options['repeat'])
+            speedup = median(django_ms) / median(jinja2_ms)
+            self.stdout.write(
+                f'{name:<18}'
+                f'{median(django_ms):>10.2f} / {min(django_ms):<5.2f}'
+                f'{median(jinja2_ms):>10.2f} / {min(jinja2_ms):<5.2f}'
+                f'{speedup:>9.1f}x  {"yes" if same else "NO"}'
+            )
+            if not same:
+                self.stderr.write(f'  {template_name}: the Jinja2 port renders different HTML')
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from attendance import storage
+
+
+class Command(BaseCommand):
+    help = ('Convert stored attendance between the "full" and "exceptions" storage modes '
+            '(ATTENDANCE_STORAGE["MODE"]), in small batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--to', choices=storage.MODES, required=True, help='Target storage mode.')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between batches.')
+        parser.add_argument('--dry-run', action='store_true', help='Only show what would change.')
+
+    def progress(self, label, done, total):
+        if total:
+            self.stdout.write(f'  {label}: {done}/{total} ({100 * done // total}%)')
+
+    def handle(self, *args, **options):
+        mode = storage.get_config()['MODE']
+        batching = {'batch_size': options['batch_size'], 'pause': options['pause'],
+                    'progress': self.progress, 'dry_run': options['dry_run']}
+
+        if options['to'] == 'exceptions':
+            # строки удаляются только после того, как чтение идёт через представление
+            if mode != 'exceptions' and not options['dry_run']:
+                raise CommandError('Set ATTENDANCE_STORAGE["MODE"] = "exceptions" and restart the workers first.')
+            sessions, deleted = storage.compact(**batching)
+            if options['dry_run']:
+                self.stdout.write(f'Lessons that would become sessions: {sessions}')
+                return
+            self.stdout.write(self.style.SUCCESS(
+                f'Created {sessions} sessions, deleted {deleted} attendance rows equal to the session default.'
+            ))
+            return
+
+        rows = storage.expand(**batching)
+        if options['dry_run']:
+            self.stdout.write(f'Implied rows that would be stored: {rows}')
+            return
+        self.stdout.write(self.style.SUCCESS(f'Stored {rows} implied attendance rows.'))
+        if mode != 'full':
+            self.stdout.write('Now set ATTENDANCE_STORAGE["MODE"] = "full" and restart the workers.')
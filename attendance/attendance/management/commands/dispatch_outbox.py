@@ -0,0 +1,34 @@
+import time
+from django.core.management.base import BaseCommand
+from attendance import outbox
+
+
+class Command(BaseCommand):
+    help = 'Deliver pending attendance outbox events to the configured sinks.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the pending events once and exit.')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to sleep when there is nothing to send.')
+    
+    def handle(self, *args, **options):
+        config = outbox.get_config()
+        sinks = outbox.build_sinks(config)
+        if not sinks:
+            self.stderr.write('No sinks configured in settings.ATTENDANCE_OUTBOX["SINKS"].')
+            return
+        batch_size = options['batch_size'] or config['BATCH_SIZE']
+        
+        total = 0
+        while True:
+            delivered, failed = outbox.dispatch_batch(config, sinks, batch_size)
+            total += delivered
+            if failed:
+                self.stderr.write(f'{failed} events failed, will retry with backoff.')
+            if delivered == batch_size:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Delivered {total} events.'))
@@ -0,0 +1,148 @@
+import itertools
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from attendance import checkin, enrollment, retention
+from attendance.models import Attendance, Class, Group, Student
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+class Command(BaseCommand):
+    help = ('Load-test QR self check-in: many students posting tokens at once. '
+            'Creates a temporary subject, group and students; run it against a copy of the database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=300)
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent clients.')
+        parser.add_argument('--seconds', type=float, default=10.0, help='How long to keep posting.')
+        parser.add_argument('--direct', action='store_true',
+                            help='Write every check-in immediately instead of through the buffer (baseline).')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated data.')
+
+    def setup_data(self, count):
+        tag = f'LOADTEST-{int(time.time())}'
+        class_obj = Class.objects.create(name=tag, code=tag)
+        group = Group.objects.create(code=tag, name=tag)
+        group.classes.add(class_obj)
+        User.objects.bulk_create([User(username=f'{tag.lower()}-{i}') for i in range(count)])
+        users = list(User.objects.filter(username__startswith=f'{tag.lower()}-').order_by('id'))
+        Student.objects.bulk_create([
+            Student(name=f'Load Test {i}', student_id=f'{tag}-{i}', group=group, user=user)
+            for i, user in enumerate(users)
+        ])
+        enrollment.sync_groups([group.id])
+        return class_obj, group, users
+
+    def cleanup(self, class_obj, group, users):
+        retention.delete_attendance_batches(Attendance.objects.filter(class_enrolled=class_obj), pause=0)
+        Student.all_objects.filter(group=group).delete()
+        group.delete()
+        class_obj.delete()
+        User.objects.filter(id__in=[user.id for user in users]).delete()
+
+    def handle(self, *args, **options):
+        if options['students'] < 1 or options['threads'] < 1:
+            raise CommandError('--students and --threads must be positive.')
+        config = {**checkin.get_config(), 'BUFFERED': not options['direct']}
+        with override_settings(
+            ATTENDANCE_CHECKIN=config,
+            ATTENDANCE_THROTTLE={**getattr(settings, 'ATTENDANCE_THROTTLE', {}), 'ENABLED': False},
+            ALLOWED_HOSTS=['testserver'],
+        ):
+            class_obj, group, users = self.setup_data(options['students'])
+            try:
+                self.run(class_obj, group, users, options)
+            finally:
+                if not options['keep']:
+                    self.cleanup(class_obj, group, users)
+
+    def run(self, class_obj, group, users, options):
+        clients = []
+        for user in users:
+            client = Client(raise_request_exception=False)
+            client.force_login(user)
+            clients.append(client)
+        # каждый «раунд» — новый день, иначе повторные отметки схлопнулись бы в буфере
+        today = date.today()
+        tokens = {}
+        url = reverse('api_checkin')
+        sequence = itertools.count()
+        sequence_lock = threading.Lock()
+        latencies = []
+        statuses = Counter()
+        results_lock = threading.Lock()
+        deadline = time.monotonic() + options['seconds']
+
+        def token_for(round_number):
+            if round_number not in tokens:
+                tokens[round_number] = checkin.make_token(class_obj.id, group.id, today - timedelta(days=round_number))
+            return tokens[round_number]
+
+        def worker():
+            local_latencies = []
+            local_statuses = Counter()
+            while time.monotonic() < deadline:
+                with sequence_lock:
+                    number = next(sequence)
+                    token = token_for(number // len(clients))
+                client = clients[number % len(clients)]
+                started = time.perf_counter()
+                response = client.post(url, {'token': token}, content_type='application/json')
+                local_latencies.append((time.perf_counter() - started) * 1000)
+                local_statuses[response.status_code] += 1
+            with results_lock:
+                latencies.extend(local_latencies)
+                statuses.update(local_statuses)
+            connections.close_all()
+
+        mode = 'direct writes' if options['direct'] else 'buffered'
+        self.stdout.write(
+            f'{options["students"]} students, {options["threads"]} clients, {options["seconds"]}s, {mode}...'
+        )
+        started = time.monotonic()
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        posting_seconds = time.monotonic() - started
+
+        accepted = statuses[202]
+        # ждём, пока буфер допишет всё принятое
+        while True:
+            stored = Attendance.objects.filter(class_enrolled=class_obj).count()
+            if stored >= accepted or time.monotonic() - started > posting_seconds + 30:
+                break
+            time.sleep(0.05)
+        stored_seconds = time.monotonic() - started
+
+        self.stdout.write(f'requests:   {sum(statuses.values())} ({dict(sorted(statuses.items()))})')
+        self.stdout.write(f'accepted:   {accepted / posting_seconds:.0f} check-ins/s')
+        self.stdout.write(f'stored:     {stored} rows, {stored / stored_seconds:.0f} rows/s '
+                          f'(all stored {stored_seconds - posting_seconds:.2f}s after the last request)')
+        self.stdout.write(
+            f'latency ms: p50 {percentile(latencies, 0.5):.1f}  p95 {percentile(latencies, 0.95):.1f}  '
+            f'p99 {percentile(latencies, 0.99):.1f}  max {max(latencies, default=0):.1f}'
+        )
+        if not options['direct']:
+            stats = checkin.stats()
+            batch = stats['written'] / stats['flushes'] if stats['flushes'] else 0
+            self.stdout.write(f'flushes:    {stats["flushes"]}, {batch:.0f} check-ins per batch, '
+                              f'{stats["errors"]} failed')
+        if stored < accepted:
+            self.stderr.write(f'{accepted - stored} accepted check-ins were not stored within 30s')
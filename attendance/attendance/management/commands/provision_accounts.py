@@ -0,0 +1,38 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from attendance.models import Group
+from attendance import provisioning
+
+
+class Command(BaseCommand):
+    help = 'Create and link user accounts for every student without one in the given groups.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('groups', nargs='*', help='Group codes, e.g. cs-2301 cs-2302.')
+        parser.add_argument('--all', action='store_true', help='Provision every group.')
+        parser.add_argument('--output', '-o', default=None,
+                            help='Credential CSV file (default: stdout).')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Hashing processes (default: number of CPU cores).')
+        parser.add_argument('--batch-size', type=int, default=provisioning.BATCH_SIZE)
+    
+    def handle(self, *args, **options):
+        if options['all']:
+            groups = Group.objects.all()
+        elif options['groups']:
+            groups = Group.objects.filter(code__in=options['groups'])
+            missing = set(options['groups']) - set(groups.values_list('code', flat=True))
+            if missing:
+                raise CommandError(f'Unknown groups: {", ".join(sorted(missing))}')
+        else:
+            raise CommandError('Give one or more group codes or --all.')
+        
+        credentials = provisioning.provision(
+            groups, processes=options['processes'], batch_size=options['batch_size'],
+        )
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as fh:
+                provisioning.write_credentials(fh, credentials)
+        else:
+            provisioning.write_credentials(sys.stdout, credentials)
+        self.stderr.write(self.style.SUCCESS(f'Provisioned {len(credentials)} accounts.'))
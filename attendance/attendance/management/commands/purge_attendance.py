@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from attendance import jobs, retention
+from attendance.models import Attendance
+
+
+class Command(BaseCommand):
+    help = ('Purge soft-deleted classes, groups and students with their attendance, and apply '
+            'the retention policy (ATTENDANCE_RETENTION["YEARS"]), in small batches. '
+            'Also deletes job result files older than ATTENDANCE_JOBS["RESULT_TTL"].')
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--deleted-only', action='store_true', help='Only purge soft-deleted rows.')
+        parser.add_argument('--retention-only', action='store_true', help='Only apply the retention policy.')
+        parser.add_argument('--years', type=int, default=None,
+                            help='Keep this many years of attendance (overrides the setting).')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--pause', type=float, default=None, help='Seconds to sleep between batches.')
+        parser.add_argument('--dry-run', action='store_true', help='Only show what would be deleted.')
+    
+    def progress(self, label, done, total):
+        if total:
+            self.stdout.write(f'  {label}: {done}/{total} attendance rows ({100 * done // total}%)')
+    
+    def handle(self, *args, **options):
+        config = retention.get_config()
+        years = options['years'] or config['YEARS']
+        batching = {'batch_size': options['batch_size'], 'pause': options['pause'], 'progress': self.progress}
+        
+        if options['dry_run']:
+            for kind, rows in retention.pending_deletions().items():
+                self.stdout.write(f'Soft-deleted {kind}: {rows.count()}')
+            if years:
+                cutoff = retention.retention_cutoff(years)
+                count = Attendance.objects.filter(date__lt=cutoff).count()
+                self.stdout.write(f'Attendance older than {cutoff}: {count}')
+            else:
+                self.stdout.write('Retention policy is off (ATTENDANCE_RETENTION["YEARS"] is not set).')
+            self.stdout.write(f'Expired job result files: {jobs.expired_results().count()}')
+            return
+        
+        if not (options['deleted_only'] or options['retention_only']):
+            removed = jobs.purge_results()
+            self.stdout.write(self.style.SUCCESS(f'Deleted {removed} expired job result files.'))
+        
+        if not options['retention_only']:
+            self.stdout.write('Purging soft-deleted classes, groups and students...')
+            deleted = retention.purge_deleted(**batching)
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} attendance rows of removed records.'))
+        if not options['deleted_only']:
+            if not years:
+                self.stdout.write('Retention policy is off (ATTENDANCE_RETENTION["YEARS"] is not set).')
+                return
+            self.stdout.write(f'Applying retention policy: keep {years} years...')
+            deleted = retention.purge_expired(years=years, **batching)
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired attendance rows.'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from attendance import heatmap
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the packed calendar heatmap bitmaps from Attendance rows.'
+    
+    def handle(self, *args, **options):
+        count = heatmap.rebuild_all()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} calendar rows.'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from attendance import enrollment
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the Enrollment table (subjects of every student) from Student.group and Group.classes.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=enrollment.BATCH_SIZE, help='Groups per transaction.')
+    
+    def handle(self, *args, **options):
+        added, removed = enrollment.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Enrollments rebuilt: {added} added, {removed} removed.'))
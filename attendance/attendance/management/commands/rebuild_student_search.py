@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from attendance import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the student search index (SQLite FTS5 table) from Student rows.'
+    
+    def handle(self, *args, **options):
+        count = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} students.'))
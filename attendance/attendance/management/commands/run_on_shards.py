@@ -0,0 +1,42 @@
+import argparse
+from pathlib import Path
+
+from django.core.management import call_command, get_commands, load_command_class
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from attendance import sharding
+
+
+class Command(BaseCommand):
+    help = ('Run a management command on every institution shard (or on --shard ones), e.g. '
+            '"run_on_shards migrate" or "run_on_shards --shard physics purge_attendance".')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shard', action='append', dest='shards', default=None,
+                            help='Shard alias; repeat for several (default: all, "default" included).')
+        parser.add_argument('command_name', help='Command to run.')
+        parser.add_argument('args', nargs=argparse.REMAINDER, help='Arguments of the command.')
+
+    def handle(self, *args, **options):
+        name = options['command_name']
+        commands = get_commands()
+        if name not in commands or name == 'run_on_shards':
+            raise CommandError(f'Unknown command: {name}')
+        shards = options['shards'] or sharding.aliases()
+        unknown = set(shards) - set(sharding.aliases())
+        if unknown:
+            raise CommandError(f'Unknown shard(s): {", ".join(sorted(unknown))}')
+
+        command = load_command_class(commands[name], name)
+        # migrate, createsuperuser, dumpdata... выбирают базу сами через --database
+        takes_database = any(
+            action.dest == 'database' for action in command.create_parser('manage.py', name)._actions
+        )
+        for alias in shards:
+            settings_dict = connections[alias].settings_dict
+            if settings_dict['ENGINE'].endswith('sqlite3'):
+                Path(settings_dict['NAME']).parent.mkdir(parents=True, exist_ok=True)
+            self.stdout.write(self.style.MIGRATE_HEADING(f'[{alias}] {name} {" ".join(args)}'.rstrip()))
+            extra = ['--database', alias] if takes_database else []
+            with sharding.use(alias):
+                call_command(name, *args, *extra)
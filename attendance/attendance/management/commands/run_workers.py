@@ -0,0 +1,60 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from django.core.management.base import BaseCommand
+from django.db import connections
+from attendance import jobs, sharding
+
+
+def work_loop(poll_interval, once, shard):
+    # Соединение, унаследованное от родителя после fork, использовать нельзя
+    connections.close_all()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sharding.activate(shard)
+    worker_name = f'{socket.gethostname()}:{os.getpid()}'
+    while True:
+        # задания убитых воркеров (истёкшая аренда) возвращаются в очередь
+        jobs.requeue_expired()
+        job = jobs.claim_next(worker_name)
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+        jobs.run(job)
+
+
+class Command(BaseCommand):
+    help = 'Run background job workers (exports, range reports, recalculations).'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Number of worker processes (default: ATTENDANCE_JOBS["PROCESSES"]).')
+        parser.add_argument('--poll-interval', type=float, default=None)
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty.')
+    
+    def handle(self, *args, **options):
+        config = jobs.get_config()
+        processes = options['processes'] or config['PROCESSES']
+        poll_interval = options['poll_interval'] or config['POLL_INTERVAL']
+        
+        connections.close_all()
+        workers = [
+            # не daemon: демоническому процессу нельзя заводить дочерние (пул хеширования provision_accounts)
+            multiprocessing.Process(target=work_loop, args=(poll_interval, options['once'], sharding.current()))
+            for _ in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f'Started {processes} job workers.')
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
+        self.stdout.write(self.style.SUCCESS('Job workers stopped.'))
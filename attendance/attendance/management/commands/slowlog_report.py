@@ -0,0 +1,70 @@
+import json
+from collections import Counter, defaultdict
+from pathlib import Path
+from django.core.management.base import BaseCommand
+from attendance import slowlog
+
+
+class Command(BaseCommand):
+    help = 'Aggregate the slow-query log by SQL fingerprint.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=None, help='Log file (default: ATTENDANCE_SLOWLOG["PATH"]).')
+        parser.add_argument('--top', type=int, default=20)
+        parser.add_argument('--sort', choices=['total', 'count', 'max', 'per_request'], default='total')
+        parser.add_argument('--view', default=None, help='Only statements issued by this view.')
+    
+    def log_files(self, path):
+        path = Path(path)
+        files = [path] + sorted(path.parent.glob(path.name + '.*'))
+        return [f for f in files if f.exists()]
+    
+    def handle(self, *args, **options):
+        config = slowlog.get_config()
+        files = self.log_files(options['path'] or config['PATH'])
+        if not files:
+            self.stderr.write('No slow-query log found.')
+            return
+        
+        stats = defaultdict(lambda: {
+            'count': 0, 'total': 0.0, 'max': 0.0,
+            'views': Counter(), 'requests': Counter(), 'stack': [], 'sql': '',
+        })
+        for file in files:
+            with file.open(encoding='utf-8') as fh:
+                for line in fh:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if options['view'] and record.get('view') != options['view']:
+                        continue
+                    entry = stats[record['fingerprint']]
+                    entry['count'] += 1
+                    entry['total'] += record['duration_ms']
+                    if record['duration_ms'] >= entry['max']:
+                        entry['max'] = record['duration_ms']
+                        entry['stack'] = record.get('stack') or []
+                        entry['sql'] = record.get('sql', '')
+                    entry['views'][record.get('view') or '-'] += 1
+                    if record.get('request_id'):
+                        entry['requests'][record['request_id']] += 1
+        
+        for entry in stats.values():
+            # Сколько раз один и тот же запрос выполнялся в рамках одного HTTP-запроса: признак N+1
+            entry['per_request'] = max(entry['requests'].values()) if entry['requests'] else 1
+        ordered = sorted(stats.items(), key=lambda item: item[1][options['sort']], reverse=True)
+        
+        self.stdout.write(f'{len(stats)} fingerprints from {sum(e["count"] for e in stats.values())} slow statements\n')
+        for fp, entry in ordered[:options['top']]:
+            flag = '  << repeated within one request (N+1?)' if entry['per_request'] > 1 else ''
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{entry["total"]:.1f} ms total | {entry["count"]}x | avg {entry["total"] / entry["count"]:.1f} ms '
+                f'| max {entry["max"]:.1f} ms | up to {entry["per_request"]}x per request{flag}'
+            ))
+            self.stdout.write(f'  {fp[:300]}')
+            views = ', '.join(f'{view} ({n})' for view, n in entry['views'].most_common(3))
+            self.stdout.write(f'  views: {views}')
+            for frame in entry['stack']:
+                self.stdout.write(f'    {frame}')
+            self.stdout.write('')
@@ -9,12 +9,13 @@ def migrate_students_to_groups(apps, schema_editor):
     Class = apps.get_model('attendance', 'Class')
     Group = apps.get_model('attendance', 'Group')
     Student = apps.get_model('attendance', 'Student')
-    for c in Class.objects.all():
+    db_alias = schema_editor.connection.alias
+    for c in Class.objects.using(db_alias).all():
         code = f"{c.code}-1"
         # avoid duplicate code if migration is re-run
-        if not Group.objects.filter(code=code).exists():
-            g = Group.objects.create(code=code, name=c.name or "", class_enrolled=c)
-            Student.objects.filter(class_enrolled=c).update(group=g)
+        if not Group.objects.using(db_alias).filter(code=code).exists():
+            g = Group.objects.using(db_alias).create(code=code, name=c.name or "", class_enrolled=c)
+            Student.objects.using(db_alias).filter(class_enrolled=c).update(group=g)
 
 
 def noop(apps, schema_editor):
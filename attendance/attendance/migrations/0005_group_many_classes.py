@@ -6,7 +6,7 @@ from django.db import migrations, models
 def migrate_group_classes(apps, schema_editor):
     """Copy each group's class_enrolled into the new classes M2M."""
     Group = apps.get_model('attendance', 'Group')
-    for g in Group.objects.all():
+    for g in Group.objects.using(schema_editor.connection.alias).all():
         if g.class_enrolled_id:
             g.classes.add(g.class_enrolled_id)
 
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.10 on 2026-10-19 17:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_calendar(apps, schema_editor):
+    """Pack existing attendance into per-month bitmaps."""
+    Attendance = apps.get_model('attendance', 'Attendance')
+    AttendanceCalendar = apps.get_model('attendance', 'AttendanceCalendar')
+    rows = {}
+    for student_id, class_id, day, status in Attendance.objects.values_list(
+        'student_id', 'class_enrolled_id', 'date', 'status'
+    ).iterator():
+        key = (student_id, class_id, day.year, day.month)
+        bits = rows.setdefault(key, {'marked_bits': 0, 'present_bits': 0, 'late_bits': 0})
+        mask = 1 << (day.day - 1)
+        bits['marked_bits'] |= mask
+        if status == 'present':
+            bits['present_bits'] |= mask
+        elif status == 'late':
+            bits['late_bits'] |= mask
+    AttendanceCalendar.objects.bulk_create(
+        [
+            AttendanceCalendar(student_id=s, class_enrolled_id=c, year=y, month=m, **bits)
+            for (s, c, y, m), bits in rows.items()
+        ],
+        batch_size=500,
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0008_attendance_per_subject'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceCalendar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('marked_bits', models.IntegerField(default=0)),
+                ('present_bits', models.IntegerField(default=0)),
+                ('late_bits', models.IntegerField(default=0)),
+                ('class_enrolled', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='calendar_months', to='attendance.class')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='calendar_months', to='attendance.student')),
+            ],
+            options={
+                'ordering': ['student', 'class_enrolled', 'year', 'month'],
+                'indexes': [models.Index(fields=['class_enrolled', 'year'], name='attendance__class_e_411e41_idx')],
+                'unique_together': {('student', 'class_enrolled', 'year', 'month')},
+            },
+        ),
+        migrations.RunPython(build_calendar, migrations.RunPython.noop),
+    ]
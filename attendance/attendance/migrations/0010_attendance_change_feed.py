@@ -0,0 +1,44 @@
+# Generated by Django 5.2.10 on 2026-10-19 17:36
+
+from django.db import migrations, models
+
+
+def seed_change_log(apps, schema_editor):
+    """Log every existing row as an upsert, so a feed read from cursor 0 is a full snapshot."""
+    Attendance = apps.get_model('attendance', 'Attendance')
+    AttendanceChange = apps.get_model('attendance', 'AttendanceChange')
+    AttendanceChange.objects.bulk_create(
+        (
+            AttendanceChange(attendance_id=pk, op='upsert', student_id=s, class_id=c, date=d)
+            for pk, s, c, d in Attendance.objects.order_by('id').values_list(
+                'id', 'student_id', 'class_enrolled_id', 'date'
+            ).iterator()
+        ),
+        batch_size=500,
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0009_attendance_calendar'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attendance_id', models.BigIntegerField()),
+                ('op', models.CharField(choices=[('upsert', 'Created or updated'), ('delete', 'Deleted')], max_length=10)),
+                ('student_id', models.BigIntegerField()),
+                ('class_id', models.BigIntegerField()),
+                ('date', models.DateField()),
+                ('changed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['class_id', 'id'], name='attendance__class_i_44ecd6_idx')],
+            },
+        ),
+        migrations.RunPython(seed_change_log, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.10 on 2026-10-19 18:20
+
+from django.db import migrations
+
+SQLITE_TABLE = 'attendance_student_search'
+
+
+def create_index(apps, schema_editor):
+    """FTS5 trigram table on SQLite, pg_trgm GIN index on PostgreSQL (see attendance/search.py)."""
+    vendor = schema_editor.connection.vendor
+    db_alias = schema_editor.connection.alias
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} "
+            f"USING fts5(name, student_id, group_id UNINDEXED, tokenize='trigram')"
+        )
+        Student = apps.get_model('attendance', 'Student')
+        rows = [
+            (pk, ' %s ' % ' '.join(name.lower().split()), student_id.lower(), group_id)
+            for pk, name, student_id, group_id in Student.objects.using(db_alias).values_list(
+                'id', 'name', 'student_id', 'group_id',
+            )
+        ]
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {SQLITE_TABLE} (rowid, name, student_id, group_id) VALUES (%s, %s, %s, %s)', rows,
+            )
+    elif vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS attendance_student_name_trgm '
+            'ON attendance_student USING gin (lower(name) gin_trgm_ops)'
+        )
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SQLITE_TABLE}')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS attendance_student_name_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0013_attendance_history_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
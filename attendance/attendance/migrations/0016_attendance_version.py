@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-19 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0015_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendance',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.10 on 2026-10-19 18:16
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+# Сохранённые отметки + отметки по умолчанию для учеников группы без строки (см. attendance/storage.py)
+CREATE_VIEW = """
+CREATE VIEW attendance_effective AS
+SELECT a.id, a.student_id, a.class_enrolled_id, a.date, a.status, a.notes, a.marked_at, a.version,
+       FALSE AS derived
+FROM attendance_attendance a
+UNION ALL
+SELECT -(s.id * 4294967296 + st.id), st.id, s.class_enrolled_id, s.date, s.default_status, '', s.taken_at, 1,
+       TRUE
+FROM attendance_attendancesession s
+JOIN attendance_student st ON st.group_id = s.group_id AND st.created_at <= s.taken_at
+WHERE NOT EXISTS (
+    SELECT 1 FROM attendance_attendance a2
+    WHERE a2.student_id = st.id AND a2.class_enrolled_id = s.class_enrolled_id AND a2.date = s.date
+)
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0017_soft_delete'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('default_status', models.CharField(choices=[('present', 'Present'), ('absent', 'Absent'), ('late', 'Late')], default='present', max_length=10)),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('class_enrolled', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sessions', to='attendance.class')),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sessions', to='attendance.group')),
+            ],
+            options={
+                'ordering': ['-date', 'class_enrolled', 'group'],
+                'indexes': [models.Index(fields=['group', 'date'], name='attendance__group_i_68f61a_idx')],
+                'unique_together': {('class_enrolled', 'group', 'date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='EffectiveAttendance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('status', models.CharField(choices=[('present', 'Present'), ('absent', 'Absent'), ('late', 'Late')], max_length=10)),
+                ('notes', models.TextField(blank=True)),
+                ('marked_at', models.DateTimeField()),
+                ('version', models.PositiveIntegerField()),
+                ('derived', models.BooleanField()),
+            ],
+            options={
+                'db_table': 'attendance_effective',
+                'ordering': ['-date', 'student'],
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(CREATE_VIEW, 'DROP VIEW attendance_effective'),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.10 on 2026-10-19 18:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_enrollments(apps, schema_editor):
+    """One row per student and subject of the student's group."""
+    Enrollment = apps.get_model('attendance', 'Enrollment')
+    Student = apps.get_model('attendance', 'Student')
+    GroupClasses = apps.get_model('attendance', 'Group').classes.through
+    db_alias = schema_editor.connection.alias
+    subjects = {}
+    for group_id, class_id in GroupClasses.objects.using(db_alias).values_list('group_id', 'class_id'):
+        subjects.setdefault(group_id, []).append(class_id)
+    students = Student.objects.using(db_alias).order_by('id').values_list('id', 'group_id')
+    Enrollment.objects.using(db_alias).bulk_create(
+        (
+            Enrollment(class_enrolled_id=class_id, student_id=student_id, group_id=group_id)
+            for student_id, group_id in students.iterator()
+            for class_id in subjects.get(group_id, ())
+        ),
+        batch_size=500,
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0018_attendance_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Enrollment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('class_enrolled', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='enrollments', to='attendance.class')),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='enrollments', to='attendance.group')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='enrollments', to='attendance.student')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['class_enrolled', 'group'], name='enrollment_class_group')],
+                'unique_together': {('class_enrolled', 'student')},
+            },
+        ),
+        migrations.RunPython(fill_enrollments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.10 on 2026-10-19 18:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0019_enrollment'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceAudit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attendance_id', models.BigIntegerField(blank=True, null=True)),
+                ('student_id', models.BigIntegerField()),
+                ('class_id', models.BigIntegerField()),
+                ('date', models.DateField()),
+                ('old_status', models.CharField(blank=True, max_length=10)),
+                ('new_status', models.CharField(blank=True, max_length=10)),
+                ('source', models.CharField(choices=[('web', 'Web'), ('api', 'API'), ('admin', 'Admin'), ('checkin', 'QR check-in'), ('system', 'System')], max_length=10)),
+                ('changed_at', models.DateTimeField(auto_now_add=True)),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['student_id', '-id'], name='audit_student_history'), models.Index(fields=['class_id', '-id'], name='audit_class_history')],
+            },
+        ),
+    ]
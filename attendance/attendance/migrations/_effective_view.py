@@ -0,0 +1,47 @@
+"""The ``attendance_effective`` view for migrations (see attendance/storage.py).
+
+SQLite alters a table by building a new one and renaming it, and refuses the
+rename while a view reads the table ("error in view attendance_effective: no
+such table"). A migration that alters ``attendance_attendance``,
+``attendance_attendancesession`` or ``attendance_student`` must therefore wrap
+its operations::
+
+    from ._effective_view import without_effective_view
+
+    operations = without_effective_view(
+        migrations.AlterField(model_name='attendance', name='notes', field=...),
+    )
+
+``makemigrations`` does not know about the view: wrap the generated operations
+by hand. If the view itself has to change, update ``CREATE_VIEW`` here in the
+same migration and keep the old text in the migrations that used it.
+"""
+from django.db import migrations
+
+# Сохранённые отметки + отметки по умолчанию для учеников группы без строки (как в 0018)
+CREATE_VIEW = """
+CREATE VIEW attendance_effective AS
+SELECT a.id, a.student_id, a.class_enrolled_id, a.date, a.status, a.notes, a.marked_at, a.version,
+       FALSE AS derived
+FROM attendance_attendance a
+UNION ALL
+SELECT -(s.id * 4294967296 + st.id), st.id, s.class_enrolled_id, s.date, s.default_status, '', s.taken_at, 1,
+       TRUE
+FROM attendance_attendancesession s
+JOIN attendance_student st ON st.group_id = s.group_id AND st.created_at <= s.taken_at
+WHERE NOT EXISTS (
+    SELECT 1 FROM attendance_attendance a2
+    WHERE a2.student_id = st.id AND a2.class_enrolled_id = s.class_enrolled_id AND a2.date = s.date
+)
+"""
+
+DROP_VIEW = 'DROP VIEW IF EXISTS attendance_effective'
+
+
+def without_effective_view(*operations, create_view=CREATE_VIEW):
+    """``operations`` with the view dropped before them and created again (as ``create_view``) after."""
+    return [
+        migrations.RunSQL(DROP_VIEW, create_view),
+        *operations,
+        migrations.RunSQL(create_view, DROP_VIEW),
+    ]
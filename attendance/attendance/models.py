@@ -1,8 +1,46 @@
 from django.db import models
 from django.utils import timezone
+from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
 
-class Class(models.Model):
+
+class ActiveManager(models.Manager):
+    """Default manager: hides soft-deleted rows."""
+    
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class SoftDeleteModel(models.Model):
+    """Rows are first marked deleted, then purged in batches by ``manage.py purge_attendance``."""
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True, editable=False)
+    
+    objects = ActiveManager()
+    all_objects = models.Manager()
+    
+    class Meta:
+        abstract = True
+    
+    @property
+    def is_deleted(self):
+        return self.deleted_at is not None
+    
+    def validate_unique(self, exclude=None):
+        super().validate_unique(exclude)
+        # Уникальные коды удалённых, но ещё не вычищенных строк по-прежнему заняты в БД
+        for field in self._meta.fields:
+            if not field.unique or field.primary_key or (exclude and field.name in exclude):
+                continue
+            value = getattr(self, field.attname)
+            taken = type(self).all_objects.filter(deleted_at__isnull=False, **{field.attname: value})
+            if taken.exclude(pk=self.pk).exists():
+                raise ValidationError({
+                    field.name: f'{field.verbose_name.capitalize()} "{value}" belongs to a deleted record '
+                                f'that has not been purged yet.',
+                })
+
+
+class Class(SoftDeleteModel):
     name = models.CharField(max_length=100)
     code = models.CharField(max_length=20, unique=True)
     description = models.TextField(blank=True)
@@ -17,11 +55,11 @@ class Class(models.Model):
     
     @property
     def students(self):
-        """Students in this class (via groups)."""
-        return Student.objects.filter(group__classes=self)
+        """Students in this class (via the materialized Enrollment table)."""
+        return Student.objects.filter(enrollments__class_enrolled=self)
 
 
-class Group(models.Model):
+class Group(SoftDeleteModel):
     """Учебная группа (например cs-2301). Может быть привязана к нескольким классам/курсам."""
     code = models.CharField(max_length=50, unique=True)
     name = models.CharField(max_length=100, blank=True)
@@ -36,7 +74,7 @@ class Group(models.Model):
         return self.code or self.name or str(self.id)
 
 
-class Student(models.Model):
+class Student(SoftDeleteModel):
     name = models.CharField(max_length=100)
     student_id = models.CharField(max_length=20, unique=True)
     email = models.EmailField(blank=True)
@@ -54,10 +92,46 @@ class Student(models.Model):
     def __str__(self):
         return f"{self.name} ({self.student_id})"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # сигнал пересчитывает Enrollment, только если группа сменилась
+        instance._loaded_group_id = instance.__dict__.get('group_id')
+        return instance
+    
     def has_account(self):
         return self.user_id is not None
 
 
+class Enrollment(models.Model):
+    """Student studies the subject: one row per subject of the student's group.
+    
+    Materialized from ``Student.group`` and ``Group.classes`` and kept in sync
+    by the signals in signals.py (see enrollment.py).
+    """
+    class_enrolled = models.ForeignKey(Class, on_delete=models.CASCADE, related_name='enrollments')
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='enrollments')
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='enrollments')
+    
+    class Meta:
+        unique_together = [['class_enrolled', 'student']]
+        indexes = [
+            # ростер преподавателя: предмет + его группы
+            models.Index(fields=['class_enrolled', 'group'], name='enrollment_class_group'),
+        ]
+    
+    def __str__(self):
+        return f"{self.student_id} in {self.class_enrolled_id}"
+
+
+class VersionConflict(Exception):
+    """An Attendance row was changed (or deleted) by someone else after it was loaded."""
+    
+    def __init__(self, instance):
+        self.instance = instance
+        super().__init__(f'Attendance #{instance.pk} was modified concurrently')
+
+
 # --- ВОТ ЭТА МОДЕЛЬ БЫЛА ПРОПУЩЕНА ---
 class Attendance(models.Model):
     STATUS_CHOICES = [
@@ -72,17 +146,315 @@ class Attendance(models.Model):
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='absent')
     notes = models.TextField(blank=True)
     marked_at = models.DateTimeField(auto_now_add=True)
+    # Оптимистичная блокировка: +1 при каждом изменении, UPDATE ... WHERE version = загруженная
+    version = models.PositiveIntegerField(default=1, editable=False)
     
     class Meta:
         ordering = ['-date', 'student']
         # Один студент - одна отметка по предмету в день
         unique_together = [['student', 'date', 'class_enrolled']]
+        indexes = [
+            # keyset-пагинация истории студента: ORDER BY date DESC, id DESC
+            models.Index(fields=['student', '-date', '-id'], name='attendance_student_history'),
+        ]
     
     def __str__(self):
         return f"{self.student.name} - {self.date} - {self.class_enrolled.code} - {self.status}"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем значения из БД, чтобы обработчики сигналов видели, что изменилось
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._loaded_values = {f.attname: getattr(self, f.attname) for f in self._meta.concrete_fields}
+    
+    def changed_fields(self):
+        """attnames whose value differs from what was loaded from the database."""
+        loaded = getattr(self, '_loaded_values', None) or {}
+        return [
+            f.attname for f in self._meta.concrete_fields
+            if not f.primary_key and f.attname in loaded and loaded[f.attname] != getattr(self, f.attname)
+        ]
+    
+    def save(self, *args, **kwargs):
+        """Insert, or update only the changed fields if nobody else changed the row meanwhile.
+        
+        Raises VersionConflict when the row's version is no longer the loaded one.
+        Saving an unchanged row does nothing (no query, no signals).
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        expected = None
+        if not self._state.adding and loaded and 'version' in loaded and not kwargs.get('force_insert'):
+            changed = [name for name in self.changed_fields() if name != 'version']
+            if kwargs.get('update_fields') is not None:
+                requested = {self._meta.get_field(name).attname for name in kwargs['update_fields']}
+                changed = [name for name in changed if name in requested]
+            if not changed:
+                return
+            expected = loaded['version']
+            kwargs['update_fields'] = changed + ['version']
+            self.version = expected + 1
+        self._expected_version = expected
+        try:
+            super().save(*args, **kwargs)
+        except VersionConflict:
+            self.version = expected
+            raise
+        finally:
+            self._expected_version = None
+        self._loaded_values = {f.attname: getattr(self, f.attname) for f in self._meta.concrete_fields}
+    
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        expected = getattr(self, '_expected_version', None)
+        if expected is None:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        if not super()._do_update(base_qs.filter(version=expected), using, pk_val, values, update_fields, forced_update):
+            raise VersionConflict(self)
+        return True
+    
+    def previous_state(self):
+        """(student_id, class_enrolled_id, date, status) as last loaded/saved, or None for new rows."""
+        loaded = getattr(self, '_loaded_values', None)
+        if not loaded or 'date' not in loaded or 'status' not in loaded:
+            return None
+        return (loaded['student_id'], loaded['class_enrolled_id'], loaded['date'], loaded['status'])
+    
+    def current_state(self):
+        return (self.student_id, self.class_enrolled_id, self.date, self.status)
 # -------------------------------------
 
 
+class AttendanceSession(models.Model):
+    """Attendance of a group in a subject was taken on this day.
+    
+    In the ``exceptions`` storage mode (see storage.py) only marks that differ
+    from ``default_status`` are stored as Attendance rows; every other student
+    of the group who existed at ``taken_at`` has ``default_status``.
+    """
+    class_enrolled = models.ForeignKey(Class, on_delete=models.CASCADE, related_name='sessions')
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='sessions')
+    date = models.DateField()
+    default_status = models.CharField(max_length=10, choices=Attendance.STATUS_CHOICES, default='present')
+    taken_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-date', 'class_enrolled', 'group']
+        unique_together = [['class_enrolled', 'group', 'date']]
+        indexes = [models.Index(fields=['group', 'date'])]
+    
+    def __str__(self):
+        return f"{self.class_enrolled_id} - {self.group_id} - {self.date}"
+
+
+class EffectiveAttendance(models.Model):
+    """Read-only view ``attendance_effective``: stored Attendance rows plus the rows implied by sessions.
+    
+    Implied rows have ``derived=True``, empty notes, ``marked_at`` = the session's
+    ``taken_at`` and a negative synthetic ``id``. Migrations that alter Attendance,
+    AttendanceSession or Student must drop and recreate the view around their
+    operations (``migrations/_effective_view.py``).
+    """
+    student = models.ForeignKey(Student, on_delete=models.DO_NOTHING, related_name='+', db_constraint=False)
+    class_enrolled = models.ForeignKey(Class, on_delete=models.DO_NOTHING, related_name='+', db_constraint=False)
+    date = models.DateField()
+    status = models.CharField(max_length=10, choices=Attendance.STATUS_CHOICES)
+    notes = models.TextField(blank=True)
+    marked_at = models.DateTimeField()
+    version = models.PositiveIntegerField()
+    derived = models.BooleanField()
+    
+    class Meta:
+        managed = False
+        db_table = 'attendance_effective'
+        ordering = ['-date', 'student']
+    
+    def __str__(self):
+        return f"{self.student_id} - {self.date} - {self.class_enrolled_id} - {self.status}"
+    
+    def current_state(self):
+        return (self.student_id, self.class_enrolled_id, self.date, self.status)
+
+
+class AttendanceCalendar(models.Model):
+    """Packed attendance of one student in one subject for one month (calendar heatmap).
+    
+    Bit ``day - 1`` is set in ``marked_bits`` for every recorded day, and in
+    ``present_bits`` / ``late_bits`` when the student was present / late that day.
+    Maintained on every Attendance write (see signals.py).
+    """
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='calendar_months')
+    class_enrolled = models.ForeignKey(Class, on_delete=models.CASCADE, related_name='calendar_months')
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    marked_bits = models.IntegerField(default=0)
+    present_bits = models.IntegerField(default=0)
+    late_bits = models.IntegerField(default=0)
+    
+    class Meta:
+        ordering = ['student', 'class_enrolled', 'year', 'month']
+        unique_together = [['student', 'class_enrolled', 'year', 'month']]
+        indexes = [models.Index(fields=['class_enrolled', 'year'])]
+    
+    def __str__(self):
+        return f"{self.student_id} - {self.class_enrolled_id} - {self.year}-{self.month:02d}"
+
+
+class AttendanceChange(models.Model):
+    """Change log behind the delta feed. ``id`` is the monotonically increasing change sequence."""
+    OP_CHOICES = [
+        ('upsert', 'Created or updated'),
+        ('delete', 'Deleted'),
+    ]
+    
+    attendance_id = models.BigIntegerField()
+    op = models.CharField(max_length=10, choices=OP_CHOICES)
+    student_id = models.BigIntegerField()
+    class_id = models.BigIntegerField()
+    date = models.DateField()
+    changed_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [models.Index(fields=['class_id', 'id'])]
+    
+    def __str__(self):
+        return f"#{self.id} {self.op} attendance {self.attendance_id}"
+
+
+class AttendanceAudit(models.Model):
+    """Who changed a student's status, when and through what. Append-only (see audit.py).
+    
+    The key is stored by value, so the trail outlives purged Attendance rows.
+    """
+    SOURCE_CHOICES = [
+        ('web', 'Web'),
+        ('api', 'API'),
+        ('admin', 'Admin'),
+        ('checkin', 'QR check-in'),
+        ('system', 'System'),
+    ]
+    
+    attendance_id = models.BigIntegerField(null=True, blank=True)
+    student_id = models.BigIntegerField()
+    class_id = models.BigIntegerField()
+    date = models.DateField()
+    old_status = models.CharField(max_length=10, blank=True)  # '' — отметки не было
+    new_status = models.CharField(max_length=10, blank=True)  # '' — отметка удалена
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    changed_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-id']
+        indexes = [
+            # история по студенту / по предмету: WHERE ... ORDER BY id DESC
+            models.Index(fields=['student_id', '-id'], name='audit_student_history'),
+            models.Index(fields=['class_id', '-id'], name='audit_class_history'),
+        ]
+    
+    def __str__(self):
+        return f"#{self.id} {self.student_id}/{self.class_id}/{self.date}: {self.old_status or '-'} -> {self.new_status or '-'}"
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Audit entries cannot be changed.')
+        super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        raise ValueError('Audit entries cannot be deleted.')
+
+
+class OutboxEvent(models.Model):
+    """Attendance event waiting to be delivered downstream (transactional outbox).
+    
+    Written in the same transaction as the Attendance change, delivered later by
+    ``manage.py dispatch_outbox``.
+    """
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [models.Index(fields=['dispatched_at', 'next_attempt_at'])]
+    
+    def __str__(self):
+        return f"#{self.id} {self.event_type}"
+
+
+class Job(models.Model):
+    """Background job (exports, range reports, recalculations) run by ``manage.py run_workers``."""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    result_file = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    # run_workers продлевает аренду, пока задание выполняется; просроченную забирают обратно в очередь
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='attendance_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['status', 'id'])]
+    
+    def __str__(self):
+        return f"#{self.id} {self.kind} ({self.status})"
+    
+    @property
+    def percent(self):
+        if self.status == 'done':
+            return 100
+        return round(100 * self.progress / self.total, 1) if self.total else 0
+
+
+class IdempotencyKey(models.Model):
+    """Stored response of an API write sent with an ``Idempotency-Key`` header (see idempotency.py)."""
+    key_hash = models.CharField(max_length=64, unique=True)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)  # NULL — запрос ещё выполняется
+    response = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    def __str__(self):
+        return f"{self.key_hash[:12]} ({self.status_code or 'pending'})"
+    
+    @property
+    def is_pending(self):
+        return self.status_code is None
+
+
+class CacheVersion(models.Model):
+    """Version counter of cached data (see versions.py); in the database so every worker sees a bump."""
+    key = models.CharField(max_length=100, unique=True)
+    value = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.key} = {self.value}"
+
+
 class Teacher(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -0,0 +1,148 @@
+"""Transactional outbox for downstream attendance events.
+
+``record()`` is called from the Attendance signals, i.e. inside the transaction
+that writes the attendance row, so an event exists if and only if the change was
+committed. ``dispatch_batch()`` (run by ``manage.py dispatch_outbox``) delivers
+pending events to the configured sinks with retry and exponential backoff.
+Delivery is at-least-once: consumers should de-duplicate by event ``shard`` and
+``id``.
+"""
+import json
+import random
+import urllib.request
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import sharding
+from .models import OutboxEvent
+
+DEFAULTS = {
+    'SINKS': [],
+    'BATCH_SIZE': 100,
+    'MAX_ATTEMPTS': 10,
+    'BACKOFF_BASE': 2,
+    'BACKOFF_MAX': 300,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ATTENDANCE_OUTBOX', {})}
+
+
+def attendance_payload(instance):
+    previous = instance.previous_state()
+    return {
+        'id': instance.pk,
+        'student': instance.student_id,
+        'class_enrolled': instance.class_enrolled_id,
+        'date': str(instance.date),
+        'status': instance.status,
+        'notes': instance.notes,
+        'previous_status': previous[3] if previous else None,
+    }
+
+
+def record(event_type, payload):
+    return OutboxEvent.objects.create(event_type=event_type, payload=payload)
+
+
+def record_many(event_type, payloads):
+    OutboxEvent.objects.bulk_create(
+        [OutboxEvent(event_type=event_type, payload=payload) for payload in payloads]
+    )
+
+
+class FileSink:
+    """Append events as JSON lines to a local file."""
+
+    def __init__(self, path, **options):
+        self.path = Path(path)
+
+    def send(self, events):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open('a', encoding='utf-8') as fh:
+            for event in events:
+                fh.write(json.dumps(event) + '\n')
+
+
+class HttpSink:
+    """POST the whole batch as a JSON array; any non-2xx answer is a failure."""
+
+    def __init__(self, url, timeout=5, headers=None, **options):
+        self.url = url
+        self.timeout = timeout
+        self.headers = {'Content-Type': 'application/json', **(headers or {})}
+
+    def send(self, events):
+        request = urllib.request.Request(
+            self.url, data=json.dumps(events).encode(), headers=self.headers, method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if not 200 <= response.status < 300:
+                raise OSError(f'{self.url} answered {response.status}')
+
+
+SINK_TYPES = {
+    'file': FileSink,
+    'http': HttpSink,
+}
+
+
+def build_sinks(config):
+    sinks = []
+    for sink in config['SINKS']:
+        options = dict(sink)
+        sinks.append(SINK_TYPES[options.pop('type')](**options))
+    return sinks
+
+
+def backoff(attempts, config):
+    delay = min(config['BACKOFF_BASE'] ** attempts, config['BACKOFF_MAX'])
+    # jitter, чтобы повторы после общего сбоя не шли одной волной
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+def pending(config):
+    return OutboxEvent.objects.filter(
+        dispatched_at__isnull=True,
+        next_attempt_at__lte=timezone.now(),
+        attempts__lt=config['MAX_ATTEMPTS'],
+    ).order_by('id')
+
+
+def dispatch_batch(config=None, sinks=None, batch_size=None):
+    """Deliver one batch of pending events. Returns ``(delivered, failed)`` counts."""
+    config = config or get_config()
+    sinks = build_sinks(config) if sinks is None else sinks
+    events = list(pending(config)[:batch_size or config['BATCH_SIZE']])
+    if not events or not sinks:
+        return 0, 0
+
+    body = [
+        {
+            'id': event.id,
+            'type': event.event_type,
+            'created_at': event.created_at.isoformat(),
+            'shard': sharding.current(),
+            'payload': event.payload,
+        }
+        for event in events
+    ]
+    ids = [event.id for event in events]
+    try:
+        for sink in sinks:
+            sink.send(body)
+    except Exception as exc:
+        now = timezone.now()
+        for event in events:
+            event.attempts += 1
+            event.next_attempt_at = now + backoff(event.attempts, config)
+            event.last_error = f'{type(exc).__name__}: {exc}'[:1000]
+        OutboxEvent.objects.bulk_update(events, ['attempts', 'next_attempt_at', 'last_error'])
+        return 0, len(events)
+
+    OutboxEvent.objects.filter(id__in=ids).update(dispatched_at=timezone.now(), last_error='')
+    return len(events), 0
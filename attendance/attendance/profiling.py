@@ -0,0 +1,137 @@
+"""On-demand request profiling for staff users.
+
+A staff user adds ``?_profile=1`` (or the ``X-Profile: 1`` header) to any URL.
+The view then runs under cProfile and, instead of the page, the response is a
+JSON summary: top functions by cumulative time, SQL count/time and template
+render time. The raw profile is saved to ``PROFILE_DIR`` for ``snakeviz`` /
+``pstats``. Requests without the trigger only pay for a substring check.
+"""
+import cProfile
+import io
+import inspect
+import pstats
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import JsonResponse
+from django.template.base import Template
+from django.utils import timezone
+from jinja2 import Template as Jinja2Template
+
+DEFAULTS = {
+    'ENABLED': True,
+    'QUERY_PARAM': '_profile',
+    'HEADER': 'HTTP_X_PROFILE',
+    'PROFILE_DIR': Path(settings.BASE_DIR) / 'profiles',
+    'TOP': 30,
+}
+
+
+def _profile_key(func):
+    return (inspect.getsourcefile(func), inspect.getsourcelines(func)[1], func.__name__)
+
+
+# страницы из JINJA2_VIEWS рендерит jinja2, Django-шаблон там не вызывается вовсе
+TEMPLATE_RENDERS = [_profile_key(Template.render), _profile_key(Jinja2Template.render)]
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ATTENDANCE_PROFILING', {})}
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+def _function_label(key):
+    filename, lineno, name = key
+    for marker in ('site-packages/', str(settings.BASE_DIR) + '/'):
+        if marker in filename:
+            filename = filename.split(marker, 1)[1]
+            break
+    return f'{filename}:{lineno}({name})'
+
+
+def summarize(profiler, top):
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+    template_seconds = sum(stats.stats.get(key, (0, 0, 0, 0))[3] for key in TEMPLATE_RENDERS)
+    functions = [
+        {
+            'function': _function_label(key),
+            'calls': primitive_calls if primitive_calls == total_calls else f'{total_calls}/{primitive_calls}',
+            'tottime_ms': round(tottime * 1000, 2),
+            'cumtime_ms': round(cumtime * 1000, 2),
+        }
+        for key, (primitive_calls, total_calls, tottime, cumtime, callers) in rows[:top]
+    ]
+    return functions, template_seconds
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.config = get_config()
+        if not self.config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.param = self.config['QUERY_PARAM']
+        self.header = self.config['HEADER']
+
+    def requested(self, request):
+        if self.header in request.META:
+            return True
+        return self.param in request.META.get('QUERY_STRING', '') and self.param in request.GET
+
+    def __call__(self, request):
+        if not self.requested(request) or not request.user.is_staff:
+            return self.get_response(request)
+        return self.profile(request)
+
+    def profile(self, request):
+        queries = QueryCounter()
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        wall = time.perf_counter() - started
+
+        view = getattr(request.resolver_match, 'view_name', None) or 'unresolved'
+        profile_dir = Path(self.config['PROFILE_DIR'])
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        profile_path = profile_dir / f"{timezone.now():%Y%m%d-%H%M%S-%f}-{view.replace(':', '-')}.prof"
+        profiler.dump_stats(profile_path)
+
+        functions, template_seconds = summarize(profiler, self.config['TOP'])
+        return JsonResponse({
+            'path': request.get_full_path(),
+            'view': view,
+            'status_code': response.status_code,
+            'total_ms': round(wall * 1000, 2),
+            'sql': {
+                'count': queries.count,
+                'time_ms': round(queries.seconds * 1000, 2),
+            },
+            'template_render_ms': round(template_seconds * 1000, 2),
+            'profile_file': str(profile_path),
+            'top_functions': functions,
+        })
@@ -0,0 +1,128 @@
+"""Bulk provisioning of student accounts for whole groups.
+
+Creates and links a ``User`` for every student of the given groups that has no
+account yet. Password hashing (PBKDF2, deliberately slow) is spread over a
+process pool; users are inserted with ``bulk_create`` in batches.
+"""
+import csv
+import os
+import re
+import secrets
+import string
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from . import sharding
+from .models import Student
+
+PASSWORD_ALPHABET = string.ascii_letters + string.digits
+PASSWORD_LENGTH = 12
+BATCH_SIZE = 500
+CSV_FIELDS = ['group', 'student_id', 'name', 'username', 'password']
+
+
+def generate_password(length=PASSWORD_LENGTH):
+    return ''.join(secrets.choice(PASSWORD_ALPHABET) for _ in range(length))
+
+
+def base_username(student):
+    username = re.sub(r'[^\w.@+-]', '', student.student_id.strip().lower())
+    return username or f'student{student.id}'
+
+
+def _hash_chunk(passwords):
+    return [make_password(password) for password in passwords]
+
+
+def hash_passwords(passwords, processes=None):
+    """PBKDF2-hash passwords using all cores; order is preserved."""
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(passwords) < 2:
+        return _hash_chunk(passwords)
+    chunk_size = max(1, -(-len(passwords) // (processes * 4)))
+    chunks = [passwords[i:i + chunk_size] for i in range(0, len(passwords), chunk_size)]
+    # initializer: при старте через spawn дочернему процессу нужен настроенный Django
+    with ProcessPoolExecutor(max_workers=processes, initializer=django.setup) as pool:
+        hashed = []
+        for part in pool.map(_hash_chunk, chunks):
+            hashed.extend(part)
+    return hashed
+
+
+def unlinked_students(groups):
+    return (
+        Student.objects.filter(group__in=groups, user__isnull=True)
+        .select_related('group')
+        .order_by('group__code', 'name')
+    )
+
+
+def assign_usernames(students):
+    """Username per student (its student ID), suffixed with -2, -3... when already taken."""
+    wanted = {student.id: base_username(student) for student in students}
+    taken = set(
+        User.objects.filter(username__in=set(wanted.values())).values_list('username', flat=True)
+    )
+    usernames = {}
+    for student in students:
+        base = wanted[student.id]
+        username = base
+        if username in taken:
+            taken.update(
+                User.objects.filter(username__startswith=f'{base}-').values_list('username', flat=True)
+            )
+            suffix = 2
+            while f'{base}-{suffix}' in taken:
+                suffix += 1
+            username = f'{base}-{suffix}'
+        taken.add(username)
+        usernames[student.id] = username
+    return usernames
+
+
+def provision(groups, processes=None, batch_size=BATCH_SIZE):
+    """Create accounts for unlinked students of ``groups``.
+
+    Returns a list of credential dicts (see ``CSV_FIELDS``); passwords appear
+    only here, in plain text, so hand them out and discard the file.
+    """
+    students = list(unlinked_students(groups))
+    if not students:
+        return []
+    usernames = assign_usernames(students)
+    passwords = [generate_password() for _ in students]
+    hashed = hash_passwords(passwords, processes)
+
+    users = [
+        User(username=usernames[student.id], email=student.email or '', password=password_hash)
+        for student, password_hash in zip(students, hashed)
+    ]
+    with transaction.atomic(using=sharding.current()):
+        User.objects.bulk_create(users, batch_size=batch_size)
+        user_ids = dict(
+            User.objects.filter(username__in=usernames.values()).values_list('username', 'id')
+        )
+        for student in students:
+            student.user_id = user_ids[usernames[student.id]]
+        Student.objects.bulk_update(students, ['user'], batch_size=batch_size)
+
+    return [
+        {
+            'group': student.group.code,
+            'student_id': student.student_id,
+            'name': student.name,
+            'username': usernames[student.id],
+            'password': password,
+        }
+        for student, password in zip(students, passwords)
+    ]
+
+
+def write_credentials(fh, credentials):
+    writer = csv.DictWriter(fh, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+    writer.writerows(credentials)
@@ -0,0 +1,207 @@
+"""Reference-data cache for classes, groups and teacher assignments.
+
+These rows change a few times per term but are read on almost every page, so
+they are served from two tiers:
+
+1. an in-process LRU (``LOCAL_MAX_ENTRIES`` entries per worker process);
+2. the Django cache ``CACHE_ALIAS``. Point it at a cache shared by the workers
+   (Redis, memcached) so a fresh worker does not have to hit the database
+   either; with the per-process ``LocMemCache`` each worker loads its own copy
+   (``checks.py`` warns about it).
+
+Entries are keyed by a version number kept in the database (``versions.py``),
+so every worker sees a bump whatever the cache backend. Any save/delete of
+Class, Group or Teacher, and any change of their M2M links, bumps the version
+after the transaction commits (see ``signals.py``); other processes read the
+version at most every ``VERSION_CHECK_INTERVAL`` seconds and notice the bump
+within that time. With institution shards (``sharding.py``) each shard has its
+own version and entries.
+
+Cached objects are shared between requests of a process — treat them as
+read-only.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import sharding, versions
+from .models import Class, Group, Teacher
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 24 * 3600,
+    'LOCAL_MAX_ENTRIES': 256,
+    'VERSION_CHECK_INTERVAL': 2.0,
+}
+
+VERSION_KEY = 'refcache:version'
+
+_lock = threading.Lock()
+_local = OrderedDict()
+_versions = {}  # shard -> {'value': ..., 'checked_at': ...}
+_stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'invalidations': 0}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ATTENDANCE_REFCACHE', {})}
+
+
+def _shared(config):
+    return caches[config['CACHE_ALIAS']]
+
+
+def current_version(config=None):
+    config = config or get_config()
+    now = time.monotonic()
+    _version = _versions.setdefault(sharding.current(), {'value': None, 'checked_at': 0.0})
+    if _version['value'] is not None and now - _version['checked_at'] < config['VERSION_CHECK_INTERVAL']:
+        return _version['value']
+    version = versions.get(VERSION_KEY)
+    _version.update(value=version, checked_at=now)
+    return version
+
+
+def get(name, loader):
+    """Value of entry ``name`` for the current version: local LRU, then shared cache, then ``loader()``."""
+    config = get_config()
+    version = current_version(config)
+    key = f'refcache:{version}:{name}'
+    local_key = (sharding.current(), key)
+    with _lock:
+        if local_key in _local:
+            _local.move_to_end(local_key)
+            _stats['local_hits'] += 1
+            return _local[local_key]
+
+    shared = _shared(config)
+    value = shared.get(key)
+    if value is None:
+        value = loader()
+        shared.set(key, value, timeout=config['TIMEOUT'])
+        counter = 'misses'
+    else:
+        counter = 'shared_hits'
+
+    with _lock:
+        _stats[counter] += 1
+        _local[local_key] = value
+        _local.move_to_end(local_key)
+        while len(_local) > config['LOCAL_MAX_ENTRIES']:
+            _local.popitem(last=False)
+    return value
+
+
+def _bump():
+    versions.bump([VERSION_KEY])
+    version = versions.get(VERSION_KEY)
+    alias = sharding.current()
+    with _lock:
+        for key in [key for key in _local if key[0] == alias]:
+            del _local[key]
+        _stats['invalidations'] += 1
+    # этот процесс видит новую версию сразу, остальные — через VERSION_CHECK_INTERVAL
+    _versions[alias] = {'value': version, 'checked_at': time.monotonic()}
+
+
+def invalidate():
+    """Drop every cached entry once the current transaction (if any) commits."""
+    transaction.on_commit(_bump, using=sharding.current())
+
+
+def stats():
+    config = get_config()
+    with _lock:
+        counters = dict(_stats)
+        local_entries = len(_local)
+    lookups = counters['local_hits'] + counters['shared_hits'] + counters['misses']
+    return {
+        **counters,
+        'hit_rate': round((counters['local_hits'] + counters['shared_hits']) / lookups, 3) if lookups else None,
+        'local_entries': local_entries,
+        'local_max_entries': config['LOCAL_MAX_ENTRIES'],
+        'version': current_version(config),
+    }
+
+
+# --- справочные данные ---
+
+def _load_classes():
+    return {c.id: c for c in Class.objects.all()}
+
+
+def _load_groups():
+    groups = {g.id: g for g in Group.objects.all()}
+    class_ids = {group_id: [] for group_id in groups}
+    # связи удалённой (soft delete) группы остаются в таблице до purge
+    rows = (
+        Group.classes.through.objects.filter(group__deleted_at__isnull=True)
+        .order_by('class__name').values_list('group_id', 'class_id')
+    )
+    for group_id, class_id in rows:
+        class_ids[group_id].append(class_id)
+    return {'groups': groups, 'class_ids': class_ids}
+
+
+def class_map():
+    """{id: Class}, ordered by name."""
+    return get('classes', _load_classes)
+
+
+def classes():
+    return list(class_map().values())
+
+
+def get_class(class_id):
+    try:
+        return class_map().get(int(class_id))
+    except (TypeError, ValueError):
+        return None
+
+
+def group_map():
+    """{id: Group}, ordered by code."""
+    return get('groups', _load_groups)['groups']
+
+
+def get_group(group_id):
+    try:
+        return group_map().get(int(group_id))
+    except (TypeError, ValueError):
+        return None
+
+
+def group_class_ids(group_id):
+    return get('groups', _load_groups)['class_ids'].get(group_id, [])
+
+
+def group_classes(group_id):
+    """Subjects of a group, ordered by name (same as ``group.classes.all()``)."""
+    classes_by_id = class_map()
+    return [classes_by_id[class_id] for class_id in group_class_ids(group_id) if class_id in classes_by_id]
+
+
+def teacher_scope(teacher):
+    """(class ids, group ids) assigned to a teacher."""
+    def load():
+        through_classes = Teacher.classes.through.objects.filter(teacher_id=teacher.id)
+        through_groups = Teacher.groups.through.objects.filter(teacher_id=teacher.id)
+        return (
+            frozenset(through_classes.values_list('class_id', flat=True)),
+            frozenset(through_groups.values_list('group_id', flat=True)),
+        )
+    return get(f'teacher:{teacher.id}', load)
+
+
+def teacher_classes(teacher):
+    class_ids, _ = teacher_scope(teacher)
+    return [c for c in classes() if c.id in class_ids]
+
+
+def teacher_groups_for_class(teacher, class_id):
+    """Teacher's groups that study the subject, ordered by code."""
+    _, group_ids = teacher_scope(teacher)
+    return [g for g in group_map().values() if g.id in group_ids and class_id in group_class_ids(g.id)]
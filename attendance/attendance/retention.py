@@ -0,0 +1,176 @@
+"""Soft deletion, batched purging and the attendance retention policy.
+
+Deleting a Class, Group or Student used to cascade to all of its Attendance in
+one statement, holding the SQLite write lock for minutes. Now deletion has two
+phases:
+
+1. ``soft_delete()`` only sets ``deleted_at`` (the default managers hide such
+   rows right away);
+2. ``purge_deleted()`` (``manage.py purge_attendance``) removes their
+   attendance ``BATCH_SIZE`` rows per transaction with ``PAUSE`` seconds in
+   between, so other writers get the lock, and then deletes the row itself.
+
+``purge_expired()`` uses the same batching to drop attendance older than
+``ATTENDANCE_RETENTION['YEARS']`` years. Every batch goes through the same
+hooks as a normal delete: calendar rows, trend caches, one audit row per mark,
+change feed tombstones and outbox events.
+"""
+import time
+from datetime import date
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import audit, changefeed, heatmap, outbox, refcache, search, sharding, signals, storage, trends
+from .models import Attendance, AttendanceCalendar, AttendanceSession, Class, Group, Student
+
+DEFAULTS = {
+    'YEARS': None,  # None — политика хранения выключена
+    'BATCH_SIZE': 1000,
+    'PAUSE': 0.5,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ATTENDANCE_RETENTION', {})}
+
+
+def _noop_progress(label, done, total):
+    pass
+
+
+def soft_delete(queryset):
+    """Mark Classes, Groups or Students as deleted; a Group takes its students with it."""
+    now = timezone.now()
+    ids = list(queryset.values_list('id', flat=True))
+    model = queryset.model
+    lookup = {Class: 'class_enrolled_id__in', Group: 'student__group_id__in', Student: 'student_id__in'}[model]
+    with transaction.atomic(using=sharding.current()):
+        # отметки скрытых строк пропадут из трендов — даты считаем, пока они ещё видны
+        trends.invalidate(set(
+            storage.attendances().filter(**{lookup: ids}).values_list('date', flat=True).distinct()
+        ))
+        model.all_objects.filter(id__in=ids).update(deleted_at=now)
+        if model is Group:
+            students = Student.objects.filter(group_id__in=ids)
+            student_ids = list(students.values_list('id', flat=True))
+            students.update(deleted_at=now)
+        elif model is Student:
+            student_ids = ids
+        else:
+            student_ids = []
+        for student_id in student_ids:
+            search.remove_student(student_id)
+        refcache.invalidate()
+    return len(ids)
+
+
+def delete_attendance_batches(attendances, batch_size=None, pause=None, progress=_noop_progress, label=''):
+    """Delete ``attendances`` in id order, one transaction per batch."""
+    config = get_config()
+    batch_size = batch_size or config['BATCH_SIZE']
+    pause = config['PAUSE'] if pause is None else pause
+    total = attendances.count()
+    done = 0
+    progress(label, done, total)
+    while True:
+        batch = list(attendances.order_by('id')[:batch_size])
+        if not batch:
+            break
+        with transaction.atomic(using=sharding.current()), signals.batched_delete():
+            # построчные хуки сигналов выключены: ниже они вызываются один раз на пачку
+            Attendance.objects.filter(id__in=[a.id for a in batch]).delete()
+            heatmap.refresh([a.current_state() for a in batch])
+            trends.invalidate({a.date for a in batch})
+            audit.record_many([audit.entry(a.current_state()[:3], a.status, None, a.id) for a in batch])
+            changefeed.record_many(batch, 'delete')
+            outbox.record_many('attendance.deleted', [outbox.attendance_payload(a) for a in batch])
+        done += len(batch)
+        progress(label, done, total)
+        if len(batch) < batch_size:
+            break
+        time.sleep(pause)
+    return done
+
+
+def _delete_calendar(calendar_rows, batch_size, pause):
+    while True:
+        ids = list(calendar_rows.order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return
+        AttendanceCalendar.objects.filter(id__in=ids).delete()
+        if len(ids) < batch_size:
+            return
+        time.sleep(pause)
+
+
+def pending_deletions():
+    return {
+        'classes': Class.all_objects.filter(deleted_at__isnull=False),
+        'groups': Group.all_objects.filter(deleted_at__isnull=False),
+        'students': Student.all_objects.filter(deleted_at__isnull=False),
+    }
+
+
+def purge_deleted(batch_size=None, pause=None, progress=_noop_progress):
+    """Remove soft-deleted rows with their attendance; return the number of attendance rows deleted."""
+    config = get_config()
+    batch_size = batch_size or config['BATCH_SIZE']
+    pause = config['PAUSE'] if pause is None else pause
+    pending = pending_deletions()
+    deleted = 0
+
+    for student in pending['students'].order_by('id'):
+        deleted += delete_attendance_batches(
+            Attendance.objects.filter(student_id=student.id), batch_size, pause, progress,
+            label=f'student {student.student_id}',
+        )
+        student.delete()
+
+    for group in pending['groups'].order_by('id'):
+        # обычно студенты группы уже вычищены выше; остаются только добавленные после удаления
+        deleted += delete_attendance_batches(
+            Attendance.objects.filter(student__group_id=group.id), batch_size, pause, progress,
+            label=f'group {group.code}',
+        )
+        group.delete()
+
+    for class_obj in pending['classes'].order_by('id'):
+        deleted += delete_attendance_batches(
+            Attendance.objects.filter(class_enrolled_id=class_obj.id), batch_size, pause, progress,
+            label=f'class {class_obj.code}',
+        )
+        _delete_calendar(AttendanceCalendar.objects.filter(class_enrolled_id=class_obj.id), batch_size, pause)
+        class_obj.delete()
+    return deleted
+
+
+def retention_cutoff(years, today=None):
+    """First day of the month ``years`` years ago; attendance before it is purged."""
+    today = today or date.today()
+    return date(today.year - years, today.month, 1)
+
+
+def purge_expired(years=None, batch_size=None, pause=None, progress=_noop_progress, today=None):
+    """Apply the retention policy; return the number of attendance rows deleted."""
+    config = get_config()
+    years = years or config['YEARS']
+    if not years:
+        return 0
+    batch_size = batch_size or config['BATCH_SIZE']
+    pause = config['PAUSE'] if pause is None else pause
+    cutoff = retention_cutoff(years, today)
+    deleted = delete_attendance_batches(
+        Attendance.objects.filter(date__lt=cutoff), batch_size, pause, progress,
+        label=f'older than {cutoff}',
+    )
+    # сессии режима исключений, иначе старые уроки вернулись бы как неявные строки
+    AttendanceSession.objects.filter(date__lt=cutoff).delete()
+    # граница по месяцу: календарные строки до cutoff целиком устарели
+    _delete_calendar(
+        AttendanceCalendar.objects.filter(Q(year__lt=cutoff.year) | Q(year=cutoff.year, month__lt=cutoff.month)),
+        batch_size, pause,
+    )
+    return deleted
@@ -0,0 +1,184 @@
+"""Student search index: prefix and typo-tolerant matching on name and student ID.
+
+SQLite: an FTS5 virtual table with the trigram tokenizer, one row per student
+(rowid = student id), kept in sync by the Student signals. Names are
+stored with a space on both sides so that word starts and ends form their own
+trigrams — that is what makes "ivonov" still find "Ivanov".
+
+PostgreSQL: no extra table, a pg_trgm GIN index on ``lower(name)`` created by
+migration 0014 and queried with ``word_similarity``.
+
+Other databases fall back to ``icontains``.
+"""
+import re
+
+from django.db import connections
+from django.db.models import Q
+
+from . import sharding
+from .models import Student
+
+TABLE = 'attendance_student_search'
+MIN_QUERY_LENGTH = 3
+MIN_SIMILARITY = 0.4
+CANDIDATES = 200
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+_SPACE = re.compile(r'\s+')
+
+
+def normalize(text):
+    return _SPACE.sub(' ', (text or '').lower()).strip()
+
+
+def padded(text):
+    return f' {normalize(text)} '
+
+
+def query_trigrams(query):
+    """Trigrams of the query; the last word is not closed, it may still be typed."""
+    text = ' ' + normalize(query)
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def document_trigrams(*values):
+    grams = set()
+    for value in values:
+        text = padded(value)
+        grams.update(text[i:i + 3] for i in range(len(text) - 2))
+    return grams
+
+
+def similarity(query, name, student_id):
+    """Share of query trigrams found in the student; 1.0 and above for a prefix hit."""
+    wanted = query_trigrams(query)
+    if not wanted:
+        return 0.0
+    score = len(wanted & document_trigrams(name, student_id)) / len(wanted)
+    text = normalize(query)
+    if student_id.lower().startswith(text) or padded(name).find(' ' + text) >= 0:
+        score += 1
+    return score
+
+
+def _connection():
+    return connections[sharding.current()]
+
+
+def enabled():
+    return _connection().vendor in ('sqlite', 'postgresql')
+
+
+# --- синхронизация индекса (только SQLite, в PostgreSQL индекс на самой таблице) ---
+
+def index_students(students):
+    if _connection().vendor != 'sqlite':
+        return
+    rows = [(s.id, padded(s.name), s.student_id.lower(), s.group_id) for s in students]
+    if not rows:
+        return
+    with _connection().cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+        cursor.executemany(
+            f'INSERT INTO {TABLE} (rowid, name, student_id, group_id) VALUES (%s, %s, %s, %s)', rows,
+        )
+
+
+def index_student(student):
+    index_students([student])
+
+
+def remove_student(student_id):
+    if _connection().vendor != 'sqlite':
+        return
+    with _connection().cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [student_id])
+
+
+def rebuild(batch_size=1000):
+    if _connection().vendor != 'sqlite':
+        return 0
+    with _connection().cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+    batch = []
+    total = 0
+    for student in Student.objects.only('id', 'name', 'student_id', 'group_id').iterator(chunk_size=batch_size):
+        batch.append(student)
+        if len(batch) >= batch_size:
+            index_students(batch)
+            total += len(batch)
+            batch = []
+    index_students(batch)
+    return total + len(batch)
+
+
+# --- поиск ---
+
+def _sqlite_candidates(query, group_ids):
+    match = ' OR '.join('"%s"' % gram.replace('"', '""') for gram in sorted(query_trigrams(query)))
+    sql = f'SELECT rowid, name, student_id FROM {TABLE} WHERE {TABLE} MATCH %s'
+    params = [match]
+    if group_ids is not None:
+        sql += ' AND group_id IN (%s)' % ', '.join(['%s'] * len(group_ids))
+        params.extend(group_ids)
+    sql += ' ORDER BY rank LIMIT %s'
+    params.append(CANDIDATES)
+    with _connection().cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    scored = sorted(
+        ((similarity(query, name, student_id), student_id, pk) for pk, name, student_id in rows),
+        key=lambda row: (-row[0], row[1]),
+    )
+    # есть точные совпадения по началу слова — нечёткие (ST0004 для ST0003) только мешают
+    threshold = 1.0 if scored and scored[0][0] >= 1 else MIN_SIMILARITY
+    return [pk for score, _, pk in scored if score >= threshold]
+
+
+def _postgresql_candidates(query, group_ids):
+    table = Student._meta.db_table
+    text = normalize(query)
+    sql = (
+        f'SELECT id FROM {table} '
+        f'WHERE (%s <%% lower(name) OR lower(student_id) LIKE %s)'
+    )
+    params = [text, text.replace('%', r'\%').replace('_', r'\_') + '%']
+    if group_ids is not None:
+        sql += ' AND group_id = ANY(%s)'
+        params.append(list(group_ids))
+    sql += ' ORDER BY word_similarity(%s, lower(name)) DESC, student_id LIMIT %s'
+    params.extend([text, CANDIDATES])
+    with _connection().cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_ids(query, group_ids=None, limit=DEFAULT_LIMIT):
+    """Ids of matching students, best first. ``group_ids`` restricts the result (None = all)."""
+    query = normalize(query)
+    if not query or (group_ids is not None and not group_ids):
+        return []
+    group_ids = list(group_ids) if group_ids is not None else None
+
+    if len(query) < MIN_QUERY_LENGTH or not enabled():
+        # для 1-2 символов триграмм нет — только совпадение с начала
+        students = Student.objects.filter(
+            Q(name__istartswith=query) | Q(name__icontains=' ' + query) | Q(student_id__istartswith=query)
+            if len(query) < MIN_QUERY_LENGTH else
+            Q(name__icontains=query) | Q(student_id__icontains=query)
+        )
+        if group_ids is not None:
+            students = students.filter(group_id__in=group_ids)
+        return list(students.order_by('name').values_list('id', flat=True)[:limit])
+
+    if _connection().vendor == 'sqlite':
+        return _sqlite_candidates(query, group_ids)[:limit]
+    return _postgresql_candidates(query, group_ids)[:limit]
+
+
+def search(query, group_ids=None, limit=DEFAULT_LIMIT):
+    """Matching Student objects (with group), best first."""
+    ids = search_ids(query, group_ids, limit)
+    students = Student.objects.select_related('group').in_bulk(ids)
+    return [students[pk] for pk in ids if pk in students]
@@ -1,5 +1,10 @@
 from rest_framework import serializers
-from .models import Class, Group, Student, Attendance
+from django.urls import reverse
+from django.db.models import Count, Q
+from .models import Class, Group, Student, Attendance, Job
+
+
+ACTIVE_STUDENTS = Q(enrollments__student__deleted_at__isnull=True)
 
 
 class ClassSerializer(serializers.ModelSerializer):
@@ -9,7 +14,16 @@ class ClassSerializer(serializers.ModelSerializer):
         model = Class
         fields = ['id', 'name', 'code', 'description', 'student_count', 'created_at']
     
+    @staticmethod
+    def setup_queryset(queryset):
+        """Annotate student counts so that a list is serialized without a query per class."""
+        return queryset.annotate(
+            student_total=Count('enrollments', filter=ACTIVE_STUDENTS),
+        )
+    
     def get_student_count(self, obj):
+        if hasattr(obj, 'student_total'):
+            return obj.student_total
         return obj.students.count()
 
 
@@ -20,7 +34,15 @@ class GroupSerializer(serializers.ModelSerializer):
         model = Group
         fields = ['id', 'code', 'name', 'classes', 'student_count', 'created_at']
     
+    @staticmethod
+    def setup_queryset(queryset):
+        return queryset.prefetch_related('classes').annotate(
+            student_total=Count('students', filter=Q(students__deleted_at__isnull=True)),
+        )
+    
     def get_student_count(self, obj):
+        if hasattr(obj, 'student_total'):
+            return obj.student_total
         return obj.students.count()
 
 
@@ -40,6 +62,20 @@ class AttendanceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Attendance
         fields = ['id', 'student', 'student_name', 'student_id', 'class_enrolled', 'class_name', 
-                  'date', 'status', 'notes', 'marked_at']
+                  'date', 'status', 'notes', 'marked_at', 'version']
+        read_only_fields = ['version']
 
 
+class JobSerializer(serializers.ModelSerializer):
+    percent = serializers.FloatField(read_only=True)
+    result_url = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'params', 'status', 'progress', 'total', 'percent', 'result_url',
+                  'error', 'created_at', 'started_at', 'finished_at']
+    
+    def get_result_url(self, obj):
+        if obj.status != 'done' or not obj.result_file:
+            return None
+        return reverse('api_job_result', args=[obj.id])
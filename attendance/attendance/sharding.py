@@ -0,0 +1,155 @@
+"""Institutions in separate databases.
+
+Every institution listed in ``ATTENDANCE_SHARDS`` has its own database alias
+with the full schema: its subjects, groups, students, teachers and attendance,
+and also its users and sessions, because a foreign key cannot point into
+another database. ``default`` is the shard of requests that belong to no
+institution.
+
+``ShardMiddleware`` picks the shard of a request: the host (a shard's
+``HOSTS`` or a subdomain equal to its name), otherwise the signed cookie that
+the login view sets once it has found the user's shard, otherwise
+``default``. The choice is kept in a context variable and ``ShardRouter``
+sends every ORM query there. Code that opens transactions or cursors itself
+passes ``using=sharding.current()``; background threads and streams take
+the alias with them and enter it with ``sharding.use(alias)``.
+
+``manage.py run_on_shards <command>`` runs a command (``migrate`` included)
+on every shard; ``/admin/attendance/student/all-shards/`` lists students of
+all shards.
+"""
+import heapq
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import repeat
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.http.request import split_domain_port
+
+COOKIE = 'attendance_shard'
+COOKIE_SALT = 'attendance.sharding'
+COOKIE_MAX_AGE = 365 * 24 * 3600
+
+_current = ContextVar('attendance_shard', default=DEFAULT_DB_ALIAS)
+
+
+def get_shards():
+    """``ATTENDANCE_SHARDS``: {alias: {'NAME': ..., 'HOSTS': [...]}}."""
+    return getattr(settings, 'ATTENDANCE_SHARDS', {})
+
+
+def aliases():
+    return [DEFAULT_DB_ALIAS, *get_shards()]
+
+
+def enabled():
+    return bool(get_shards())
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def use(alias):
+    """Route the queries of the block to shard ``alias``."""
+    if alias not in aliases():
+        raise ValueError(f'Unknown shard: {alias}')
+    token = _current.set(alias)
+    try:
+        yield alias
+    finally:
+        _current.reset(token)
+
+
+def activate(alias):
+    """Switch the rest of the current request (or context) to ``alias``."""
+    if alias not in aliases():
+        raise ValueError(f'Unknown shard: {alias}')
+    _current.set(alias)
+
+
+def for_host(host):
+    """Shard of a request host, or None if the host does not name one."""
+    domain, _ = split_domain_port(host)
+    shards = get_shards()
+    for alias, shard in shards.items():
+        if domain in (name.lower() for name in shard.get('HOSTS', ())):
+            return alias
+    subdomain, _, parent = domain.partition('.')
+    return subdomain if parent and subdomain in shards else None
+
+
+def find_user(username):
+    """Shards that have a user called ``username`` (usernames are unique per shard only)."""
+    from django.contrib.auth.models import User
+
+    return [alias for alias in aliases() if User.objects.using(alias).filter(username=username).exists()]
+
+
+def make_cache_key(key, key_prefix, version):
+    """``CACHES[...]['KEY_FUNCTION']``: the same ids mean different rows on different shards."""
+    return f'{key_prefix}:{version}:{_current.get()}:{key}'
+
+
+def merged(querysets, key, limit):
+    """First ``limit`` rows of per-shard ``querysets`` {alias: qs} ordered by ``key``, as (alias, obj)."""
+    streams = [zip(repeat(alias), queryset[:limit]) for alias, queryset in querysets.items()]
+    rows = heapq.merge(*streams, key=lambda row: (key(row[1]), row[0]))
+    return [row for _, row in zip(range(limit), rows)]
+
+
+class ShardRouter:
+    """Send queries to the shard of the current request; objects stay on the shard they came from."""
+
+    def _db(self, hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return _current.get()
+
+    def db_for_read(self, model, **hints):
+        return self._db(hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db(hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if obj1._state.db and obj2._state.db:
+            return obj1._state.db == obj2._state.db
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # у каждого шарда полная схема, включая auth и sessions
+        return True
+
+
+class ShardMiddleware:
+    """Pick the request's shard by host, then by the login cookie; remember it after login."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned = for_host(request.get_host()) if enabled() else None
+        alias = pinned or self.from_cookie(request) or DEFAULT_DB_ALIAS
+        request.shard = alias
+        request.shard_pinned = pinned is not None
+        token = _current.set(alias)
+        try:
+            response = self.get_response(request)
+            chosen = _current.get()
+        finally:
+            _current.reset(token)
+        if chosen != alias and not pinned:
+            response.set_signed_cookie(
+                COOKIE, chosen, salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE, httponly=True, samesite='Lax',
+            )
+        return response
+
+    def from_cookie(self, request):
+        if not enabled():
+            return None
+        alias = request.get_signed_cookie(COOKIE, default=None, salt=COOKIE_SALT)
+        return alias if alias in aliases() else None
@@ -0,0 +1,97 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from .models import Attendance, Class, Group, Student, Teacher
+from . import audit, heatmap, changefeed, enrollment, outbox, search, refcache, storage, trends
+
+_batched = ContextVar('attendance_batched_delete', default=False)
+
+
+@contextmanager
+def batched_delete():
+    """Skip the per-row Attendance delete hooks in the block; the caller runs them once per batch."""
+    token = _batched.set(True)
+    try:
+        yield
+    finally:
+        _batched.reset(token)
+
+
+@receiver(post_save, sender=Attendance)
+def attendance_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = None if created else instance.previous_state()
+    if storage.exceptions_mode():
+        # строка могла заменить или вернуть отметку по умолчанию — пересчитываем месяц целиком
+        heatmap.refresh([state for state in (previous, instance.current_state()) if state])
+    else:
+        heatmap.record_change(previous, instance.current_state())
+    trends.invalidate([instance.date, previous[2] if previous else None])
+    audit.record(previous, instance.current_state(), instance.pk)
+    changefeed.record_upsert(instance)
+    outbox.record('attendance.saved', outbox.attendance_payload(instance))
+
+
+@receiver(post_delete, sender=Attendance)
+def attendance_deleted(sender, instance, **kwargs):
+    if _batched.get():
+        return
+    if storage.exceptions_mode():
+        heatmap.refresh([instance.previous_state() or instance.current_state()])
+    else:
+        heatmap.record_change(instance.previous_state() or instance.current_state(), None)
+    trends.invalidate([instance.date])
+    audit.record(instance.previous_state() or instance.current_state(), None, instance.pk)
+    changefeed.record_delete(instance)
+    outbox.record('attendance.deleted', outbox.attendance_payload(instance))
+
+
+@receiver(post_save, sender=Student)
+def student_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_student(instance)
+    if created or instance.group_id != getattr(instance, '_loaded_group_id', None):
+        enrollment.sync_students([instance.id])
+        instance._loaded_group_id = instance.group_id
+
+
+@receiver(post_delete, sender=Student)
+def student_deleted(sender, instance, **kwargs):
+    search.remove_student(instance.id)
+
+
+# Справочные данные (предметы, группы, назначения преподавателей) — сбрасываем refcache
+@receiver(post_save, sender=Class)
+@receiver(post_delete, sender=Class)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Teacher)
+@receiver(post_delete, sender=Teacher)
+def reference_data_changed(sender, raw=False, **kwargs):
+    if not raw:
+        refcache.invalidate()
+
+
+@receiver(m2m_changed, sender=Group.classes.through)
+@receiver(m2m_changed, sender=Teacher.classes.through)
+@receiver(m2m_changed, sender=Teacher.groups.through)
+def reference_links_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        refcache.invalidate()
+
+
+@receiver(m2m_changed, sender=Group.classes.through)
+def group_classes_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        enrollment.sync_groups([instance.id])
+    elif action == 'post_clear':
+        # class.groups.clear(): связей уже нет, группы берём из записанных строк
+        enrollment.sync_groups(set(instance.enrollments.values_list('group_id', flat=True)))
+    else:
+        enrollment.sync_groups(pk_set)
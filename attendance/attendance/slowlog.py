@@ -0,0 +1,156 @@
+"""Slow-query log with view attribution.
+
+When ``ATTENDANCE_SLOWLOG['ENABLED']`` is on, SlowQueryLogMiddleware installs a
+connection ``execute_wrapper`` for every request. Statements slower than
+``THRESHOLD_MS`` are written as JSON lines to a rotating file, together with a
+normalized SQL fingerprint, the resolved view name and a trimmed app-level
+stack. ``manage.py slowlog_report`` aggregates the file by fingerprint.
+"""
+import json
+import logging
+import re
+import time
+import traceback
+import uuid
+from contextlib import ExitStack, contextmanager
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
+
+DEFAULTS = {
+    'ENABLED': False,
+    'THRESHOLD_MS': 100,
+    'PATH': Path(settings.BASE_DIR) / 'slow_queries.jsonl',
+    'MAX_BYTES': 10 * 1024 * 1024,
+    'BACKUP_COUNT': 5,
+    'STACK_DEPTH': 6,
+}
+
+logger = logging.getLogger('attendance.slowlog')
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s|\?')
+_IN_LIST = re.compile(r'\bIN \((?:\?, )*\?\)', re.IGNORECASE)
+_VALUES = re.compile(r'\bVALUES (?:\((?:\?, )*\?\)(?:, )?)+', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ATTENDANCE_SLOWLOG', {})}
+
+
+def fingerprint(sql):
+    """Normalize a statement so that queries differing only in values group together."""
+    sql = _SPACE.sub(' ', sql).strip()
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    sql = _VALUES.sub('VALUES (...)', sql)
+    return sql
+
+
+def app_stack(depth):
+    """Innermost project frames (no Django/site-packages, no this module)."""
+    base = str(settings.BASE_DIR)
+    frames = [
+        frame for frame in traceback.extract_stack()
+        if frame.filename.startswith(base)
+        and 'site-packages' not in frame.filename
+        and not frame.filename.endswith('slowlog.py')
+    ]
+    return [
+        f'{Path(frame.filename).relative_to(base)}:{frame.lineno} in {frame.name}'
+        for frame in frames[-depth:]
+    ]
+
+
+def _configure_logger(config):
+    path = Path(config['PATH'])
+    for handler in logger.handlers:
+        if getattr(handler, 'baseFilename', None) == str(path.resolve()):
+            return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    handler = RotatingFileHandler(
+        path, maxBytes=config['MAX_BYTES'], backupCount=config['BACKUP_COUNT'], encoding='utf-8',
+    )
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class SlowQueryRecorder:
+    """``execute_wrapper`` that logs statements slower than the threshold."""
+
+    def __init__(self, config, view_name=None, request=None):
+        self.threshold = config['THRESHOLD_MS'] / 1000
+        self.stack_depth = config['STACK_DEPTH']
+        self.view_name = view_name
+        self.request = request
+        self.request_id = uuid.uuid4().hex[:12]
+
+    def resolved_view(self):
+        if self.view_name:
+            return self.view_name
+        match = getattr(self.request, 'resolver_match', None)
+        if match is not None:
+            return match.view_name
+        return None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            if duration >= self.threshold:
+                self.record(sql, params, many, context, duration)
+
+    def record(self, sql, params, many, context, duration):
+        if many:
+            param_count = sum(len(p) for p in params or [])
+        else:
+            param_count = len(params or [])
+        logger.info(json.dumps({
+            'ts': timezone.now().isoformat(),
+            'duration_ms': round(duration * 1000, 2),
+            'fingerprint': fingerprint(sql),
+            'sql': sql[:2000],
+            'params': param_count,
+            'many': many,
+            'db': context['connection'].alias,
+            'view': self.resolved_view(),
+            'path': getattr(self.request, 'path', None),
+            'request_id': self.request_id,
+            'stack': app_stack(self.stack_depth),
+        }))
+
+
+@contextmanager
+def recording(view_name=None, request=None, config=None):
+    """Log slow statements on every database connection of this thread."""
+    config = config or get_config()
+    _configure_logger(config)
+    recorder = SlowQueryRecorder(config, view_name=view_name, request=request)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield recorder
+
+
+class SlowQueryLogMiddleware:
+    def __init__(self, get_response):
+        self.config = get_config()
+        if not self.config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with recording(request=request, config=self.config):
+            return self.get_response(request)
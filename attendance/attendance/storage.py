@@ -0,0 +1,246 @@
+"""Attendance storage modes.
+
+``full`` (default): every student gets an Attendance row on every lesson.
+
+``exceptions``: taking attendance records one AttendanceSession per (subject,
+group, day) and only the marks that differ from the session's
+``default_status`` (``DEFAULT_STATUS``, normally ``present``). In a healthy
+class that is a few rows per lesson instead of one per student. Reads go
+through the ``attendance_effective`` view (model EffectiveAttendance), which
+adds the implied rows back, so reports, statistics, exports, trends and the
+list/history and change feed APIs return the same data as in ``full`` mode.
+Implied rows have a negative synthetic id and cannot be edited by id until a
+non-default mark is saved for them.
+
+Switch modes with ``manage.py convert_attendance_storage`` (see DEPLOYMENT.md):
+``compact()`` turns complete lessons into sessions and drops the redundant
+rows, ``expand()`` writes the implied rows back.
+"""
+import bisect
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, Min, OuterRef
+
+from . import changefeed, outbox, sharding, trends
+from .models import Attendance, AttendanceSession, EffectiveAttendance, Student
+
+DEFAULTS = {
+    'MODE': 'full',  # 'full' | 'exceptions'
+    'DEFAULT_STATUS': 'present',
+    'BATCH_SIZE': 1000,
+}
+
+MODES = ('full', 'exceptions')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ATTENDANCE_STORAGE', {})}
+
+
+def exceptions_mode():
+    return get_config()['MODE'] == 'exceptions'
+
+
+def attendances():
+    """Base queryset for reading attendance (includes implied rows in ``exceptions`` mode).
+
+    Rows of soft-deleted students and subjects are left out: they only wait for
+    ``purge_attendance``, which works on ``Attendance`` directly.
+    """
+    model = EffectiveAttendance if exceptions_mode() else Attendance
+    return model.objects.filter(student__deleted_at__isnull=True, class_enrolled__deleted_at__isnull=True)
+
+
+def sessions_for(class_id, day, group_ids=None):
+    """{group_id: AttendanceSession} of a lesson; empty in ``full`` mode, where nothing is implied."""
+    if not exceptions_mode():
+        return {}
+    sessions = AttendanceSession.objects.filter(class_enrolled_id=class_id, date=day)
+    if group_ids is not None:
+        sessions = sessions.filter(group_id__in=group_ids)
+    return {session.group_id: session for session in sessions}
+
+
+def implied_status(student, sessions):
+    """Status a student without a stored row has on the lesson of ``sessions``, or None."""
+    session = sessions.get(student.group_id)
+    if session is None or student.created_at > session.taken_at:
+        return None
+    return session.default_status
+
+
+def take_sessions(class_id, group_ids, day):
+    """Record that attendance of the groups was taken; return {group_id: session} (``exceptions`` mode only)."""
+    if not exceptions_mode():
+        return {}
+    existing = sessions_for(class_id, day, group_ids)
+    missing = [group_id for group_id in group_ids if group_id not in existing]
+    if not missing:
+        return existing
+    default_status = get_config()['DEFAULT_STATUS']
+    AttendanceSession.objects.bulk_create(
+        [AttendanceSession(class_enrolled_id=class_id, group_id=group_id, date=day, default_status=default_status)
+         for group_id in missing],
+        ignore_conflicts=True,
+    )
+    sessions = sessions_for(class_id, day, group_ids)
+    outbox.record_many('attendance.session_taken', [
+        {
+            'class_id': class_id,
+            'group_id': group_id,
+            'date': day.isoformat(),
+            'default_status': sessions[group_id].default_status,
+        }
+        for group_id in missing
+    ])
+    # у учеников без строки появились отметки: календарь, тренды и лента изменений
+    from . import heatmap
+    students = Student.all_objects.filter(group_id__in=missing).values_list('id', flat=True)
+    heatmap.refresh({(student_id, class_id, day, None) for student_id in students})
+    trends.invalidate([day])
+    changefeed.record_many(EffectiveAttendance.objects.filter(
+        derived=True, class_enrolled_id=class_id, date=day, student__group_id__in=missing,
+    ))
+    return sessions
+
+
+# --- переход между режимами ---
+
+def _noop_progress(label, done, total):
+    pass
+
+
+def _group_rosters():
+    """{group_id: sorted created_at of its students} — who a session on a given moment covers."""
+    rosters = defaultdict(list)
+    for group_id, created_at in Student.all_objects.values_list('group_id', 'created_at'):
+        rosters[group_id].append(created_at)
+    for created in rosters.values():
+        created.sort()
+    return rosters
+
+
+def redundant_rows():
+    """Stored rows that a session already implies."""
+    session = AttendanceSession.objects.filter(
+        class_enrolled_id=OuterRef('class_enrolled_id'),
+        group_id=OuterRef('student__group_id'),
+        date=OuterRef('date'),
+        default_status=OuterRef('status'),
+        taken_at__gte=OuterRef('student__created_at'),
+    )
+    return Attendance.objects.filter(notes='').filter(Exists(session))
+
+
+def compact(batch_size=None, pause=0, progress=_noop_progress, dry_run=False):
+    """Switch stored data to ``exceptions`` form; return (sessions created, rows deleted).
+
+    Every lesson where each student of the group has a row becomes a session
+    (taken at its earliest ``marked_at``); rows equal to the session default are
+    then deleted. Lessons with missing rows stay as they are. Reads do not
+    change, except that implied rows get ``marked_at`` of the session.
+    """
+    from . import signals
+
+    config = get_config()
+    batch_size = batch_size or config['BATCH_SIZE']
+    default_status = config['DEFAULT_STATUS']
+    rosters = _group_rosters()
+    has_session = AttendanceSession.objects.filter(
+        class_enrolled_id=OuterRef('class_enrolled_id'),
+        group_id=OuterRef('student__group_id'),
+        date=OuterRef('date'),
+    )
+    lessons = (
+        Attendance.objects.filter(~Exists(has_session)).order_by()
+        .values('class_enrolled_id', 'student__group_id', 'date')
+        .annotate(rows=Count('id'), taken_at=Min('marked_at'))
+    )
+    candidates = [
+        AttendanceSession(
+            class_enrolled_id=lesson['class_enrolled_id'], group_id=lesson['student__group_id'],
+            date=lesson['date'], default_status=default_status, taken_at=lesson['taken_at'],
+        )
+        for lesson in lessons.iterator()
+        if lesson['rows'] >= bisect.bisect_right(rosters[lesson['student__group_id']], lesson['taken_at'])
+    ]
+    if dry_run:
+        return len(candidates), None
+
+    created = 0
+    for start in range(0, len(candidates), batch_size):
+        batch = candidates[start:start + batch_size]
+        with transaction.atomic(using=sharding.current()):
+            AttendanceSession.objects.bulk_create(batch, ignore_conflicts=True)
+            # сессия, из-за которой появились бы строки, которых не было, — неполный урок: убираем
+            incomplete = (
+                EffectiveAttendance.objects.filter(derived=True, date__in={s.date for s in batch})
+                .values_list('class_enrolled_id', 'student__group_id', 'date').distinct()
+            )
+            incomplete = set(incomplete) & {(s.class_enrolled_id, s.group_id, s.date) for s in batch}
+            for class_id, group_id, day in incomplete:
+                AttendanceSession.objects.filter(class_enrolled_id=class_id, group_id=group_id, date=day).delete()
+        created += len(batch) - len(incomplete)
+        progress('sessions', start + len(batch), len(candidates))
+
+    total = redundant_rows().count()
+    deleted = 0
+    while True:
+        rows = list(
+            redundant_rows().order_by('id').only('id', 'student_id', 'class_enrolled_id', 'date')[:batch_size]
+        )
+        if not rows:
+            break
+        ids = [row.id for row in rows]
+        with transaction.atomic(using=sharding.current()), signals.batched_delete():
+            # формат хранения меняется, данные нет: без календаря, аудита и outbox; лента изменений
+            # отдаст вместо удалённых id неявные строки тех же учеников
+            Attendance.objects.filter(id__in=ids).delete()
+            changefeed.record_many(rows, 'delete')
+        deleted += len(ids)
+        progress('rows', deleted, total)
+        time.sleep(pause)
+    return created, deleted
+
+
+def expand(batch_size=None, pause=0, progress=_noop_progress, dry_run=False):
+    """Write every implied row back as an Attendance row; return the number of rows created."""
+    batch_size = batch_size or get_config()['BATCH_SIZE']
+    implied = EffectiveAttendance.objects.filter(derived=True)
+    total = implied.count()
+    if dry_run:
+        return total
+    created = 0
+    while True:
+        rows = list(implied.order_by('id').values(
+            'id', 'student_id', 'class_enrolled_id', 'date', 'status', 'marked_at',
+        )[:batch_size])
+        if not rows:
+            break
+        with transaction.atomic(using=sharding.current()):
+            Attendance.objects.bulk_create(
+                [Attendance(student_id=row['student_id'], class_enrolled_id=row['class_enrolled_id'],
+                            date=row['date'], status=row['status']) for row in rows],
+                ignore_conflicts=True,
+            )
+            # marked_at — auto_now_add; возвращаем время, когда урок был отмечен
+            lessons = defaultdict(list)
+            for row in rows:
+                lessons[(row['class_enrolled_id'], row['date'], row['marked_at'])].append(row['student_id'])
+            for (class_id, day, marked_at), student_ids in lessons.items():
+                Attendance.objects.filter(
+                    class_enrolled_id=class_id, date=day, student_id__in=student_ids,
+                ).update(marked_at=marked_at)
+            # неявный id сменился на настоящий: лента отдаст новую строку и tombstone старого id
+            changefeed.record_many([
+                EffectiveAttendance(id=row['id'], student_id=row['student_id'],
+                                    class_enrolled_id=row['class_enrolled_id'], date=row['date'])
+                for row in rows
+            ])
+        created += len(rows)
+        progress('rows', created, total)
+        time.sleep(pause)
+    return created
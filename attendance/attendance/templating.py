@@ -0,0 +1,65 @@
+"""Jinja2 rendering for the large attendance tables.
+
+Rendering a 300-row roster or a long history with the Django template engine
+is a noticeable part of the response time, so the heaviest pages also exist as
+Jinja2 templates under ``jinja2/`` (same names, same HTML). Which views use
+them is set in ``ATTENDANCE_TEMPLATES["JINJA2_VIEWS"]`` (view function names);
+every other view, and every template without a port, stays on Django.
+
+``manage.py bench_templates`` compares both engines on large tables.
+"""
+from django.conf import settings
+from django.shortcuts import render as django_render
+from django.template.defaultfilters import capfirst, date as date_filter
+from django.templatetags.static import static
+from django.urls import reverse
+from django.utils.timezone import template_localtime
+from jinja2 import Environment
+
+DEFAULTS = {
+    'ENGINE': 'jinja2',  # alias в TEMPLATES
+    'JINJA2_VIEWS': ['mark_attendance', 'attendance_report', 'my_attendance'],
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ATTENDANCE_TEMPLATES', {})}
+
+
+def url(viewname, *args, **kwargs):
+    """``{{ url('class_students', class_obj.id) }}`` — the ``{% url %}`` tag."""
+    return reverse(viewname, args=args or None, kwargs=kwargs or None)
+
+
+def date(value, arg=None):
+    # как в Django-шаблонах: aware datetime сначала переводится в текущую зону
+    return date_filter(template_localtime(value), arg)
+
+
+def environment(**options):
+    env = Environment(**options)
+    env.globals.update({
+        'url': url,
+        'static': static,
+    })
+    env.filters.update({
+        'date': date,
+        'capfirst': capfirst,
+    })
+    return env
+
+
+def engine_for(request):
+    """Template engine alias for the view handling ``request`` (None — the default Django engine)."""
+    match = getattr(request, 'resolver_match', None)
+    view_name = getattr(getattr(match, 'func', None), '__name__', None)
+    config = get_config()
+    return config['ENGINE'] if view_name in config['JINJA2_VIEWS'] else None
+
+
+def render(request, template_name, context=None, content_type=None, status=None):
+    """``django.shortcuts.render`` with the engine chosen per view."""
+    return django_render(
+        request, template_name, context, content_type=content_type, status=status,
+        using=engine_for(request),
+    )
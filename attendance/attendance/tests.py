@@ -1,3 +1,704 @@
-from django.test import TestCase
+"""Query-count scaling tests, then behaviour tests.
 
-# Create your tests here.
+Every page and API endpoint is requested against datasets of 10, 100 and 1000
+students and subjects (see ``Dataset``); the number of SQL queries must not depend on the size.
+A failure lists the statements (normalized fingerprints) that grew with the
+data — the N+1 to fix.
+
+The test cases after ``AdminQueryCountTests`` check results instead of query
+counts: storage modes, and further below the write paths.
+
+    python manage.py test attendance
+"""
+import re
+from collections import Counter
+from datetime import date, timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, force_authenticate
+from django.utils import timezone
+
+from . import checkin, enrollment, heatmap, idempotency, refcache, retention, search, storage, throttling
+from .models import (
+    Attendance, AttendanceAudit, AttendanceCalendar, AttendanceSession, Class, Group, IdempotencyKey, Student, Teacher,
+)
+from .serializers import ClassSerializer, GroupSerializer
+from .slowlog import fingerprint
+
+SIZES = (10, 100, 1000)
+# Предметов у группы немного и всегда столько же: Enrollment — это ученики × предметы группы,
+# при `size` предметах набор на 1000 превращался в миллион строк
+GROUP_SUBJECTS = 10
+
+
+class Dataset:
+    """``size`` students in one group and ``size`` subjects taught by one teacher.
+
+    The group studies the first ``GROUP_SUBJECTS`` of them. Today every
+    student is marked in the first subject, and the first student in every
+    subject (so per-subject statistics also have ``size`` rows).
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.today = date.today()
+        self.group = Group.objects.create(code=f'grp-{size}', name='Group')
+        Class.objects.bulk_create([
+            Class(name=f'Subject {i:04d}', code=f'S{size}-{i:04d}') for i in range(size)
+        ])
+        self.classes = list(Class.objects.filter(code__startswith=f'S{size}-').order_by('code'))
+        self.group.classes.set(self.classes[:GROUP_SUBJECTS])
+        Student.objects.bulk_create([
+            Student(name=f'Student {i:04d}', student_id=f'{size}-{i:05d}', group=self.group)
+            for i in range(size)
+        ])
+        self.students = list(Student.objects.filter(group=self.group).order_by('student_id'))
+        self.first_class = self.classes[0]
+        self.first_student = self.students[0]
+
+        statuses = ['present', 'late', 'absent']
+        rows = [
+            Attendance(student=student, class_enrolled=self.first_class, date=self.today,
+                       status=statuses[i % 3])
+            for i, student in enumerate(self.students)
+        ]
+        rows += [
+            Attendance(student=self.first_student, class_enrolled=class_obj, date=self.today,
+                       status=statuses[i % 3])
+            for i, class_obj in enumerate(self.classes[1:])
+        ]
+        # история первого студента: по отметке за каждый из `size` прошлых дней
+        rows += [
+            Attendance(student=self.first_student, class_enrolled=self.first_class,
+                       date=self.today - timedelta(days=day), status=statuses[day % 3])
+            for day in range(1, size + 1)
+        ]
+        Attendance.objects.bulk_create(rows, batch_size=500)
+        AttendanceAudit.objects.bulk_create([
+            AttendanceAudit(student_id=row.student_id, class_id=row.class_enrolled_id, date=row.date,
+                            new_status=row.status, source='system')
+            for row in rows
+        ], batch_size=500)
+        heatmap.rebuild(Attendance.objects.filter(student__group=self.group))
+        search.rebuild()
+        enrollment.sync_groups([self.group.id])
+
+        self.teacher_user = User.objects.create_user(f'teacher{size}', password='x')
+        self.teacher = Teacher.objects.create(user=self.teacher_user, status='approved')
+        self.teacher.classes.set(self.classes)
+        self.teacher.groups.set([self.group])
+        self.student_user = User.objects.create_user(f'student{size}', password='x')
+        self.first_student.user = self.student_user
+        self.first_student.save()
+        self.admin_user = User.objects.create_superuser(f'admin{size}', f'admin{size}@example.com', 'x')
+
+
+# версия справочников читается из БД раз в VERSION_CHECK_INTERVAL — в замер это попадать не должно
+@override_settings(ATTENDANCE_REFCACHE={'VERSION_CHECK_INTERVAL': 3600})
+class QueryCountTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # все размеры строятся один раз на класс; в замере остальные скрыты (hide_other_sizes)
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.datasets = {size: Dataset(size) for size in SIZES}
+
+    def hide_other_sizes(self, size):
+        """Soft-delete the other datasets and drop their marks, so lists only show ``size`` rows."""
+        others = [data for other, data in self.datasets.items() if other != size]
+        group_ids = [data.group.id for data in others]
+        now = timezone.now()
+        Group.all_objects.filter(id__in=group_ids).update(deleted_at=now)
+        Student.all_objects.filter(group_id__in=group_ids).update(deleted_at=now)
+        Class.all_objects.filter(id__in=[c.id for data in others for c in data.classes]).update(deleted_at=now)
+        # без сигналов и хуков: откат точки сохранения всё равно вернёт строки
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {Attendance._meta.db_table} WHERE student_id IN '
+                f'(SELECT id FROM {Student._meta.db_table} WHERE group_id IN ({", ".join(["%s"] * len(group_ids))}))',
+                group_ids,
+            )
+
+    def measure(self, request, data):
+        cache.clear()
+        refcache._bump()  # локальный LRU мог пережить откат предыдущего набора данных
+        request(data)  # прогрев кэшей (refcache и т.п.): меряем установившийся режим
+        with CaptureQueriesContext(connection) as queries:
+            response = request(data)
+        self.assertLess(response.status_code, 400, f'{response.status_code} for size {data.size}')
+        return queries.captured_queries
+
+    def assertFlatQueries(self, request, login=None):
+        """Run ``request(data)`` at every size and compare the query counts."""
+        runs = {}
+        for size in SIZES:
+            savepoint = transaction.savepoint()
+            data = self.datasets[size]
+            self.hide_other_sizes(size)
+            if login:
+                self.client.force_login(getattr(data, f'{login}_user'))
+            runs[size] = self.measure(request, data)
+            self.client.logout()
+            transaction.savepoint_rollback(savepoint)
+
+        smallest = runs[SIZES[0]]
+        for size in SIZES[1:]:
+            if len(runs[size]) != len(smallest):
+                self.fail(self.growth_report(smallest, runs[size], size))
+
+    def growth_report(self, small_run, big_run, size):
+        small = Counter(fingerprint(query['sql']) for query in small_run)
+        big = Counter(fingerprint(query['sql']) for query in big_run)
+        lines = [
+            f'Query count grows with data: {len(small_run)} queries at {SIZES[0]} rows, '
+            f'{len(big_run)} at {size}. Repeated statements:'
+        ]
+        for sql, count in big.most_common():
+            if count > small.get(sql, 0):
+                lines.append(f'  {small.get(sql, 0)} -> {count}x  {sql[:300]}')
+        return '\n'.join(lines)
+
+
+class PageQueryCountTests(QueryCountTestCase):
+
+    def test_home_teacher(self):
+        self.assertFlatQueries(lambda d: self.client.get(reverse('home')), login='teacher')
+
+    def test_home_admin(self):
+        self.assertFlatQueries(lambda d: self.client.get(reverse('home')), login='admin')
+
+    def test_class_students(self):
+        self.assertFlatQueries(
+            lambda d: self.client.get(reverse('class_students', args=[d.first_class.id])), login='teacher',
+        )
+
+    def test_mark_attendance_select_group(self):
+        self.assertFlatQueries(
+            lambda d: self.client.get(reverse('mark_attendance', args=[d.first_class.id])), login='teacher',
+        )
+
+    def test_mark_attendance_form(self):
+        self.assertFlatQueries(
+            lambda d: self.client.get(
+                reverse('mark_attendance', args=[d.first_class.id]), {'group_id': d.group.id},
+            ),
+            login='teacher',
+        )
+
+    def test_mark_attendance_unchanged_submit(self):
+        def submit(d):
+            form = {}
+            for attendance in Attendance.objects.filter(class_enrolled=d.first_class, date=d.today):
+                form[f'status_{attendance.student_id}'] = attendance.status
+                form[f'original_{attendance.student_id}'] = attendance.status
+                form[f'version_{attendance.student_id}'] = attendance.version
+            url = reverse('mark_attendance', args=[d.first_class.id])
+            return self.client.post(f'{url}?group_id={d.group.id}&date={d.today}', form)
+        self.assertFlatQueries(submit, login='teacher')
+
+    def test_attendance_report(self):
+        self.assertFlatQueries(
+            lambda d: self.client.get(reverse('attendance_report', args=[d.first_class.id])), login='teacher',
+        )
+
+    def test_attendance_export(self):
+        self.assertFlatQueries(
+            lambda d: self.client.get(reverse('attendance_export', args=[d.first_class.id])), login='teacher',
+        )
+
+    def test_my_attendance(self):
+        self.assertFlatQueries(lambda d: self.client.get(reverse('my_attendance')), login='student')
+
+    def test_student_detail(self):
+        self.assertFlatQueries(
+            lambda d: self.client.get(reverse('student_detail', args=[d.first_student.id])), login='teacher',
+        )
+
+
+class ApiQueryCountTests(QueryCountTestCase):
+
+    def test_attendance_list(self):
+        self.assertFlatQueries(
+            lambda d: self.client.get(reverse('api_attendance_list'), {'class_id': d.first_class.id}),
+        )
+
+    def test_attendance_changes(self):
+        self.assertFlatQueries(lambda d: self.client.get(reverse('api_attendance_changes')))
+
+    def test_student_history(self):
+        self.assertFlatQueries(
+            lambda d: self.client.get(reverse('api_student_history', args=[d.first_student.id]), {'limit': 200}),
+            login='teacher',
+        )
+
+    def test_attendance_audit(self):
+        self.assertFlatQueries(
+            lambda d: self.client.get(reverse('api_attendance_audit'), {'class_id': d.first_class.id, 'limit': 500}),
+            login='teacher',
+        )
+
+    def test_student_calendar(self):
+        self.assertFlatQueries(
+            lambda d: self.client.get(reverse('api_student_calendar', args=[d.first_student.id])),
+            login='teacher',
+        )
+
+    def test_group_calendar(self):
+        self.assertFlatQueries(
+            lambda d: self.client.get(reverse('api_group_calendar', args=[d.group.id])), login='teacher',
+        )
+
+    def test_trends(self):
+        self.assertFlatQueries(
+            lambda d: self.client.get(reverse('api_trends'), {'class_id': d.first_class.id, 'granularity': 'day',
+                                                             'date_from': d.today - timedelta(days=30)}),
+            login='teacher',
+        )
+
+    def test_student_search(self):
+        self.assertFlatQueries(
+            lambda d: self.client.get(reverse('api_student_search'), {'q': 'student 00', 'limit': 50}),
+            login='teacher',
+        )
+
+    def test_checkin_token(self):
+        self.assertFlatQueries(
+            lambda d: self.client.get(reverse('api_checkin_token'), {'class_id': d.first_class.id,
+                                                                     'group_id': d.group.id}),
+            login='teacher',
+        )
+
+    @override_settings(ATTENDANCE_CHECKIN={'BUFFERED': False})
+    def test_checkin(self):
+        self.assertFlatQueries(
+            lambda d: self.client.post(reverse('api_checkin'), {
+                'token': checkin.make_token(d.first_class.id, d.group.id),
+            }, content_type='application/json'),
+            login='student',
+        )
+
+    def test_mark_attendance(self):
+        self.assertFlatQueries(
+            lambda d: self.client.post(reverse('api_mark_attendance'), {
+                'student_id': d.first_student.id,
+                'class_id': d.first_class.id,
+                'date': d.today.isoformat(),
+                'status': 'late',
+            }, content_type='application/json'),
+        )
+
+
+class SerializerQueryCountTests(QueryCountTestCase):
+
+    def serialize(self, serializer_class, queryset):
+        class Result:
+            status_code = 200
+        serializer_class(serializer_class.setup_queryset(queryset), many=True).data
+        return Result
+
+    def test_class_serializer(self):
+        self.assertFlatQueries(lambda d: self.serialize(ClassSerializer, Class.objects.all()))
+
+    def test_group_serializer(self):
+        self.assertFlatQueries(lambda d: self.serialize(GroupSerializer, Group.objects.all()))
+
+
+class AdminQueryCountTests(QueryCountTestCase):
+
+    def changelist(self, model):
+        return lambda d: self.client.get(reverse(f'admin:attendance_{model}_changelist'))
+
+    def test_class_changelist(self):
+        self.assertFlatQueries(self.changelist('class'), login='admin')
+
+    def test_group_changelist(self):
+        self.assertFlatQueries(self.changelist('group'), login='admin')
+
+    def test_student_changelist(self):
+        self.assertFlatQueries(self.changelist('student'), login='admin')
+
+    def test_teacher_changelist(self):
+        self.assertFlatQueries(self.changelist('teacher'), login='admin')
+
+    def test_attendance_changelist(self):
+        self.assertFlatQueries(self.changelist('attendance'), login='admin')
+
+
+EXCEPTIONS_MODE = {'MODE': 'exceptions', 'DEFAULT_STATUS': 'present'}
+
+
+@override_settings(ATTENDANCE_CHANGEFEED={'SAFETY_WINDOW': 0})
+class StorageModeTests(TestCase):
+    """``full`` and ``exceptions`` storage (storage.py) must read the same."""
+
+    def setUp(self):
+        self.today = date.today()
+        self.days = [self.today - timedelta(days=day) for day in (1, 2, 3)]
+        self.group = Group.objects.create(code='grp', name='Group')
+        self.classes = [Class.objects.create(name=f'Subject {i}', code=f'S-{i}') for i in range(2)]
+        self.group.classes.set(self.classes)
+        self.students = [
+            Student.objects.create(name=f'Student {i}', student_id=f'{i:05d}', group=self.group) for i in range(4)
+        ]
+        for d, day in enumerate(self.days):
+            for c, class_obj in enumerate(self.classes):
+                for s, student in enumerate(self.students):
+                    if (d, c, s) == (2, 1, 3):
+                        continue  # урок без одной отметки не превращается в сессию
+                    status = ['late', 'absent'][s % 2] if (d + c + s) % 4 == 0 else 'present'
+                    Attendance.objects.create(
+                        student=student, class_enrolled=class_obj, date=day, status=status,
+                        notes='sick' if (d, c, s) == (1, 0, 2) else '',
+                    )
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+
+    def stored(self):
+        return sorted(Attendance.objects.values_list('student_id', 'class_enrolled_id', 'date', 'status', 'notes'))
+
+    def rows(self, data):
+        # id и время отметки у неявных строк свои, остальное должно совпасть
+        return sorted(
+            tuple(sorted((key, value) for key, value in row.items() if key not in ('id', 'marked_at')))
+            for row in data
+        )
+
+    def snapshot(self):
+        cache.clear()
+        refcache._bump()
+        result = {}
+        for class_obj in self.classes:
+            for day in self.days:
+                response = self.client.get(reverse('attendance_report_date', args=[class_obj.id, day]))
+                self.assertContains(response, 'Student 0')
+                html = response.content.decode()
+                html = re.sub(r'\d\d:\d\d|csrfmiddlewaretoken" value="[^"]*"|\?since=[\d-]+', '', html)
+                result[('report', class_obj.id, day)] = html
+        result['list'] = self.rows(self.client.get(reverse('api_attendance_list'), {'limit': 1000}).json())
+        result['changes'] = self.rows(self.client.get(reverse('api_attendance_changes')).json()['changes'])
+        return result
+
+    def test_modes_read_the_same(self):
+        full = self.snapshot()
+        with override_settings(ATTENDANCE_STORAGE=EXCEPTIONS_MODE):
+            sessions, deleted = storage.compact()
+            self.assertEqual(sessions, 5)
+            self.assertGreater(deleted, 0)
+            exceptions = self.snapshot()
+        self.assertEqual(len(full['list']), 23)
+        self.assertEqual(len(full['changes']), 23)
+        for key in full:
+            self.assertEqual(full[key], exceptions[key], key)
+
+    def test_compact_then_expand_round_trips(self):
+        before = self.stored()
+        with override_settings(ATTENDANCE_STORAGE=EXCEPTIONS_MODE):
+            cursor = self.client.get(reverse('api_attendance_changes')).json()['cursor']
+            dropped = set(Attendance.objects.values_list('id', flat=True))
+            storage.compact()
+            dropped -= set(Attendance.objects.values_list('id', flat=True))
+            self.assertLess(len(self.stored()), len(before))
+            # офлайн-клиент забывает удалённые id и получает вместо них неявные строки
+            feed = self.client.get(reverse('api_attendance_changes'), {'since': cursor}).json()
+            self.assertEqual({row['id'] for row in feed['deleted']}, dropped)
+            self.assertEqual(len(feed['changes']), len(dropped))
+            self.assertTrue(all(row['id'] < 0 for row in feed['changes']))
+            storage.expand()
+        self.assertEqual(self.stored(), before)
+        self.assertEqual(AttendanceSession.objects.count(), 5)
+
+
+THROTTLE = {'ENDPOINT_RATES': {'api_mark_attendance': '1/min'}, 'MAX_CONCURRENT_WRITES': 1, 'SHED_RETRY_AFTER': 2}
+
+
+@override_settings(ATTENDANCE_THROTTLE=THROTTLE)
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        group = Group.objects.create(name='G', code='G')
+        self.student = Student.objects.create(student_id='S0', name='Student 0', group=group)
+        self.class_obj = Class.objects.create(name='Math', code='M')
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+
+    def mark(self, day):
+        return self.client.post(reverse('api_mark_attendance'), {
+            'student_id': self.student.id, 'class_id': self.class_obj.id,
+            'date': day.isoformat(), 'status': 'late',
+        }, content_type='application/json')
+
+    def test_rate_limit_answers_429_with_retry_after(self):
+        self.assertEqual(self.mark(date(2024, 9, 2)).status_code, 201)
+        response = self.mark(date(2024, 9, 3))
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(Attendance.objects.count(), 1)
+
+    def test_busy_writes_are_shed_with_503(self):
+        # единственный слот занят «другим запросом» этого процесса
+        self.assertTrue(throttling.take_write_slot(1))
+        try:
+            response = self.mark(date(2024, 9, 2))
+        finally:
+            throttling.release_write_slot()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '2')
+        self.assertFalse(Attendance.objects.exists())
+        self.assertEqual(throttling.writes_in_flight(), 0)
+        self.assertEqual(throttling.stats()['writes_shed'], 1)
+        # слот освободился — следующая запись проходит и тоже возвращает его
+        self.assertEqual(self.mark(date(2024, 9, 2)).status_code, 201)
+        self.assertEqual(throttling.writes_in_flight(), 0)
+
+
+class RetentionTests(TestCase):
+    def test_purge_runs_the_delete_hooks_per_batch(self):
+        group = Group.objects.create(name='G', code='G')
+        class_obj = Class.objects.create(name='Math', code='M')
+        kept, gone = [Student.objects.create(student_id=f'S{s}', name=f'Student {s}', group=group) for s in range(2)]
+        with self.captureOnCommitCallbacks(execute=True):
+            for day in range(1, 6):
+                for student in (kept, gone):
+                    Attendance.objects.create(
+                        student=student, class_enrolled=class_obj, date=date(2024, 9, day), status='late',
+                    )
+        AttendanceAudit.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            retention.soft_delete(Student.objects.filter(id=gone.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(retention.purge_deleted(batch_size=2, pause=0), 5)
+        # одна строка аудита на каждую удалённую отметку, календарь удалённого студента пуст
+        audit_rows = AttendanceAudit.objects.values_list('student_id', 'old_status', 'new_status')
+        self.assertEqual(sorted(audit_rows), [(gone.id, 'late', '')] * 5)
+        self.assertFalse(AttendanceCalendar.objects.filter(student_id=gone.id).exists())
+        self.assertEqual(AttendanceCalendar.objects.get(student_id=kept.id).marked_bits, 0b11111)
+
+
+class TeacherScopeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        refcache._bump()
+        self.class_obj = Class.objects.create(name='Math', code='M')
+        self.other_class = Class.objects.create(name='Art', code='A')
+        self.group, self.other_group = Group.objects.create(code='G1'), Group.objects.create(code='G2')
+        self.group.classes.set([self.class_obj])
+        Student.objects.create(student_id='S1', name='Anna Own', group=self.group)
+        Student.objects.create(student_id='S2', name='Anna Other', group=self.other_group)
+        teacher = Teacher.objects.create(user=User.objects.create_user('teacher', password='x'), status='approved')
+        teacher.classes.set([self.class_obj])
+        teacher.groups.set([self.group])
+        self.client.force_login(teacher.user)
+
+    def test_group_calendar_is_limited_to_own_groups(self):
+        self.assertEqual(self.client.get(reverse('api_group_calendar', args=[self.group.id])).status_code, 200)
+        self.assertEqual(self.client.get(reverse('api_group_calendar', args=[self.other_group.id])).status_code, 403)
+        response = self.client.get(reverse('api_group_calendar', args=[self.group.id]), {'class_id': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_sees_own_groups_only(self):
+        results = self.client.get(reverse('api_student_search'), {'q': 'anna'}).json()['results']
+        self.assertEqual([row['student_id'] for row in results], ['S1'])
+
+    def test_jobs_check_the_subject(self):
+        def start(class_id):
+            return self.client.post(reverse('api_jobs'), {
+                'kind': 'export', 'params': {'class_id': class_id, 'date_from': '2024-09-01', 'date_to': '2024-09-30'},
+            }, content_type='application/json')
+
+        self.assertEqual(start('abc').status_code, 400)
+        self.assertEqual(start(self.other_class.id).status_code, 403)
+        response = start(str(self.class_obj.id))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['params'], {
+            'class_id': self.class_obj.id, 'date_from': '2024-09-01', 'date_to': '2024-09-30',
+            'group_ids': [self.group.id],
+        })
+
+
+class LiveReportTests(TestCase):
+    def setUp(self):
+        self.class_obj = Class.objects.create(name='Math', code='M')
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        self.client.force_login(self.user)
+        self.url = reverse('attendance_report_date', args=[self.class_obj.id, date(2024, 9, 2)])
+
+    def test_wsgi_page_leaves_the_stream_out(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertNotContains(response, 'data-live-url')
+        self.assertFalse([q for q in queries if 'attendance_attendancechange' in q['sql']])
+        with override_settings(ATTENDANCE_LIVE={'STREAM_ELSEWHERE': True}):
+            self.assertContains(self.client.get(self.url), '/live/?since=0-0')
+
+    async def test_asgi_page_subscribes(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url)
+        self.assertContains(response, '/live/?since=0-0')
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        group = Group.objects.create(name='G', code='G')
+        self.student = Student.objects.create(student_id='S0', name='Student 0', group=group)
+        self.class_obj = Class.objects.create(name='Math', code='M')
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        self.client.force_login(self.user)
+
+    def mark(self, key, status='late'):
+        return self.client.post(reverse('api_mark_attendance'), {
+            'student_id': self.student.id, 'class_id': self.class_obj.id, 'date': '2024-09-02', 'status': status,
+        }, content_type='application/json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_replayed_key_returns_the_stored_response(self):
+        first = self.mark('k1')
+        self.assertEqual(first.status_code, 201)
+        Attendance.objects.update(status='absent')  # повтор не должен перезаписать более позднюю правку
+        second = self.mark('k1')
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(list(Attendance.objects.values_list('status', flat=True)), ['absent'])
+
+    def test_key_reused_with_another_body_is_rejected(self):
+        self.assertEqual(self.mark('k1').status_code, 201)
+        response = self.mark('k1', status='absent')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(list(Attendance.objects.values_list('status', flat=True)), ['late'])
+
+    def test_client_errors_are_stored(self):
+        self.assertEqual(self.mark('k1', status='sick').status_code, 400)
+        replay = self.mark('k1', status='sick')
+        self.assertEqual(replay.status_code, 400)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+
+        attendance = Attendance.objects.create(
+            student=self.student, class_enrolled=self.class_obj, date=date(2024, 9, 3), status='late',
+        )
+        url = reverse('api_attendance_detail', args=[attendance.id])
+        for _ in range(2):
+            response = self.client.put(
+                url, {'status': 'absent', 'version': attendance.version + 1},
+                content_type='application/json', HTTP_IDEMPOTENCY_KEY='k2',
+            )
+            self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(IdempotencyKey.objects.filter(status_code__in=[400, 409]).count(), 2)
+
+    def test_server_errors_are_not_stored(self):
+        calls = []
+
+        @api_view(['POST'])
+        @idempotency.idempotent
+        def flaky(request):
+            calls.append(request.data)
+            return Response({}, status=503 if len(calls) == 1 else 201)
+
+        def post():
+            request = APIRequestFactory().post('/api/flaky/', {'a': 1}, format='json', HTTP_IDEMPOTENCY_KEY='k1')
+            force_authenticate(request, self.user)
+            return flaky(request)
+
+        self.assertEqual(post().status_code, 503)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        response = post()
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(len(calls), 2)
+
+    def test_concurrent_duplicate_waits_for_the_first_request(self):
+        first = self.mark('k1')
+        stored = IdempotencyKey.objects.get()
+        # ключ снова «в работе», как будто первый запрос ещё выполняется; он завершается во время ожидания
+        IdempotencyKey.objects.update(status_code=None)
+
+        def first_finishes(delay):
+            IdempotencyKey.objects.update(status_code=stored.status_code)
+
+        with mock.patch.object(idempotency.time, 'sleep', side_effect=first_finishes) as sleep:
+            second = self.mark('k1')
+        self.assertTrue(sleep.called)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(Attendance.objects.count(), 1)
+
+        IdempotencyKey.objects.update(status_code=None)
+        with override_settings(ATTENDANCE_IDEMPOTENCY={'WAIT_TIMEOUT': 0}):
+            busy = self.mark('k1')
+        self.assertEqual(busy.status_code, 409)
+        self.assertEqual(busy['Retry-After'], '1')
+
+
+class VersionConflictTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.class_obj = Class.objects.create(name='Math', code='M')
+        group = Group.objects.create(name='G', code='G')
+        group.classes.set([self.class_obj])
+        self.edited, self.fresh = [
+            Student.objects.create(student_id=f'S{s}', name=f'Student {s}', group=group) for s in range(2)
+        ]
+        self.attendance = Attendance.objects.create(
+            student=self.edited, class_enrolled=self.class_obj, date=date(2024, 9, 2), status='present',
+        )
+        # кто-то другой успел поменять отметку после того, как форма/клиент её прочитали
+        self.attendance.status = 'late'
+        self.attendance.save()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+
+    def stored(self):
+        return list(Attendance.objects.order_by('id').values_list('id', 'status', 'version', 'notes'))
+
+    def submit(self, rows):
+        """POST the mark form with {student: (status, original status, version)}."""
+        url = reverse('mark_attendance', args=[self.class_obj.id]) + '?date=2024-09-02'
+        data = {}
+        for student, (status, original, version) in rows.items():
+            data.update({
+                f'status_{student.id}': status, f'original_{student.id}': original, f'version_{student.id}': version,
+            })
+        return self.client.post(url, data)
+
+    def test_mark_form_reports_conflict(self):
+        before = self.stored()
+        response = self.submit({self.edited: ('absent', 'present', 1), self.fresh: ('late', '', 0)})
+        self.assertEqual(response.status_code, 409)
+        self.assertContains(response, 'changed by someone else', status_code=409)
+        # устаревшая строка не тронута, остальные изменения формы сохранены
+        self.assertEqual(self.stored()[0], before[0])
+        self.assertEqual(
+            list(Attendance.objects.filter(student=self.fresh).values_list('status', 'version')), [('late', 1)],
+        )
+
+    def test_api_rejects_stale_version(self):
+        before = self.stored()
+        url = reverse('api_attendance_detail', args=[self.attendance.id])
+        response = self.client.put(url, {'status': 'absent', 'version': 1}, content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['current']['version'], 2)
+        self.assertEqual(self.client.delete(url, HTTP_IF_MATCH='"1"').status_code, 409)
+        self.assertEqual(self.stored(), before)
+
+    def test_unchanged_rows_are_skipped(self):
+        Attendance.objects.create(
+            student=self.fresh, class_enrolled=self.class_obj, date=date(2024, 9, 2), status='present',
+        )
+        before = self.stored()
+        audit_rows = AttendanceAudit.objects.count()
+        # статус совпадает с исходным: устаревшая версия не важна, строку не пишем
+        response = self.submit({self.edited: ('late', 'late', 1), self.fresh: ('present', 'present', 1)})
+        self.assertEqual(response.status_code, 302)
+        url = reverse('api_attendance_detail', args=[self.attendance.id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(url, {'status': 'late', 'version': 2}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in queries if q['sql'].startswith('UPDATE "attendance_attendance"')])
+        self.assertEqual(self.stored(), before)
+        self.assertEqual(AttendanceAudit.objects.count(), audit_rows)
@@ -0,0 +1,232 @@
+"""Rate limiting and load shedding for the JSON API.
+
+Two DRF throttles, both token buckets kept in the Django cache:
+
+* ``ClientRateThrottle`` — one bucket per client (user id, or IP for anonymous
+  callers such as card readers) shared by every API endpoint;
+* ``EndpointRateThrottle`` — one bucket per client and endpoint, with
+  per-endpoint rates in ``ENDPOINT_RATES``.
+
+A throttled call gets 429 with ``Retry-After``. On top of that
+``WriteConcurrencyMiddleware`` caps the number of API writes in flight in each
+process and answers the excess with 503 before the view touches the database.
+
+With the default LocMemCache every gunicorn process has its own buckets and
+counters; point ``CACHE_ALIAS`` at a shared cache (Redis, memcached) to make
+the rate limits global. The write cap always stays per process: the slots are
+a plain counter in memory, so a crashed process cannot leave them taken.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import JsonResponse
+from rest_framework.throttling import BaseThrottle
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'default',
+    'CLIENT_RATE': '600/min',
+    'ENDPOINT_RATE': '120/min',
+    'ENDPOINT_RATES': {},
+    'MAX_CONCURRENT_WRITES': 8,
+    'WRITE_PATH_PREFIXES': ['/api/'],
+    # пишут только в буфер процесса (см. checkin.py) — не занимают слот записи
+    'WRITE_PATH_EXEMPT': ['/api/checkin/'],
+    'SHED_RETRY_AFTER': 2,
+}
+
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# get + set в кэше не атомарны; блокировка убирает гонки хотя бы между потоками процесса
+_bucket_lock = threading.Lock()
+
+# слоты записи процесса: счётчик в памяти не истекает и не уходит в минус
+_writes_lock = threading.Lock()
+_writes_in_flight = 0
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ATTENDANCE_THROTTLE', {})}
+
+
+def get_cache(config=None):
+    return caches[(config or get_config())['CACHE_ALIAS']]
+
+
+def parse_rate(rate):
+    """'60/min' -> (capacity 60, refill 1.0 token per second)."""
+    count, period = rate.split('/')
+    count = int(count)
+    seconds = PERIODS[period]
+    return count, count / seconds
+
+
+def take_token(cache, key, capacity, refill_per_second):
+    """Take one token from the bucket; return (allowed, seconds until the next token)."""
+    now = time.time()
+    with _bucket_lock:
+        tokens, stamp = cache.get(key) or (capacity, now)
+        tokens = min(capacity, tokens + (now - stamp) * refill_per_second)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        # через capacity / refill секунд корзина снова полная — хранить дольше незачем
+        cache.set(key, (tokens, now), timeout=int(capacity / refill_per_second) + 1)
+    if allowed:
+        return True, 0
+    return False, (1 - tokens) / refill_per_second
+
+
+def take_write_slot(limit):
+    global _writes_in_flight
+    with _writes_lock:
+        if _writes_in_flight >= limit:
+            return False
+        _writes_in_flight += 1
+        return True
+
+
+def release_write_slot():
+    global _writes_in_flight
+    with _writes_lock:
+        _writes_in_flight -= 1
+
+
+def writes_in_flight():
+    with _writes_lock:
+        return _writes_in_flight
+
+
+def count(cache, name):
+    key = f'throttle:stats:{name}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    scope = None
+
+    def __init__(self):
+        self.config = get_config()
+        self.wait_seconds = None
+
+    def get_rate(self, request, view):
+        raise NotImplementedError
+
+    def get_bucket_key(self, request, view):
+        raise NotImplementedError
+
+    def client_ident(self, request):
+        if request.user and request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+        return f'ip:{self.get_ident(request)}'
+
+    def endpoint_name(self, request):
+        match = getattr(request, 'resolver_match', None)
+        return match.url_name if match and match.url_name else request.path
+
+    def allow_request(self, request, view):
+        if not self.config['ENABLED']:
+            return True
+        cache = get_cache(self.config)
+        capacity, refill = parse_rate(self.get_rate(request, view))
+        allowed, self.wait_seconds = take_token(
+            cache, self.get_bucket_key(request, view), capacity, refill,
+        )
+        outcome = 'allowed' if allowed else 'throttled'
+        count(cache, f'{self.scope}:{self.endpoint_name(request)}:{outcome}')
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class ClientRateThrottle(TokenBucketThrottle):
+    scope = 'client'
+
+    def get_rate(self, request, view):
+        return self.config['CLIENT_RATE']
+
+    def get_bucket_key(self, request, view):
+        return f'throttle:client:{self.client_ident(request)}'
+
+
+class EndpointRateThrottle(TokenBucketThrottle):
+    scope = 'endpoint'
+
+    def get_rate(self, request, view):
+        return self.config['ENDPOINT_RATES'].get(self.endpoint_name(request), self.config['ENDPOINT_RATE'])
+
+    def get_bucket_key(self, request, view):
+        return f'throttle:endpoint:{self.endpoint_name(request)}:{self.client_ident(request)}'
+
+
+class WriteConcurrencyMiddleware:
+    """Answer API writes beyond MAX_CONCURRENT_WRITES per process with 503 instead of queueing them on the DB."""
+
+    def __init__(self, get_response):
+        self.config = get_config()
+        if not self.config['ENABLED'] or not self.config['MAX_CONCURRENT_WRITES']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.limit = self.config['MAX_CONCURRENT_WRITES']
+        self.prefixes = tuple(self.config['WRITE_PATH_PREFIXES'])
+        self.exempt = tuple(self.config['WRITE_PATH_EXEMPT'])
+
+    def __call__(self, request):
+        if (request.method in SAFE_METHODS or not request.path.startswith(self.prefixes)
+                or request.path.startswith(self.exempt)):
+            return self.get_response(request)
+
+        if not take_write_slot(self.limit):
+            count(get_cache(self.config), 'shed')
+            response = JsonResponse(
+                {'error': 'Server is busy, please retry.'}, status=503,
+            )
+            response['Retry-After'] = str(self.config['SHED_RETRY_AFTER'])
+            return response
+        try:
+            return self.get_response(request)
+        finally:
+            release_write_slot()
+
+
+def api_endpoint_names():
+    from .urls import urlpatterns
+    return [pattern.name for pattern in urlpatterns if pattern.name and pattern.name.startswith('api_')]
+
+
+def stats():
+    config = get_config()
+    cache = get_cache(config)
+    names = [
+        f'{scope}:{endpoint}:{outcome}'
+        for endpoint in api_endpoint_names()
+        for scope in ('client', 'endpoint')
+        for outcome in ('allowed', 'throttled')
+    ]
+    values = cache.get_many([f'throttle:stats:{name}' for name in names + ['shed']])
+    endpoints = {}
+    for name in names:
+        scope, endpoint, outcome = name.split(':')
+        value = values.get(f'throttle:stats:{name}', 0)
+        if value:
+            endpoints.setdefault(endpoint, {}).setdefault(scope, {})[outcome] = value
+    return {
+        'limits': {
+            'client_rate': config['CLIENT_RATE'],
+            'endpoint_rate': config['ENDPOINT_RATE'],
+            'endpoint_rates': config['ENDPOINT_RATES'],
+            'max_concurrent_writes': config['MAX_CONCURRENT_WRITES'],
+        },
+        'writes_in_flight': writes_in_flight(),
+        'writes_shed': values.get('throttle:stats:shed', 0),
+        'endpoints': endpoints,
+    }
@@ -0,0 +1,173 @@
+"""Attendance trends: present/late/absent per day, week or month.
+
+Buckets are computed in the database (``Trunc*`` + conditional ``Count``) in a
+single grouped query. Buckets that ended before today are cached; every cache
+key carries a per-bucket generation number that attendance writes to past days
+bump (see ``signals.py``), so corrections are picked up on the next call. The
+generations are kept in the database (``versions.py``) so that a correction
+made in one worker process is seen by all of them; the bumps of one
+transaction are written together when it commits.
+"""
+import threading
+from datetime import date, timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+
+from . import sharding, storage, versions
+
+GRANULARITIES = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+MAX_BUCKETS = 400
+CACHE_TIMEOUT = 30 * 24 * 3600
+EMPTY = {'total': 0, 'present': 0, 'late': 0, 'absent': 0}
+
+
+def bucket_start(day, granularity):
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(start, granularity):
+    if granularity == 'week':
+        return start + timedelta(days=7)
+    if granularity == 'month':
+        return date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start + timedelta(days=1)
+
+
+def buckets(date_from, date_to, granularity):
+    """Starts of every bucket overlapping [date_from, date_to]."""
+    start = bucket_start(date_from, granularity)
+    result = []
+    while start <= date_to:
+        result.append(start)
+        start = next_bucket(start, granularity)
+    return result
+
+
+def _generation_key(granularity, start):
+    return f'trends:gen:{granularity}:{start.isoformat()}'
+
+
+def _value_key(scope, granularity, start, generation):
+    return f'trends:{scope}:{granularity}:{start.isoformat()}:{generation}'
+
+
+_pending = threading.local()
+
+
+def _pending_keys():
+    if not hasattr(_pending, 'keys'):
+        _pending.keys = {}
+    return _pending.keys.setdefault(sharding.current(), set())
+
+
+def _flush():
+    keys = _pending_keys()
+    batch = set(keys)
+    keys.clear()
+    versions.bump(batch)
+
+
+def invalidate(days):
+    """Forget cached buckets containing any of ``days`` (for every class/group) once the transaction commits."""
+    today = date.today()
+    keys = set()
+    for day in days:
+        if day is None:
+            continue
+        for granularity in GRANULARITIES:
+            start = bucket_start(day, granularity)
+            # кэшируются только закрытые корзины; текущая всё равно считается заново
+            if next_bucket(start, granularity) <= today:
+                keys.add(_generation_key(granularity, start))
+    if not keys:
+        return
+    _pending_keys().update(keys)
+    # первый сработавший колбэк пишет всё накопленное, остальные ничего не делают; ключи отменённой
+    # транзакции уйдут с ближайшим коммитом — лишний сброс кэша безвреден
+    transaction.on_commit(_flush, using=sharding.current())
+
+
+def _scope(class_id, group_ids):
+    groups = ','.join(str(group_id) for group_id in sorted(group_ids)) if group_ids is not None else '*'
+    return f'c{class_id or "*"}:g{groups}'
+
+
+def _query(class_id, group_ids, date_from, date_to, granularity):
+    attendances = storage.attendances().filter(date__gte=date_from, date__lte=date_to)
+    if class_id:
+        attendances = attendances.filter(class_enrolled_id=class_id)
+    if group_ids is not None:
+        attendances = attendances.filter(student__group_id__in=group_ids)
+    rows = (
+        attendances.order_by()
+        .annotate(bucket=GRANULARITIES[granularity]('date'))
+        .values('bucket')
+        .annotate(
+            total=Count('id'),
+            present=Count('id', filter=Q(status='present')),
+            late=Count('id', filter=Q(status='late')),
+            absent=Count('id', filter=Q(status='absent')),
+        )
+    )
+    return {
+        row.pop('bucket'): row
+        for row in rows
+    }
+
+
+def trends(date_from, date_to, granularity='week', class_id=None, group_ids=None, today=None):
+    """List of buckets ``{'start', 'end', 'closed', 'total', 'present', 'late', 'absent', 'percent'}``.
+
+    The range is widened to whole buckets. ``group_ids=None`` means all groups.
+    """
+    today = today or date.today()
+    starts = buckets(date_from, date_to, granularity)
+    if len(starts) > MAX_BUCKETS:
+        raise ValueError(f'Too many {granularity} buckets (max {MAX_BUCKETS})')
+    if not starts:
+        return []
+    ends = {start: next_bucket(start, granularity) - timedelta(days=1) for start in starts}
+    scope = _scope(class_id, group_ids)
+
+    closed = [start for start in starts if ends[start] < today]
+    generations = versions.get_many(_generation_key(granularity, start) for start in closed)
+    value_keys = {
+        start: _value_key(scope, granularity, start, generations[_generation_key(granularity, start)])
+        for start in closed
+    }
+    cached = cache.get_many(list(value_keys.values()))
+    values = {start: cached[key] for start, key in value_keys.items() if key in cached}
+
+    missing = [start for start in starts if start not in values]
+    if missing:
+        # один сгруппированный запрос на все недостающие корзины
+        rows = _query(class_id, group_ids, missing[0], ends[missing[-1]], granularity)
+        fresh = {start: rows.get(start, EMPTY) for start in missing}
+        values.update(fresh)
+        cache.set_many(
+            {value_keys[start]: counts for start, counts in fresh.items() if start in value_keys},
+            timeout=CACHE_TIMEOUT,
+        )
+
+    result = []
+    for start in starts:
+        counts = values[start]
+        result.append({
+            'start': start,
+            'end': ends[start],
+            'closed': ends[start] < today,
+            **counts,
+            'percent': round(100 * counts['present'] / counts['total'], 1) if counts['total'] else None,
+        })
+    return result
@@ -13,11 +13,29 @@ urlpatterns = [
     path('class/<int:class_id>/', views.class_students, name='class_students'),
     path('class/<int:class_id>/mark/', views.mark_attendance, name='mark_attendance'),
     path('class/<int:class_id>/report/', views.attendance_report, name='attendance_report'),
+    path('class/<int:class_id>/export/', views.attendance_export, name='attendance_export'),
+    path('class/<int:class_id>/report/range/', views.attendance_range_report, name='attendance_range_report'),
     path('class/<int:class_id>/report/<str:date_str>/', views.attendance_report, name='attendance_report_date'),
+    path('class/<int:class_id>/report/<str:date_str>/live/', views.attendance_live, name='attendance_live'),
     path('student/<int:student_id>/', views.student_detail, name='student_detail'),
+    path('healthz/ready/', views.readiness, name='readiness'),
     
     path('api/attendance/', api_views.api_attendance_list, name='api_attendance_list'),
+    path('api/attendance/changes/', api_views.api_attendance_changes, name='api_attendance_changes'),
+    path('api/attendance/audit/', api_views.api_attendance_audit, name='api_attendance_audit'),
     path('api/attendance/mark/', api_views.api_mark_attendance, name='api_mark_attendance'),
     path('api/attendance/<int:attendance_id>/', api_views.api_attendance_detail, name='api_attendance_detail'),
+    path('api/jobs/', api_views.api_jobs, name='api_jobs'),
+    path('api/jobs/<int:job_id>/', api_views.api_job_detail, name='api_job_detail'),
+    path('api/jobs/<int:job_id>/result/', api_views.api_job_result, name='api_job_result'),
+    path('api/students/search/', api_views.api_student_search, name='api_student_search'),
+    path('api/students/<int:student_id>/history/', api_views.api_student_history, name='api_student_history'),
+    path('api/calendar/student/<int:student_id>/', api_views.api_student_calendar, name='api_student_calendar'),
+    path('api/calendar/group/<int:group_id>/', api_views.api_group_calendar, name='api_group_calendar'),
+    path('api/checkin/', api_views.api_checkin, name='api_checkin'),
+    path('api/checkin/token/', api_views.api_checkin_token, name='api_checkin_token'),
+    path('api/trends/', api_views.api_trends, name='api_trends'),
+    path('api/throttle/stats/', api_views.api_throttle_stats, name='api_throttle_stats'),
+    path('api/refcache/stats/', api_views.api_refcache_stats, name='api_refcache_stats'),
 ]
 
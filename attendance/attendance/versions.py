@@ -0,0 +1,34 @@
+"""Version counters of cached data, kept in the database.
+
+Cached entries (``refcache``, closed ``trends`` buckets) are keyed by a version
+number and bumping the number invalidates them. The Django cache cannot hold
+the numbers themselves: with the default ``LocMemCache`` every worker process
+has its own copy and would never see another worker's bump. A counter that is
+missing reads as 0.
+"""
+from django.db.models import F
+
+from .models import CacheVersion
+
+
+def get_many(keys):
+    """{key: version} for ``keys``, 0 for the ones never bumped."""
+    keys = list(keys)
+    if not keys:
+        return {}
+    found = dict(CacheVersion.objects.filter(key__in=keys).values_list('key', 'value'))
+    return {key: found.get(key, 0) for key in keys}
+
+
+def get(key):
+    return get_many([key])[key]
+
+
+def bump(keys):
+    """Increment the counters of ``keys`` (creating them first), two statements for any number of keys."""
+    keys = sorted(set(keys))
+    if not keys:
+        return
+    # сначала создаём недостающие, потом увеличиваем все: каждый вызов гарантированно меняет номер
+    CacheVersion.objects.bulk_create([CacheVersion(key=key) for key in keys], ignore_conflicts=True)
+    CacheVersion.objects.filter(key__in=keys).update(value=F('value') + 1)
@@ -1,14 +1,19 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, Http404, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import ensure_csrf_cookie
-from django.db.models import Q
+from django.db import IntegrityError, transaction
+from django.db.models import Q, Count
+from django.urls import reverse
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from asgiref.sync import sync_to_async
 from datetime import date, timedelta
-from .models import Class, Group, Student, Attendance, Teacher
+from .models import Student, Attendance, Enrollment, Teacher, VersionConflict
 from .forms import UserRegistrationForm, UserLoginForm, TeacherRegistrationForm, StudentRegistrationForm
+from . import exports, history, jobs, live, refcache, sharding, storage, templating, warmup
 
 
 def get_teacher(request):
@@ -22,14 +27,23 @@ def get_teacher(request):
         return None
 
 
+def get_class_or_404(class_id):
+    """Class from the reference-data cache (see refcache.py)."""
+    class_obj = refcache.get_class(class_id)
+    if class_obj is None:
+        raise Http404('No Class matches the given query.')
+    return class_obj
+
+
 def get_student(request):
     """Return Student linked to request.user or None."""
     if not request.user.is_authenticated:
         return None
     try:
-        return request.user.student_profile
+        student = request.user.student_profile
     except Student.DoesNotExist:
         return None
+    return None if student.is_deleted else student
 
 
 def register_choice(request):
@@ -62,6 +76,20 @@ def register_student(request):
     return render(request, 'attendance/register_student.html', {'form': form})
 
 
+def _authenticate_on_shards(request, username, password):
+    """Authenticate on the request's shard; on a host without one, on the shards that know the username."""
+    if not sharding.enabled() or request.shard_pinned:
+        return authenticate(request, username=username, password=password)
+    for alias in sharding.find_user(username):
+        with sharding.use(alias):
+            user = authenticate(request, username=username, password=password)
+        if user is not None:
+            # сессия и дальнейшие запросы — в базе учреждения пользователя (cookie ставит ShardMiddleware)
+            sharding.activate(alias)
+            return user
+    return None
+
+
 def user_login(request):
     if request.user.is_authenticated:
         return redirect('home')
@@ -71,7 +99,7 @@ def user_login(request):
         if form.is_valid():
             username = form.cleaned_data.get('username')
             password = form.cleaned_data.get('password')
-            user = authenticate(request, username=username, password=password)
+            user = _authenticate_on_shards(request, username, password)
             if user is not None:
                 login(request, user)
                 messages.success(request, f'Welcome back, {username}!')
@@ -94,29 +122,103 @@ def user_login(request):
     return render(request, 'attendance/login.html', {'form': form})
 
 
+def class_student_counts(class_ids):
+    """{class_id: number of students} in one query, same as ``class_obj.students.count()`` per class."""
+    rows = (
+        Enrollment.objects.filter(class_enrolled_id__in=class_ids, student__deleted_at__isnull=True).order_by()
+        .values('class_enrolled_id').annotate(total=Count('id'))
+    )
+    return {row['class_enrolled_id']: row['total'] for row in rows}
+
+
+def group_student_counts(group_ids):
+    return dict(
+        Student.objects.filter(group_id__in=group_ids).order_by()
+        .values('group_id').annotate(total=Count('id')).values_list('group_id', 'total')
+    )
+
+
+def teacher_today(teacher, day):
+    """Marking status of every (subject, group) pair of the teacher for one day.
+
+    Two queries regardless of the number of pairs: one GROUP BY over the day's
+    attendance, one for group sizes. Pairs come from the reference-data cache.
+    """
+    class_ids, group_ids = refcache.teacher_scope(teacher)
+    groups = refcache.group_map()
+    pairs = [
+        (class_obj, groups[group_id])
+        for class_obj in refcache.teacher_classes(teacher)
+        for group_id in sorted(group_ids, key=lambda group_id: groups[group_id].code)
+        if group_id in groups and class_obj.id in refcache.group_class_ids(group_id)
+    ]
+    if not pairs:
+        return []
+    counts = {
+        (row['class_enrolled_id'], row['student__group_id']): row
+        for row in storage.attendances().filter(
+            date=day,
+            class_enrolled_id__in=class_ids,
+            student__group_id__in=group_ids,
+        ).order_by().values('class_enrolled_id', 'student__group_id').annotate(
+            total=Count('id'),
+            present=Count('id', filter=Q(status='present')),
+            absent=Count('id', filter=Q(status='absent')),
+            late=Count('id', filter=Q(status='late')),
+        )
+    }
+    group_sizes = group_student_counts(group_ids)
+    empty = {'total': 0, 'present': 0, 'absent': 0, 'late': 0}
+    rows = []
+    for class_obj, group in pairs:
+        row = counts.get((class_obj.id, group.id), empty)
+        size = group_sizes.get(group.id, 0)
+        rows.append({
+            'class': class_obj,
+            'group': group,
+            'students': size,
+            'marked': row['total'],
+            'present': row['present'],
+            'absent': row['absent'],
+            'late': row['late'],
+            'state': 'done' if size and row['total'] >= size else ('partial' if row['total'] else 'todo'),
+        })
+    return rows
+
+
 def home(request):
     teacher = get_teacher(request)
     student = get_student(request)
     # Студент после входа видит свою посещаемость; на главную попадают только преподаватели/админы
     if student:
         return redirect('my_attendance')
+    today = date.today()
     if teacher:
-        classes = teacher.classes.all()
+        classes = refcache.teacher_classes(teacher)
+        today_rows = teacher_today(teacher, today)
     else:
-        classes = Class.objects.all()
-    return render(request, 'attendance/home.html', {'classes': classes, 'is_teacher': teacher is not None})
+        classes = refcache.classes()
+        today_rows = None
+    student_counts = class_student_counts([c.id for c in classes])
+    return render(request, 'attendance/home.html', {
+        'courses': [(class_obj, student_counts.get(class_obj.id, 0)) for class_obj in classes],
+        'is_teacher': teacher is not None,
+        'today': today,
+        'today_rows': today_rows,
+    })
 
 
 def class_students(request, class_id):
     if get_student(request):
         return redirect('my_attendance')
-    class_obj = get_object_or_404(Class, id=class_id)
+    class_obj = get_class_or_404(class_id)
     teacher = get_teacher(request)
     if teacher:
-        if class_obj not in teacher.classes.all():
+        teacher_class_ids, teacher_group_ids = refcache.teacher_scope(teacher)
+        if class_obj.id not in teacher_class_ids:
             messages.error(request, 'You do not have access to this subject.')
             return redirect('home')
-        students = class_obj.students.filter(group__in=teacher.groups.all()).select_related('group')
+        students = class_obj.students.filter(group_id__in=teacher_group_ids).select_related('group')
     else:
         students = class_obj.students.select_related('group').all()
     return render(request, 'attendance/class_students.html', {
@@ -126,31 +228,54 @@ def class_students(request, class_id):
     })
 
 
+def _roster_state(students, class_obj, attendance_date):
+    """Attach today's status and row version to every student; return {student_id: Attendance}."""
+    existing = {
+        attendance.student_id: attendance
+        for attendance in Attendance.objects.filter(
+            class_enrolled=class_obj, date=attendance_date, student__in=[s.id for s in students],
+        )
+    }
+    # режим исключений: у ученика без строки статус по умолчанию из сессии урока
+    sessions = storage.sessions_for(class_obj.id, attendance_date, {s.group_id for s in students})
+    for student in students:
+        attendance = existing.get(student.id)
+        implied = storage.implied_status(student, sessions)
+        student.current_status = attendance.status if attendance else (implied or 'absent')
+        student.original_status = attendance.status if attendance else (implied or '')
+        student.version = attendance.version if attendance else 0
+    return existing
+
+
 def mark_attendance(request, class_id):
     if get_student(request):
         return redirect('my_attendance')
-    class_obj = get_object_or_404(Class, id=class_id)
+    class_obj = get_class_or_404(class_id)
     teacher = get_teacher(request)
     group_id = request.GET.get('group_id')
     
     if teacher:
-        if class_obj not in teacher.classes.all():
+        teacher_class_ids, teacher_group_ids = refcache.teacher_scope(teacher)
+        if class_obj.id not in teacher_class_ids:
             messages.error(request, 'You do not have access to this subject.')
             return redirect('home')
         # Группы преподавателя, привязанные к этому предмету
-        allowed_groups = teacher.groups.filter(classes=class_obj)
+        allowed_groups = refcache.teacher_groups_for_class(teacher, class_obj.id)
         if not group_id:
             # Показываем выбор группы
+            group_sizes = group_student_counts([g.id for g in allowed_groups])
             return render(request, 'attendance/mark_attendance_select_group.html', {
                 'class_obj': class_obj,
-                'groups': allowed_groups,
+                'groups': [(group, group_sizes.get(group.id, 0)) for group in allowed_groups],
                 'is_teacher': True,
             })
-        group = get_object_or_404(Group, id=group_id)
-        if group not in teacher.groups.all() or class_obj not in group.classes.all():
+        group = refcache.get_group(group_id)
+        if group is None:
+            raise Http404('No Group matches the given query.')
+        if group.id not in teacher_group_ids or class_obj.id not in refcache.group_class_ids(group.id):
             messages.error(request, 'You do not have access to this group for this subject.')
             return redirect('mark_attendance', class_id=class_id)
-        students = group.students.select_related('group').all()
+        students = Student.objects.filter(group_id=group.id).select_related('group')
     else:
         students = class_obj.students.select_related('group').all()
     
@@ -160,54 +285,76 @@ def mark_attendance(request, class_id):
     except (ValueError, TypeError):
         attendance_date = date.today()
     
-    existing_attendance = {}
-    for student in students:
-        attendance = Attendance.objects.filter(
-            student=student,
-            date=attendance_date,
-            class_enrolled=class_obj
-        ).first()
-        if attendance:
-            existing_attendance[student.id] = attendance.status
-            student.current_status = attendance.status
-        else:
-            student.current_status = 'absent'
+    existing = _roster_state(students, class_obj, attendance_date)
     
     if request.method == 'POST':
+        conflicts = {}
+        # Одна транзакция на весь список: отметки и события outbox фиксируются вместе
+        with transaction.atomic(using=sharding.current()):
+            sessions = storage.take_sessions(class_obj.id, {s.group_id for s in students}, attendance_date)
+            for student in students:
+                status = request.POST.get(f'status_{student.id}', 'absent')
+                original = request.POST.get(f'original_{student.id}')
+                if original is not None and status == original:
+                    continue  # эту строку в форме не меняли — не трогаем
+                try:
+                    form_version = int(request.POST[f'version_{student.id}'])
+                except (KeyError, ValueError):
+                    form_version = None  # форма без версий — записываем поверх
+                attendance = existing.get(student.id)
+                if form_version is not None and form_version != (attendance.version if attendance else 0):
+                    conflicts[student.id] = status
+                    continue
+                if attendance is None and status == storage.implied_status(student, sessions):
+                    continue  # режим исключений: статус по умолчанию не храним
+                try:
+                    if attendance is None:
+                        with transaction.atomic(using=sharding.current()):
+                            Attendance.objects.create(
+                                student=student, date=attendance_date, class_enrolled=class_obj, status=status,
+                            )
+                    elif attendance.status != status:
+                        attendance.status = status
+                        attendance.save()
+                except (IntegrityError, VersionConflict):
+                    conflicts[student.id] = status
+        if not conflicts:
+            return redirect('attendance_report_date', class_id=class_id, date_str=attendance_date.isoformat())
+        
+        # Кто-то изменил эти строки после открытия формы: показываем актуальные значения
+        _roster_state(students, class_obj, attendance_date)
         for student in students:
-            status = request.POST.get(f'status_{student.id}', 'absent')
-            attendance, created = Attendance.objects.update_or_create(
-                student=student,
-                date=attendance_date,
-                class_enrolled=class_obj,
-                defaults={'status': status}
-            )
-        return redirect('attendance_report_date', class_id=class_id, date_str=attendance_date.isoformat())
+            if student.id in conflicts:
+                student.conflict_status = conflicts[student.id]
+        messages.warning(
+            request,
+            f'{len(conflicts)} record(s) were changed by someone else while you were editing. '
+            'Other changes were saved; check the highlighted rows and save again.',
+        )
     
     selected_group = None
     if teacher and group_id:
         selected_group = group
-    return render(request, 'attendance/mark_attendance.html', {
+    return templating.render(request, 'attendance/mark_attendance.html', {
         'class_obj': class_obj,
         'students': students,
         'attendance_date': attendance_date,
-        'existing_attendance': existing_attendance,
         'is_teacher': teacher is not None,
         'selected_group': selected_group,
         'group_id': group_id or '',
-    })
+    }, status=409 if request.method == 'POST' else 200)
 
 
 def attendance_report(request, class_id, date_str=None):
     if get_student(request):
         return redirect('my_attendance')
-    class_obj = get_object_or_404(Class, id=class_id)
+    class_obj = get_class_or_404(class_id)
     teacher = get_teacher(request)
     if teacher:
-        if class_obj not in teacher.classes.all():
+        teacher_class_ids, teacher_group_ids = refcache.teacher_scope(teacher)
+        if class_obj.id not in teacher_class_ids:
             messages.error(request, 'You do not have access to this subject.')
             return redirect('home')
-        teacher_group_ids = list(teacher.groups.values_list('id', flat=True))
     
     if date_str:
         try:
@@ -222,24 +369,27 @@ def attendance_report(request, class_id, date_str=None):
             report_date = date.today()
     
     if teacher:
-        attendances = Attendance.objects.filter(
+        attendances = storage.attendances().filter(
             class_enrolled=class_obj,
             date=report_date,
             student__group_id__in=teacher_group_ids
         ).select_related('student', 'student__group')
         total_students = class_obj.students.filter(group_id__in=teacher_group_ids).count()
     else:
-        attendances = Attendance.objects.filter(
+        attendances = storage.attendances().filter(
             class_enrolled=class_obj,
             date=report_date
         ).select_related('student')
         total_students = class_obj.students.count()
     
+    # курсор берём до чтения строк: изменения между ним и рендером придут повторно, а не потеряются.
+    # Без потока (WSGI отвечает 501) курсор не нужен — страница остаётся статичной
+    live_cursor = live.format_cursor(live.current_cursor()) if live.available(request) else None
     present_count = attendances.filter(status='present').count()
     absent_count = attendances.filter(status='absent').count()
     late_count = attendances.filter(status='late').count()
     
-    return render(request, 'attendance/report.html', {
+    return templating.render(request, 'attendance/report.html', {
         'class_obj': class_obj,
         'attendances': attendances,
         'report_date': report_date,
@@ -248,55 +398,169 @@ def attendance_report(request, class_id, date_str=None):
         'absent_count': absent_count,
         'late_count': late_count,
         'is_teacher': teacher is not None,
+        'live_cursor': live_cursor,
     })
 
 
+def _live_scope(request, class_id):
+    """Group ids the user may watch on the live report (None — all), or False if not allowed."""
+    if not request.user.is_authenticated or get_student(request):
+        return False
+    class_obj = get_class_or_404(class_id)
+    teacher = get_teacher(request)
+    if teacher:
+        teacher_class_ids, teacher_group_ids = refcache.teacher_scope(teacher)
+        return teacher_group_ids if class_obj.id in teacher_class_ids else False
+    return None if request.user.is_staff else False
+
+
+async def attendance_live(request, class_id, date_str):
+    """Server-sent events with the report rows of (class, date) that change; ASGI only."""
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse('Live updates need the ASGI server.', status=501, content_type='text/plain')
+    try:
+        report_date = date.fromisoformat(date_str)
+    except ValueError:
+        raise Http404('Invalid date.')
+    group_ids = await sync_to_async(_live_scope)(request, class_id)
+    if group_ids is False:
+        return HttpResponse(status=403)
+    since = live.parse_cursor(request.headers.get('Last-Event-ID') or request.GET.get('since'))
+    response = StreamingHttpResponse(
+        live.stream((class_id, report_date), group_ids, since, sharding.current()), content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx: не буферизовать поток
+    return response
+
+
+def _csv_or_job(request, class_id, kind):
+    """Range export/report: small ranges are streamed inline, large ones go to the job queue."""
+    if get_student(request):
+        return redirect('my_attendance')
+    class_obj = get_class_or_404(class_id)
+    teacher = get_teacher(request)
+    group_ids = None
+    if teacher:
+        teacher_class_ids, teacher_group_ids = refcache.teacher_scope(teacher)
+        if class_obj.id not in teacher_class_ids:
+            messages.error(request, 'You do not have access to this subject.')
+            return redirect('home')
+        group_ids = list(teacher_group_ids)
+    
+    try:
+        date_to = date.fromisoformat(request.GET.get('date_to', date.today().isoformat()))
+        date_from = date.fromisoformat(request.GET.get('date_from', (date_to - timedelta(days=30)).isoformat()))
+    except (ValueError, TypeError):
+        messages.error(request, 'Invalid date range. Use YYYY-MM-DD.')
+        return redirect('class_students', class_id=class_id)
+    if date_from > date_to:
+        date_from, date_to = date_to, date_from
+    
+    if (date_to - date_from).days + 1 > jobs.get_config()['INLINE_MAX_DAYS']:
+        job = jobs.enqueue(kind, {
+            'class_id': class_obj.id,
+            'date_from': date_from.isoformat(),
+            'date_to': date_to.isoformat(),
+            'group_ids': group_ids,
+        }, user=request.user)
+        return render(request, 'attendance/job_status.html', {
+            'class_obj': class_obj,
+            'job': job,
+            'is_teacher': teacher is not None,
+        }, status=202)
+    
+    writer = exports.write_export if kind == 'export' else exports.write_range_report
+    response = HttpResponse(content_type='text/csv')
+    response['Content-Disposition'] = (
+        f'attachment; filename="{kind}-{class_obj.code}-{date_from}-{date_to}.csv"'
+    )
+    writer(response, class_obj.id, date_from, date_to, group_ids)
+    return response
+
+
+@login_required
+def attendance_export(request, class_id):
+    """CSV of every record of the subject between ?date_from= and ?date_to=."""
+    return _csv_or_job(request, class_id, 'export')
+
+
+@login_required
+def attendance_range_report(request, class_id):
+    """CSV with per-student totals of the subject between ?date_from= and ?date_to=."""
+    return _csv_or_job(request, class_id, 'range_report')
+
+
+def attendance_summary(attendances):
+    """Present/absent/late/total counts in one aggregate query."""
+    return attendances.order_by().aggregate(
+        total=Count('id'),
+        present=Count('id', filter=Q(status='present')),
+        absent=Count('id', filter=Q(status='absent')),
+        late=Count('id', filter=Q(status='late')),
+    )
+
+
+def history_context(student):
+    """First page of the student's history; older pages are loaded through api_student_history."""
+    rows, next_cursor = history.page(history.history_queryset(student))
+    return {
+        'history_rows': rows,
+        'history_next_cursor': next_cursor,
+        'history_url': reverse('api_student_history', args=[student.id]),
+        'history_subjects': refcache.group_classes(student.group_id),
+    }
+
+
 def my_attendance(request):
     """Личный кабинет студента: моя посещаемость (только для пользователей с привязанной записью студента)."""
     student = get_student(request)
     if not student:
         messages.info(request, 'This page is for students. Log in with your student account.')
         return redirect('login')
-    attendances = Attendance.objects.filter(student=student).select_related('class_enrolled').order_by('-date')
-    present_count = attendances.filter(status='present').count()
-    absent_count = attendances.filter(status='absent').count()
-    late_count = attendances.filter(status='late').count()
-    total_records = attendances.count()
-    attendance_percent = round(100 * present_count / total_records, 1) if total_records else 0
-    # Статистика по каждому предмету отдельно
-    class_ids = attendances.values_list('class_enrolled_id', flat=True).distinct()
+    attendances = storage.attendances().filter(student=student)
+    totals = attendance_summary(attendances)
+    total_records = totals['total']
+    attendance_percent = round(100 * totals['present'] / total_records, 1) if total_records else 0
+    # Статистика по каждому предмету отдельно — одним GROUP BY
+    per_subject = attendances.order_by().values('class_enrolled_id').annotate(
+        total=Count('id'),
+        present=Count('id', filter=Q(status='present')),
+        absent=Count('id', filter=Q(status='absent')),
+        late=Count('id', filter=Q(status='late')),
+    )
+    classes = refcache.class_map()
     stats_by_subject = []
-    for cid in class_ids:
-        cls = Class.objects.get(id=cid)
-        recs = Attendance.objects.filter(student=student, class_enrolled=cls)
-        total = recs.count()
-        p = recs.filter(status='present').count()
-        a = recs.filter(status='absent').count()
-        l = recs.filter(status='late').count()
+    for row in per_subject:
+        class_obj = classes.get(row['class_enrolled_id'])
+        if class_obj is None:
+            continue  # предмет удалён только что, а справочник ещё старый
         stats_by_subject.append({
-            'class': cls,
-            'present': p,
-            'absent': a,
-            'late': l,
-            'total': total,
-            'percent': round(100 * p / total, 1) if total else 0,
+            'class': class_obj,
+            'present': row['present'],
+            'absent': row['absent'],
+            'late': row['late'],
+            'total': row['total'],
+            'percent': round(100 * row['present'] / row['total'], 1) if row['total'] else 0,
         })
-    first_class = student.group.classes.first()
-    return render(request, 'attendance/my_attendance.html', {
+    stats_by_subject.sort(key=lambda stat: stat['class'].name)
+    subjects = refcache.group_classes(student.group_id)
+    first_class = subjects[0] if subjects else None
+    return templating.render(request, 'attendance/my_attendance.html', {
         'student': student,
         'first_class': first_class,
-        'attendances': attendances,
-        'present_count': present_count,
-        'absent_count': absent_count,
-        'late_count': late_count,
+        'present_count': totals['present'],
+        'absent_count': totals['absent'],
+        'late_count': totals['late'],
         'total_records': total_records,
         'attendance_percent': attendance_percent,
         'stats_by_subject': stats_by_subject,
+        **history_context(student),
     })
 
 
 def student_detail(request, student_id):
-    student = get_object_or_404(Student.objects.select_related('group').prefetch_related('group__classes'), id=student_id)
+    student = get_object_or_404(Student.objects.select_related('group'), id=student_id)
     logged_student = get_student(request)
     teacher = get_teacher(request)
     # Студент может смотреть только свою карточку
@@ -305,26 +569,23 @@ def student_detail(request, student_id):
             messages.error(request, 'You can only view your own attendance.')
             return redirect('my_attendance')
     elif teacher:
-        if student.group not in teacher.groups.all():
+        if student.group_id not in refcache.teacher_scope(teacher)[1]:
             messages.error(request, 'You do not have access to this student.')
             return redirect('home')
     # Неавторизованный или админ — можно смотреть любого
-    attendances = Attendance.objects.filter(student=student).select_related('class_enrolled').order_by('-date')
+    totals = attendance_summary(storage.attendances().filter(student=student))
     
-    present_count = attendances.filter(status='present').count()
-    absent_count = attendances.filter(status='absent').count()
-    late_count = attendances.filter(status='late').count()
-    
-    first_class = student.group.classes.first()
+    subjects = refcache.group_classes(student.group_id)
+    first_class = subjects[0] if subjects else None
     is_own = bool(logged_student and student.id == logged_student.id)
     return render(request, 'attendance/student_detail.html', {
         'student': student,
         'first_class': first_class,
-        'attendances': attendances,
-        'present_count': present_count,
-        'absent_count': absent_count,
-        'late_count': late_count,
+        'present_count': totals['present'],
+        'absent_count': totals['absent'],
+        'late_count': totals['late'],
         'is_own': is_own,
+        **history_context(student),
     })
 
 
@@ -359,3 +620,13 @@ def register_teacher(request):
     else:
         form = TeacherRegistrationForm()
     return render(request, 'attendance/register_teacher.html', {'form': form})
+
+
+def readiness(request):
+    """Load balancer readiness probe: 200 only after this worker has been warmed up.
+
+    Under gunicorn ``post_fork`` has done that before the worker accepts
+    connections; under runserver or uvicorn the first probe does it.
+    """
+    warmup.ensure_ready()
+    return JsonResponse({'status': 'ready', **warmup.stats})
@@ -0,0 +1,79 @@
+"""Worker warm-up: import the views and compile every template before taking traffic.
+
+Called from the gunicorn ``post_fork`` hook (see gunicorn.conf.py). Servers
+without such a hook (runserver, uvicorn) warm up on the first readiness probe
+instead, see ``ensure_ready``. With the cached template loader the compiled
+templates stay in the worker for its whole life, so the first real requests
+don't pay for parsing.
+"""
+import importlib
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.template import engines
+from django.template.loader import get_template
+from django.urls import reverse
+
+from . import templating
+
+_ready = threading.Event()
+_lock = threading.Lock()
+stats = {}
+
+MODULES = [
+    'attendance.views',
+    'attendance.api_views',
+    'attendance.admin',
+]
+TEMPLATE_DIRS = ['attendance', 'components']
+EXTRA_TEMPLATES = ['base.html']
+
+
+def template_names():
+    root = Path(settings.BASE_DIR) / 'templates'
+    names = list(EXTRA_TEMPLATES)
+    for directory in TEMPLATE_DIRS:
+        names += sorted(
+            path.relative_to(root).as_posix() for path in (root / directory).glob('**/*.html')
+        )
+    return names
+
+
+def jinja2_template_names():
+    root = Path(settings.BASE_DIR) / 'jinja2'
+    return sorted(path.relative_to(root).as_posix() for path in root.glob('**/*.html'))
+
+
+def warm_up():
+    started = time.perf_counter()
+    for module in MODULES:
+        importlib.import_module(module)
+    # Первый reverse() строит словари URLconf для всего проекта — делаем это до запросов
+    reverse('home')
+    names = template_names()
+    for name in names:
+        get_template(name)
+    # Jinja2-окружение тоже держит скомпилированные шаблоны в своём кэше
+    jinja2_names = jinja2_template_names()
+    jinja2_engine = engines[templating.get_config()['ENGINE']]
+    for name in jinja2_names:
+        jinja2_engine.get_template(name)
+    stats.update({
+        'templates': len(names) + len(jinja2_names),
+        'seconds': round(time.perf_counter() - started, 4),
+    })
+    _ready.set()
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def ensure_ready():
+    """Warm up now unless a ``post_fork`` hook already did; concurrent probes wait for one run."""
+    if not _ready.is_set():
+        with _lock:
+            if not _ready.is_set():
+                warm_up()
@@ -2,6 +2,7 @@
 ASGI config for attendance_system project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The live report stream (attendance/live.py) is only served through it.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,10 +45,15 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'attendance.sharding.ShardMiddleware',
+    'attendance.throttling.WriteConcurrencyMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'attendance.audit.AuditMiddleware',
+    'attendance.slowlog.SlowQueryLogMiddleware',
+    'attendance.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -58,8 +64,29 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Compiled templates are kept for the life of the worker (see attendance/warmup.py)
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
+            'context_processors': [
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+                'attendance.context_processors.attendance_roles',
+            ],
+        },
+    },
+    {
+        # Jinja2-версии тяжёлых страниц (см. attendance/templating.py)
+        'NAME': 'jinja2',
+        'BACKEND': 'django.template.backends.jinja2.Jinja2',
+        'DIRS': [BASE_DIR / 'jinja2'],
+        'OPTIONS': {
+            'environment': 'attendance.templating.environment',
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
@@ -83,6 +110,33 @@ DATABASES = {
     }
 }
 
+# Institutions with their own database (attendance/sharding.py); 'default' holds everything else.
+# Each shard gets the full schema (manage.py run_on_shards migrate). HOSTS are routed to the shard,
+# as is a subdomain equal to its name. For local testing: ATTENDANCE_SHARDS=physics,math gives
+# shards/physics.sqlite3 on physics.localhost and shards/math.sqlite3 on math.localhost.
+ATTENDANCE_SHARDS = {
+    name: {'NAME': BASE_DIR / 'shards' / f'{name}.sqlite3', 'HOSTS': [f'{name}.localhost']}
+    for name in filter(None, os.environ.get('ATTENDANCE_SHARDS', '').split(','))
+}
+for _name, _shard in ATTENDANCE_SHARDS.items():
+    DATABASES[_name] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        **{key: value for key, value in _shard.items() if key != 'HOSTS'},
+    }
+
+DATABASE_ROUTERS = ['attendance.sharding.ShardRouter']
+
+# The same ids mean different rows on different shards, so cache keys carry the shard.
+# LocMemCache is per process: in production use a cache shared by the workers, e.g.
+#     'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379',
+# (manage.py check warns about ATTENDANCE_REFCACHE on LocMemCache, attendance.W001)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'KEY_FUNCTION': 'attendance.sharding.make_cache_key',
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -119,6 +173,9 @@ LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'home'
 
+# Форма отметки посещаемости шлёт три поля на студента (status/original/version)
+DATA_UPLOAD_MAX_NUMBER_FIELDS = 10000
+
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
@@ -130,6 +187,124 @@ STATICFILES_DIRS = [
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# Transactional outbox for downstream attendance events (manage.py dispatch_outbox)
+ATTENDANCE_OUTBOX = {
+    'SINKS': [
+        {'type': 'file', 'path': BASE_DIR / 'outbox_events.jsonl'},
+        # {'type': 'http', 'url': 'http://localhost:9000/attendance-events', 'timeout': 5},
+    ],
+    'BATCH_SIZE': 100,
+    'MAX_ATTEMPTS': 10,
+    'BACKOFF_BASE': 2,  # seconds, doubled per failed attempt
+    'BACKOFF_MAX': 300,
+}
+
+# Background jobs (manage.py run_workers). Ranges longer than INLINE_MAX_DAYS are
+# exported through the job queue instead of inside the request.
+ATTENDANCE_JOBS = {
+    'RESULTS_DIR': BASE_DIR / 'media' / 'jobs',
+    'INLINE_MAX_DAYS': 31,
+    'PROCESSES': 2,
+    'POLL_INTERVAL': 1.0,
+    'LEASE_TIMEOUT': 120,  # seconds without a heartbeat before a running job is taken back
+    'MAX_ATTEMPTS': 3,
+    'RESULT_TTL': 7 * 24 * 3600,  # seconds; purge_attendance deletes older result files
+}
+
+# Slow-query log (manage.py slowlog_report). Off by default; statements slower than
+# THRESHOLD_MS are appended to a rotating JSONL file with the view that issued them.
+ATTENDANCE_SLOWLOG = {
+    'ENABLED': False,
+    'THRESHOLD_MS': 100,
+    'PATH': BASE_DIR / 'slow_queries.jsonl',
+    'MAX_BYTES': 10 * 1024 * 1024,
+    'BACKUP_COUNT': 5,
+    'STACK_DEPTH': 6,
+}
+
+# Staff-only request profiling: add ?_profile=1 or an "X-Profile: 1" header to any URL
+ATTENDANCE_PROFILING = {
+    'ENABLED': True,
+    'PROFILE_DIR': BASE_DIR / 'profiles',
+    'TOP': 30,
+}
+
+# API rate limits: token buckets per client and per client+endpoint (429 + Retry-After),
+# plus a per-process cap on concurrent API writes (503). Counters: GET /api/throttle/stats/ (staff)
+REST_FRAMEWORK = {
+    'DEFAULT_THROTTLE_CLASSES': [
+        'attendance.throttling.ClientRateThrottle',
+        'attendance.throttling.EndpointRateThrottle',
+    ],
+}
+
+ATTENDANCE_THROTTLE = {
+    'ENABLED': True,
+    'CLIENT_RATE': '600/min',
+    'ENDPOINT_RATE': '120/min',
+    'ENDPOINT_RATES': {
+        'api_mark_attendance': '60/min',
+        'api_jobs': '10/min',
+        'api_checkin': '10/min',
+    },
+    'MAX_CONCURRENT_WRITES': 8,
+    'SHED_RETRY_AFTER': 2,
+}
+
+# Classes, groups and teacher assignments: in-process LRU in front of the Django cache,
+# invalidated by signals through a version number in the database. Counters: GET /api/refcache/stats/ (staff)
+ATTENDANCE_REFCACHE = {
+    'LOCAL_MAX_ENTRIES': 256,
+    'VERSION_CHECK_INTERVAL': 2.0,  # seconds between version reads: other processes see an invalidation within it
+    'TIMEOUT': 24 * 3600,
+}
+
+# Idempotency-Key header on attendance write APIs: stored responses are replayed for TTL seconds
+ATTENDANCE_IDEMPOTENCY = {
+    'TTL': 24 * 3600,
+    'WAIT_TIMEOUT': 10,  # seconds a duplicate waits for the first request to finish
+    'PENDING_TIMEOUT': 60,
+}
+
+# Deleted classes/groups/students are only marked; manage.py purge_attendance removes their
+# attendance in batches. YEARS: also purge attendance older than that many years (None = keep all).
+ATTENDANCE_RETENTION = {
+    'YEARS': None,
+    'BATCH_SIZE': 1000,
+    'PAUSE': 0.5,  # seconds between batches, lets other writers take the SQLite lock
+}
+
+# QR self check-in: token lifetime and the write buffer flushed in batches (attendance/checkin.py)
+ATTENDANCE_CHECKIN = {
+    'TOKEN_TTL': 90,
+    'FLUSH_INTERVAL': 0.3,
+    'MAX_BATCH': 500,
+}
+
+# Views rendered with the Jinja2 engine (templates under jinja2/); the rest use Django templates
+ATTENDANCE_TEMPLATES = {
+    'JINJA2_VIEWS': ['mark_attendance', 'attendance_report', 'my_attendance'],
+}
+
+# Delta feed (attendance/changefeed.py): the cursor stays behind changes younger than
+# SAFETY_WINDOW seconds, which must be longer than any write transaction
+ATTENDANCE_CHANGEFEED = {
+    'SAFETY_WINDOW': 30,
+}
+
+# Live report over server-sent events (attendance/live.py): one poll of the change feed per process
+ATTENDANCE_LIVE = {
+    'POLL_INTERVAL': 1.0,
+    'KEEPALIVE': 15,
+}
+
+# Attendance storage: 'full' stores every mark; 'exceptions' stores one session per lesson and
+# only the marks that differ from DEFAULT_STATUS (attendance/storage.py, convert_attendance_storage)
+ATTENDANCE_STORAGE = {
+    'MODE': 'full',
+    'DEFAULT_STATUS': 'present',
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
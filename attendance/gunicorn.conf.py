@@ -0,0 +1,33 @@
+"""Gunicorn production profile (loaded automatically from the working directory).
+
+Settings can be tuned per environment with WEB_CONCURRENCY, GUNICORN_THREADS and PORT.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# gthread: a few processes with several threads each. Most of a request is spent
+# waiting on the database, so threads are cheaper than extra processes.
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Import Django once in the master, workers are forked with it already loaded
+preload_app = True
+
+# Recycle workers periodically; jitter keeps them from restarting all at once
+max_requests = 1000
+max_requests_jitter = 100
+
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    from attendance.warmup import warm_up, stats
+    warm_up()
+    server.log.info('Worker %s warmed up: %s templates in %ss', worker.pid, stats['templates'], stats['seconds'])